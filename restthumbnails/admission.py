@@ -0,0 +1,128 @@
+from restthumbnails import exceptions
+
+import errno
+import fcntl
+import os
+import threading
+import time
+
+
+def check_pixels(image, max_pixels):
+    """
+    Raise SourceTooLarge if an opened image has more than `max_pixels` pixels
+    at the size it's going to be decoded at.
+    """
+    width, height = image.size
+    if max_pixels and width * height > max_pixels:
+        raise exceptions.SourceTooLarge(
+            "%dx%d is more than %d pixels." % (width, height, max_pixels))
+
+
+class MemoryBudget(object):
+    """
+    A semaphore weighted by the bytes needed to decode sources, so the
+    threads of a process never decode more than `size` bytes at once.
+    Sources larger than the whole budget are decoded alone.
+
+    >>> budget = MemoryBudget(512 * 1024 * 1024, timeout=30)
+    >>> reservation = budget.acquire(48 * 1024 * 1024)
+    >>> budget.release(reservation)
+
+    """
+    poll_interval = 0.05
+
+    def __init__(self, size, timeout=None):
+        self.size = size
+        self.timeout = timeout
+        self.used = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, weight):
+        """
+        Wait until `weight` bytes are available. Return a reservation to
+        pass to `release`, or None if none was made within `timeout`
+        seconds.
+        """
+        weight = min(weight, self.size)
+        deadline = None if self.timeout is None else time.time() + self.timeout
+        with self.condition:
+            while True:
+                reservation = self._acquire(weight)
+                if reservation is not None:
+                    return reservation
+                interval = self.poll_interval
+                if deadline is not None:
+                    interval = min(interval, deadline - time.time())
+                    if interval <= 0:
+                        return None
+                # Wake up now and then, as other processes don't notify us
+                self.condition.wait(interval)
+
+    def release(self, reservation):
+        with self.condition:
+            self._release(reservation)
+            self.condition.notify_all()
+
+    def _acquire(self, weight):
+        if self.used and self.used + weight > self.size:
+            return None
+        self.used += weight
+        return weight
+
+    def _release(self, reservation):
+        self.used -= reservation
+
+
+class SharedMemoryBudget(MemoryBudget):
+    """
+    A MemoryBudget shared by all processes on a host, e.g. the workers of the
+    render executor. The budget is split in units of `unit` bytes, each one
+    a byte of the file at `path`, locked with `lockf` while it's reserved.
+    Locks are dropped by the system when a process dies.
+    """
+    def __init__(self, size, path, timeout=None, unit=16 * 1024 * 1024):
+        super(SharedMemoryBudget, self).__init__(size, timeout)
+        self.path = path
+        self.unit = unit
+        self.units = max(size // unit, 1)
+        self.pid = None
+        self.fd = None
+        self.held = set()
+
+    def _open(self):
+        # Locks aren't inherited by forked processes
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0666)
+            self.held = set()
+        return self.fd
+
+    def _acquire(self, weight):
+        fd = self._open()
+        needed = max(min(-(-weight // self.unit), self.units), 1)
+        taken = []
+        # Locks are owned by the process, so skip the units reserved by
+        # other threads
+        for offset in range(self.units):
+            if offset in self.held:
+                continue
+            try:
+                fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, offset)
+            except IOError, e:
+                if e.errno not in (errno.EACCES, errno.EAGAIN):
+                    raise
+                continue
+            taken.append(offset)
+            if len(taken) == needed:
+                self.held.update(taken)
+                return taken
+        for offset in taken:
+            fcntl.lockf(fd, fcntl.LOCK_UN, 1, offset)
+        return None
+
+    def _release(self, reservation):
+        if self.pid != os.getpid():
+            return
+        for offset in reservation:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, offset)
+            self.held.discard(offset)
@@ -8,8 +8,13 @@ class ThumbnailBase(object):
     """
     Abstract class used both by ThumbnailFile and ThumbnailProxy instances
     """
+    __slots__ = (
+        'source', 'file_signature', 'size', 'method', 'extension', 'format',
+        '_size_string', '_secret', '_key')
+
     def __init__(self, source, size, method, extension, **kwargs):
         from restthumbnails import defaults
+        self._size_string = self._secret = self._key = None
         # FieldFile/ImageFieldFile instances have a `name` attribute
         # with the relative file path
         self.source = getattr(source, 'name', source)
@@ -17,17 +22,34 @@ class ThumbnailBase(object):
         self.size = helpers.parse_size(size)
         self.method = helpers.parse_method(method)
         self.extension = extension
+        # The format is given by the extension, unless another one was
+        # negotiated with the client
+        self.format = kwargs.get('format') or helpers.parse_extension(extension)
+
+    # Derived values are computed once, as they are accessed many times
+    # while generating or rendering a thumbnail.
 
     @property
     def size_string(self):
-        return u'x'.join(map(str, self.size))
+        if self._size_string is None:
+            self._size_string = u'x'.join(map(str, self.size))
+        return self._size_string
 
     @property
     def secret(self):
-        return helpers.get_secret(
-            self.source, self.size_string, self.method, self.extension)
+        if self._secret is None:
+            self._secret = helpers.get_secret(
+                self.source, self.size_string, self.method, self.extension)
+        return self._secret
+
+    @property
+    def shard(self):
+        return helpers.get_shard(self.secret)
 
     @property
     def key(self):
-        return helpers.get_key(
-            self.source, self.size_string, self.method, self.extension)
+        if self._key is None:
+            self._key = helpers.get_key(
+                self.source, self.size_string, self.method, self.extension,
+                secret=self.secret)
+        return self._key
@@ -1,18 +1,56 @@
 from django.conf import settings
 from django.core.files.storage import get_storage_class
 from django.utils.importlib import import_module
+try:
+    from django.core.signals import setting_changed
+except ImportError:
+    from django.test.signals import setting_changed
+
+from functools import wraps
 
 import os
+import threading
 
 def import_from_path(cls_path):
     package, name = cls_path.rsplit('.', 1)
     return getattr(import_module(package), name)
 
 
+_memoized = {}
+_memoized_lock = threading.Lock()
+
+def memoize(func):
+    """
+    Cache the result of a function for the lifetime of the process, so
+    classes are imported and storage backends are built only once. The cache
+    is cleared when settings are changed (e.g., by `override_settings`).
+    """
+    @wraps(func)
+    def wrapper():
+        try:
+            return _memoized[func]
+        except KeyError:
+            with _memoized_lock:
+                if func not in _memoized:
+                    _memoized[func] = func()
+                return _memoized[func]
+    return wrapper
+
+def clear_memoized(setting, **kwargs):
+    if setting.startswith('THUMBNAILS_') or setting == 'MEDIA_ROOT':
+        _memoized.clear()
+
+setting_changed.connect(clear_memoized)
+
+
 # Common configuration
 
 DEFAULT_FILE_SIGNATURE = '%(source)s/%(size)s/%(method)s/%(secret)s%(extension)s'
 
+# Spreads thumbnails over directories named after the first digits of their
+# secret, instead of mirroring the source tree
+SHARDED_FILE_SIGNATURE = '%(shard)s/' + DEFAULT_FILE_SIGNATURE
+
 FILE_SIGNATURE = getattr(settings,
     'THUMBNAILS_FILE_SIGNATURE',
     DEFAULT_FILE_SIGNATURE)
@@ -23,6 +61,14 @@ THUMBNAIL_PROXY_BASE_URL = getattr(settings,
     'THUMBNAILS_PROXY_BASE_URL',
     '/thumbnails/')
 
+# Widths (or heights, whichever is larger) thumbnail sizes are rounded up to,
+# so slightly different sizes share the same files. Also checked by the view
+# when THUMBNAILS_SIZE_LADDER_POLICY is set.
+SIZE_LADDER = getattr(settings,
+    'THUMBNAILS_SIZE_LADDER',
+    None)
+
+@memoize
 def thumbnail_proxy():
     THUMBNAIL_PROXY = getattr(settings,
         'THUMBNAILS_PROXY',
@@ -32,13 +78,21 @@ def thumbnail_proxy():
 
 # Server configuration
 
-DEFAULT_REGEX = r'^%s$' % (FILE_SIGNATURE % {
-    'source': r'(?P<source>.+)',
-    'size': r'(?P<size>.+)',
-    'method': r'(?P<method>.+)',
-    'secret': r'(?P<secret>.+)',
-    'extension': r'(?P<extension>\..+)',
-})
+def signature_regex(signature):
+    """
+    Return a regular expression matching the URLs built from a file
+    signature.
+    """
+    return r'^%s$' % (signature % {
+        'shard': r'(?P<shard>[0-9a-f]{2}(?:/[0-9a-f]{2})*)',
+        'source': r'(?P<source>.+)',
+        'size': r'(?P<size>.+)',
+        'method': r'(?P<method>.+)',
+        'secret': r'(?P<secret>.+)',
+        'extension': r'(?P<extension>\..+)',
+    })
+
+DEFAULT_REGEX = signature_regex(FILE_SIGNATURE)
 
 URL_REGEX = getattr(settings,
     'THUMBNAILS_URL_REGEX',
@@ -48,10 +102,125 @@ LOCK_TIMEOUT = getattr(settings,
     'THUMBNAILS_LOCK_TIMEOUT',
     10)
 
+LOCK_WAIT = getattr(settings,
+    'THUMBNAILS_LOCK_WAIT',
+    5)
+
+LOCK_POLL_INTERVAL = getattr(settings,
+    'THUMBNAILS_LOCK_POLL_INTERVAL',
+    0.05)
+
+LOCK_POLL_BACKOFF = getattr(settings,
+    'THUMBNAILS_LOCK_POLL_BACKOFF',
+    2)
+
+LOCK_POLL_MAX_INTERVAL = getattr(settings,
+    'THUMBNAILS_LOCK_POLL_MAX_INTERVAL',
+    1)
+
+RENDER_WORKERS = getattr(settings,
+    'THUMBNAILS_RENDER_WORKERS',
+    None)
+
+RENDER_QUEUE_SIZE = getattr(settings,
+    'THUMBNAILS_RENDER_QUEUE_SIZE',
+    16)
+
+RENDER_TIMEOUT = getattr(settings,
+    'THUMBNAILS_RENDER_TIMEOUT',
+    LOCK_TIMEOUT)
+
+# Seconds after which a queued job still running is assumed to belong to a
+# crashed worker, and is queued again
+RENDER_QUEUE_STALE_AFTER = getattr(settings,
+    'THUMBNAILS_RENDER_QUEUE_STALE_AFTER',
+    60)
+
+# Either 'strict', to always take jobs from the most urgent priority class
+# first, or 'weighted', to share workers between classes by weight
+RENDER_QUEUE_SCHEDULING = getattr(settings,
+    'THUMBNAILS_RENDER_QUEUE_SCHEDULING',
+    'strict')
+
+RENDER_QUEUE_WEIGHTS = getattr(settings,
+    'THUMBNAILS_RENDER_QUEUE_WEIGHTS',
+    {'interactive': 8, 'prefetch': 2, 'batch': 1})
+
+RENDER_QUEUE_MAX_AGE = getattr(settings,
+    'THUMBNAILS_RENDER_QUEUE_MAX_AGE',
+    60)
+
+RENDER_QUEUE_CONCURRENCY = getattr(settings,
+    'THUMBNAILS_RENDER_QUEUE_CONCURRENCY',
+    {})
+
+RETRY_AFTER = getattr(settings,
+    'THUMBNAILS_RETRY_AFTER',
+    1)
+
+ENCODER_OPTIONS = getattr(settings,
+    'THUMBNAILS_ENCODER_OPTIONS',
+    {})
+
+NEGOTIATE_FORMATS = getattr(settings,
+    'THUMBNAILS_NEGOTIATE_FORMATS',
+    ())
+
+SMART_CROP_PROXY_SIZE = getattr(settings,
+    'THUMBNAILS_SMART_CROP_PROXY_SIZE',
+    None)
+
+REDUCING_GAP = getattr(settings,
+    'THUMBNAILS_REDUCING_GAP',
+    None)
+
+# Sources with more pixels, at the size they're decoded at, are not
+# rendered
+MAX_PIXELS = getattr(settings,
+    'THUMBNAILS_MAX_PIXELS',
+    100 * 1000 * 1000)
+
+# Longest side of the placeholder images kept in the source index, or None
+# to not make any
+PLACEHOLDER_SIZE = getattr(settings,
+    'THUMBNAILS_PLACEHOLDER_SIZE',
+    20)
+
+# What the view does with sizes that aren't on the ladder: None to render
+# them anyway, 'reject' or 'redirect' to the nearest size on the ladder
+SIZE_LADDER_POLICY = getattr(settings,
+    'THUMBNAILS_SIZE_LADDER_POLICY',
+    None)
+
+ERROR_CACHE_TIMEOUT = getattr(settings,
+    'THUMBNAILS_ERROR_CACHE_TIMEOUT',
+    60 * 60)
+
+MISSING_CACHE_TIMEOUT = getattr(settings,
+    'THUMBNAILS_MISSING_CACHE_TIMEOUT',
+    60 * 5)
+
+ASSUME_MISSING = getattr(settings,
+    'THUMBNAILS_ASSUME_MISSING',
+    False)
+
+ACCESS_LOG = getattr(settings,
+    'THUMBNAILS_ACCESS_LOG',
+    None)
+
+EVICTION_MAX_BYTES = getattr(settings,
+    'THUMBNAILS_EVICTION_MAX_BYTES',
+    None)
+
+EVICTION_MAX_FILES = getattr(settings,
+    'THUMBNAILS_EVICTION_MAX_FILES',
+    None)
+
 KEY_PREFIX = getattr(settings,
     'THUMBNAILS_KEY_PREFIX',
     'restthumbnails')
 
+@memoize
 def thumbnail_file():
     THUMBNAIL_FILE = getattr(settings,
         'THUMBNAILS_FILE',
@@ -59,6 +228,95 @@ def thumbnail_file():
 
     return import_from_path(THUMBNAIL_FILE)
 
+@memoize
+def lock_backend():
+    LOCK_BACKEND = getattr(settings,
+        'THUMBNAILS_LOCK_BACKEND',
+        'restthumbnails.locks.CacheLock')
+
+    return import_from_path(LOCK_BACKEND)
+
+_render_executors = {}
+
+def render_executor():
+    RENDER_EXECUTOR = getattr(settings,
+        'THUMBNAILS_RENDER_EXECUTOR',
+        'restthumbnails.executors.DefaultExecutor')
+
+    # Executors own worker processes, so keep one instance per process even
+    # when settings change
+    with _memoized_lock:
+        if RENDER_EXECUTOR not in _render_executors:
+            _render_executors[RENDER_EXECUTOR] = import_from_path(RENDER_EXECUTOR)(
+                max_workers=RENDER_WORKERS,
+                max_queue=RENDER_QUEUE_SIZE,
+                timeout=RENDER_TIMEOUT)
+        return _render_executors[RENDER_EXECUTOR]
+
+@memoize
+def render_queue():
+    RENDER_QUEUE = getattr(settings,
+        'THUMBNAILS_RENDER_QUEUE',
+        'restthumbnails.queues.DatabaseQueue')
+
+    RENDER_QUEUE_LOCATION = getattr(settings,
+        'THUMBNAILS_RENDER_QUEUE_LOCATION',
+        os.path.join(settings.MEDIA_ROOT, '..', 'thumbnails-queue'))
+
+    return import_from_path(RENDER_QUEUE)(
+        location=RENDER_QUEUE_LOCATION,
+        stale_after=RENDER_QUEUE_STALE_AFTER,
+        scheduling=RENDER_QUEUE_SCHEDULING,
+        weights=RENDER_QUEUE_WEIGHTS,
+        max_age=RENDER_QUEUE_MAX_AGE,
+        concurrency=RENDER_QUEUE_CONCURRENCY)
+
+@memoize
+def source_index():
+    SOURCE_INDEX = getattr(settings,
+        'THUMBNAILS_SOURCE_INDEX',
+        None)
+
+    if not SOURCE_INDEX:
+        return None
+    from restthumbnails.index import SourceIndex
+    return SourceIndex(SOURCE_INDEX)
+
+@memoize
+def decode_budget():
+    DECODE_MEMORY = getattr(settings,
+        'THUMBNAILS_DECODE_MEMORY',
+        None)
+
+    DECODE_MEMORY_LOCK = getattr(settings,
+        'THUMBNAILS_DECODE_MEMORY_LOCK',
+        None)
+
+    DECODE_MEMORY_TIMEOUT = getattr(settings,
+        'THUMBNAILS_DECODE_MEMORY_TIMEOUT',
+        30)
+
+    if not DECODE_MEMORY:
+        return None
+    from restthumbnails.admission import MemoryBudget, SharedMemoryBudget
+    if DECODE_MEMORY_LOCK:
+        return SharedMemoryBudget(DECODE_MEMORY, DECODE_MEMORY_LOCK,
+            timeout=DECODE_MEMORY_TIMEOUT)
+    return MemoryBudget(DECODE_MEMORY, timeout=DECODE_MEMORY_TIMEOUT)
+
+@memoize
+def metrics_sink():
+    METRICS_SINK = getattr(settings,
+        'THUMBNAILS_METRICS_SINK',
+        'restthumbnails.metrics.NullSink')
+
+    METRICS_OPTIONS = getattr(settings,
+        'THUMBNAILS_METRICS_OPTIONS',
+        {})
+
+    return import_from_path(METRICS_SINK)(**METRICS_OPTIONS)
+
+@memoize
 def response_backend():
     RESPONSE_BACKEND = getattr(settings,
         'THUMBNAILS_RESPONSE_BACKEND',
@@ -66,8 +324,30 @@ def response_backend():
 
     return import_from_path(RESPONSE_BACKEND)
 
+# Seconds clients and proxies keep thumbnails served by the direct response
+# backend
+DIRECT_MAX_AGE = getattr(settings,
+    'THUMBNAILS_DIRECT_MAX_AGE',
+    60 * 60 * 24 * 365)
+
+@memoize
+def direct_cache():
+    DIRECT_CACHE_SIZE = getattr(settings,
+        'THUMBNAILS_DIRECT_CACHE_SIZE',
+        32 * 1024 * 1024)
+
+    DIRECT_CACHE_MAX_FILE_SIZE = getattr(settings,
+        'THUMBNAILS_DIRECT_CACHE_MAX_FILE_SIZE',
+        256 * 1024)
+
+    if not DIRECT_CACHE_SIZE:
+        return None
+    from restthumbnails.responses.direct import LRUCache
+    return LRUCache(DIRECT_CACHE_SIZE, DIRECT_CACHE_MAX_FILE_SIZE)
+
 # Storage backends
 
+@memoize
 def source_storage_backend():
     SOURCE_STORAGE_BACKEND = getattr(settings,
         'THUMBNAILS_SOURCE_STORAGE_BACKEND',
@@ -77,14 +357,23 @@ def source_storage_backend():
         'THUMBNAILS_SOURCE_ROOT',
         settings.MEDIA_ROOT)
 
-    return get_storage_class(SOURCE_STORAGE_BACKEND)(
+    SOURCE_METADATA_TIMEOUT = getattr(settings,
+        'THUMBNAILS_SOURCE_METADATA_TIMEOUT',
+        10)
+
+    storage = get_storage_class(SOURCE_STORAGE_BACKEND)(
         location=SOURCE_STORAGE_LOCATION)
+    if SOURCE_METADATA_TIMEOUT:
+        from restthumbnails.storage import CachedMetadataStorage
+        storage = CachedMetadataStorage(storage, SOURCE_METADATA_TIMEOUT)
+    return storage
 
 
+@memoize
 def storage_backend():
     STORAGE_BACKEND = getattr(settings,
         'THUMBNAILS_STORAGE_BACKEND',
-        'django.core.files.storage.FileSystemStorage')
+        'restthumbnails.storage.ThumbnailStorage')
 
     STORAGE_LOCATION = getattr(settings,
         'THUMBNAILS_STORAGE_ROOT',
@@ -0,0 +1,173 @@
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+from multiprocessing import Pool
+
+import errno
+import os
+import stat
+import time
+
+
+# Files written or used by the storage and locks, which are not thumbnails
+IGNORED_SUFFIXES = ('.tmp', '.lock')
+
+
+def _scan(path):
+    """
+    Return a list of ``(atime, size, path)`` tuples for all thumbnails under
+    a directory, using scandir when available.
+    """
+    entries = []
+    directories = [path]
+    while directories:
+        directory = directories.pop()
+        try:
+            if scandir is not None:
+                children = [(entry.path, entry) for entry in scandir(directory)]
+            else:
+                children = [(os.path.join(directory, name), None)
+                            for name in os.listdir(directory)]
+        except OSError, e:
+            # Files and directories can vanish while being scanned
+            if e.errno != errno.ENOENT:
+                raise
+            continue
+        for child, entry in children:
+            try:
+                if entry is not None:
+                    st = entry.stat(follow_symlinks=False)
+                else:
+                    st = os.lstat(child)
+            except OSError, e:
+                if e.errno != errno.ENOENT:
+                    raise
+                continue
+            if stat.S_ISDIR(st.st_mode):
+                directories.append(child)
+            elif stat.S_ISREG(st.st_mode) and not child.endswith(
+                    IGNORED_SUFFIXES):
+                entries.append((st.st_atime, st.st_size, child))
+    return entries
+
+
+def scan(root, workers=None):
+    """
+    Return a list of ``(atime, size, path)`` tuples for all thumbnails under
+    `root`. Top level directories are scanned in parallel by `workers`
+    processes (the number of CPUs by default), or sequentially if `workers`
+    is 1.
+    """
+    try:
+        names = os.listdir(root)
+    except OSError, e:
+        if e.errno != errno.ENOENT:
+            raise
+        return []
+    directories = []
+    entries = []
+    for name in names:
+        path = os.path.join(root, name)
+        st = os.lstat(path)
+        if stat.S_ISDIR(st.st_mode):
+            directories.append(path)
+        elif stat.S_ISREG(st.st_mode) and not name.endswith(IGNORED_SUFFIXES):
+            entries.append((st.st_atime, st.st_size, path))
+    if workers == 1 or len(directories) < 2:
+        for directory in directories:
+            entries.extend(_scan(directory))
+        return entries
+    pool = Pool(workers)
+    try:
+        for result in pool.imap_unordered(_scan, directories):
+            entries.extend(result)
+    except:
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+        pool.join()
+    return entries
+
+
+def log_access(log, name):
+    """
+    Record that the thumbnail with the given name was served. Each access is
+    appended to the log as a single line, which is atomic for concurrent
+    writers.
+    """
+    fd = os.open(log, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0666)
+    try:
+        os.write(fd, '%d %s\n' % (time.time(), name.encode('utf-8')))
+    finally:
+        os.close(fd)
+
+
+def apply_access_log(log, storage):
+    """
+    Set the access time of the thumbnails found in the access log, so it
+    works on filesystems mounted with `noatime`, then empty the log. Return
+    the number of files updated.
+    """
+    # Rename the log before reading it, so accesses logged in the meantime
+    # go to a new file.
+    processing = '%s.%d' % (log, os.getpid())
+    try:
+        os.rename(log, processing)
+    except OSError, e:
+        if e.errno != errno.ENOENT:
+            raise
+        return 0
+    accessed = {}
+    try:
+        with open(processing) as lines:
+            for line in lines:
+                try:
+                    timestamp, name = line.rstrip('\n').split(' ', 1)
+                    timestamp = int(timestamp)
+                except ValueError:
+                    continue
+                accessed[name] = max(accessed.get(name, 0), timestamp)
+    finally:
+        os.unlink(processing)
+    updated = 0
+    for name, timestamp in accessed.iteritems():
+        path = storage.path(name.decode('utf-8'))
+        try:
+            st = os.stat(path)
+            if st.st_atime < timestamp:
+                os.utime(path, (timestamp, st.st_mtime))
+            updated += 1
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+    return updated
+
+
+def evict(entries, max_bytes=None, max_files=None, dry_run=False):
+    """
+    Delete the least recently used thumbnails until there are at most
+    `max_bytes` bytes and `max_files` files left, and return the number of
+    files and bytes deleted.
+    """
+    total_bytes = sum(size for atime, size, path in entries)
+    total_files = len(entries)
+    deleted_files = deleted_bytes = 0
+    for atime, size, path in sorted(entries):
+        if ((max_bytes is None or total_bytes - deleted_bytes <= max_bytes) and
+                (max_files is None or total_files - deleted_files <= max_files)):
+            break
+        if not dry_run:
+            try:
+                os.unlink(path)
+            except OSError, e:
+                if e.errno != errno.ENOENT:
+                    raise
+        deleted_files += 1
+        deleted_bytes += size
+    return deleted_files, deleted_bytes
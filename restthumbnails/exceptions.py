@@ -10,9 +10,33 @@ class InvalidMethodError(ThumbnailError):
     pass
 
 
+class InvalidExtensionError(ThumbnailError):
+    pass
+
+
 class InvalidSecretError(ThumbnailError):
     status = 401
 
 
 class SourceDoesNotExist(ThumbnailError):
     status = 404
+
+
+class SourceTooLarge(ThumbnailError):
+    status = 422
+
+
+class RenderFailed(ThumbnailError):
+    status = 500
+
+
+class RenderUnavailable(ThumbnailError):
+    status = 503
+
+
+class RenderQueueFull(RenderUnavailable):
+    pass
+
+
+class RenderTimeout(RenderUnavailable):
+    pass
@@ -0,0 +1,230 @@
+try:
+    from concurrent import futures
+except ImportError:
+    futures = None
+
+from django.core.exceptions import ImproperlyConfigured
+
+from restthumbnails import exceptions
+
+import threading
+import time
+
+
+def render(source, size, method, extension, format=None):
+    """
+    Generate a thumbnail. This is what runs on the executor workers, so it
+    only takes plain arguments that can be sent to another process.
+    """
+    from restthumbnails import defaults
+    thumbnail = defaults.thumbnail_file()(
+        source=source,
+        size=size,
+        method=method,
+        extension=extension,
+        format=format)
+    return thumbnail.generate()
+
+
+class RenderExecutorBase(object):
+    """
+    Abstract class for executors responsible for generating thumbnails on
+    behalf of the view.
+    """
+    def __init__(self, max_workers=None, max_queue=0, timeout=None):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+
+    def render(self, thumbnail):
+        """
+        Generate the thumbnail and return the result of `generate`. Raise
+        RenderQueueFull if there's no room for another job, or RenderTimeout
+        if the job doesn't finish within `timeout` seconds.
+        """
+        raise NotImplementedError
+
+    def shutdown(self, wait=True):
+        pass
+
+
+class InlineExecutor(RenderExecutorBase):
+    """
+    Generate thumbnails on the same thread handling the request.
+    """
+    def render(self, thumbnail):
+        return thumbnail.generate()
+
+
+class ProcessPoolExecutor(RenderExecutorBase):
+    """
+    Generate thumbnails on a pool of worker processes, so image processing
+    doesn't hold the GIL of the process handling requests. At most
+    `max_workers` jobs run at once, and at most `max_queue` jobs wait for a
+    free worker. Requests for a thumbnail that is still being generated,
+    e.g. retries after a timeout, wait for the same job. Requests check
+    every `poll_interval` seconds whether a worker died while they wait.
+    """
+    poll_interval = 1.0
+
+    def __init__(self, *args, **kwargs):
+        if futures is None:
+            raise ImproperlyConfigured(
+                "ProcessPoolExecutor requires the 'futures' package on "
+                "Python 2.")
+        super(ProcessPoolExecutor, self).__init__(*args, **kwargs)
+        self.pool = futures.ProcessPoolExecutor(self.max_workers)
+        self.slots = threading.BoundedSemaphore(
+            self.pool._max_workers + self.max_queue)
+        self.running = {}
+        self.mutex = threading.Lock()
+
+    def submit(self, thumbnail):
+        """
+        Return the future of the job generating the thumbnail, submitting
+        one unless it's already running.
+        """
+        key = thumbnail.key
+        with self.mutex:
+            future = self.running.get(key)
+            if future is not None:
+                return future
+            if not self.slots.acquire(False):
+                raise exceptions.RenderQueueFull(
+                    "Render queue is full, can't generate '%s'." % key)
+            try:
+                future = self.pool.submit(render,
+                    thumbnail.source,
+                    thumbnail.size_string,
+                    thumbnail.method,
+                    thumbnail.extension,
+                    thumbnail.format)
+            except Exception:
+                self.slots.release()
+                raise
+            self.running[key] = future
+        # The slot is held until the job is done, even if the request gives
+        # up on waiting for it.
+        future.add_done_callback(lambda future: self.release(key, future))
+        return future
+
+    def release(self, key, future):
+        """
+        Free the slot of a finished job, once.
+        """
+        with self.mutex:
+            if self.running.get(key) is future:
+                del self.running[key]
+                self.slots.release()
+
+    def broken(self):
+        """
+        Whether a worker of the pool died, e.g. killed by the OOM killer. The
+        pool never finishes the job it was running, nor replaces the worker.
+        """
+        return any(process.exitcode is not None
+            for process in self.pool._processes or ())
+
+    def reset(self):
+        """
+        Replace a broken pool, failing the jobs it was running so their slots
+        are freed.
+        """
+        with self.mutex:
+            if not self.broken():
+                # Already replaced by another thread
+                return
+            pool, running = self.pool, self.running
+            self.pool = futures.ProcessPoolExecutor(self.max_workers)
+            self.running = {}
+            for future in running.values():
+                self.slots.release()
+        # The pool waits for its pending jobs before shutting down, including
+        # the ones lost with the dead worker
+        for process in pool._processes:
+            process.terminate()
+        pool._pending_work_items.clear()
+        pool.shutdown(False)
+        for key, future in running.items():
+            if not future.done():
+                future.set_exception(exceptions.RenderFailed(
+                    "A worker died generating '%s'." % key))
+
+    def render(self, thumbnail):
+        if self.broken():
+            self.reset()
+        future = self.submit(thumbnail)
+        deadline = None if self.timeout is None else time.time() + self.timeout
+        try:
+            while True:
+                interval = self.poll_interval
+                if deadline is not None:
+                    interval = max(min(interval, deadline - time.time()), 0)
+                try:
+                    return future.result(interval)
+                except futures.TimeoutError:
+                    if self.broken():
+                        self.reset()
+                    elif deadline is not None and time.time() >= deadline:
+                        raise exceptions.RenderTimeout(
+                            "Timed out generating '%s'." % thumbnail.key)
+        finally:
+            # The done callback can run after result() returns, don't keep
+            # the slot until then
+            if future.done():
+                self.release(thumbnail.key, future)
+
+    def shutdown(self, wait=True):
+        self.pool.shutdown(wait)
+
+
+class QueueExecutor(RenderExecutorBase):
+    """
+    Queue thumbnails on the render queue, to be generated by
+    `runthumbnailworker` processes on any host, and wait up to `timeout`
+    seconds for the result. With a `timeout` of 0, requests return a
+    retryable response right away while the thumbnail is generated.
+    """
+    def __init__(self, *args, **kwargs):
+        from restthumbnails import defaults
+        super(QueueExecutor, self).__init__(*args, **kwargs)
+        self.queue = defaults.render_queue()
+        self.poll_interval = defaults.LOCK_POLL_INTERVAL
+        self.poll_backoff = defaults.LOCK_POLL_BACKOFF
+        self.poll_max_interval = defaults.LOCK_POLL_MAX_INTERVAL
+
+    def render(self, thumbnail):
+        from restthumbnails import queues
+        if thumbnail.exists():
+            return False
+        # Jobs that failed recently aren't queued again until the queue
+        # forgets about them
+        status = self.queue.status(thumbnail.key)
+        if status is None or status[0] != queues.FAILED:
+            self.queue.put(queues.get_job(thumbnail))
+            status = self.queue.status(thumbnail.key)
+        deadline = time.time() + (self.timeout or 0)
+        interval = self.poll_interval
+        while True:
+            if status is not None and status[0] == queues.DONE:
+                return status[1]
+            if status is not None and status[0] == queues.FAILED:
+                name, message = status[2]
+                error = getattr(exceptions, name, None)
+                if not (isinstance(error, type) and
+                        issubclass(error, exceptions.ThumbnailError)):
+                    error = exceptions.RenderFailed
+                raise error(message)
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise exceptions.RenderTimeout(
+                    "Timed out generating '%s'." % thumbnail.key)
+            time.sleep(min(interval, remaining))
+            interval = min(interval * self.poll_backoff, self.poll_max_interval)
+            status = self.queue.status(thumbnail.key)
+
+
+if futures is not None:
+    DefaultExecutor = ProcessPoolExecutor
+else:
+    DefaultExecutor = InlineExecutor
@@ -1,8 +1,13 @@
 from django.utils.log import getLogger
 
-from restthumbnails import processors, exceptions
+from restthumbnails import admission, processors, exceptions, helpers, metrics
 from restthumbnails.base import ThumbnailBase
+from restthumbnails.index import SourceInfo
 
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import errno
 import os
 
 
@@ -22,9 +27,21 @@ class ThumbnailFileBase(ThumbnailBase):
     def url(self):
         raise NotImplementedError
 
+    def exists(self):
+        return self._exists()
+
     def generate(self):
         return self._generate()
 
+    @classmethod
+    def generate_batch(cls, thumbnails, assume_missing=False):
+        """
+        Generate many thumbnails at once, returning a list with the result
+        of `generate` for each one. If `assume_missing` is True, thumbnails
+        are generated without checking if they exist first.
+        """
+        return [thumbnail.generate() for thumbnail in thumbnails]
+
 
 class ThumbnailFile(ThumbnailFileBase):
     """
@@ -40,24 +57,38 @@ class ThumbnailFile(ThumbnailFileBase):
     """
     def __init__(self, *args, **kwargs):
         from restthumbnails import defaults
+        self._name = None
         self.storage = defaults.storage_backend()
         self.source_storage = defaults.source_storage_backend()
         super(ThumbnailFile, self).__init__(*args, **kwargs)
 
     def _exists(self):
-        return self.storage.exists(self.path)
+        return self.storage.exists(self.name)
 
     def _source_exists(self):
         return self.source_storage.exists(self.source)
 
     @property
     def name(self):
-        return self.file_signature % {
-            'source': os.path.normpath(self.source),
-            'size': self.size_string,
-            'method': self.method,
-            'secret': self.secret,
-            'extension': self.extension}
+        if self._name is None:
+            self._name = self.file_signature % {
+                'shard': self.shard,
+                'source': os.path.normpath(self.source),
+                'size': self.size_string,
+                'method': self.method,
+                'secret': self.secret,
+                'extension': self.extension}
+            if self.format != helpers.parse_extension(self.extension):
+                # Keep negotiated formats beside the requested file
+                self._name += helpers.FORMAT_EXTENSIONS[self.format].lower()
+        return self._name
+
+    @property
+    def key(self):
+        key = super(ThumbnailFile, self).key
+        if self.format != helpers.parse_extension(self.extension):
+            key = '-'.join((key, self.format.lower()))
+        return key
 
     @property
     def path(self):
@@ -67,14 +98,156 @@ class ThumbnailFile(ThumbnailFileBase):
     def url(self):
         return self.storage.url(self.name)
 
+    def _admit(self, image, budget, reservations):
+        """
+        Check the size of an opened source before it's decoded, and wait
+        until the memory needed to decode it is available in the budget.
+        """
+        from restthumbnails import defaults
+        admission.check_pixels(image, defaults.MAX_PIXELS)
+        if budget is None:
+            return
+        with metrics.timer('generate.memory_wait', self.__class__):
+            reservation = budget.acquire(processors.get_decoded_size(image))
+        if reservation is None:
+            raise exceptions.RenderUnavailable(
+                "No memory to decode '%s' within %ss." % (
+                    self.source, budget.timeout))
+        reservations.append(reservation)
+
+    @contextmanager
+    def _open_source_image(self, sizes, info=None):
+        """
+        Open and decode the source, for the given ``(size, crop)`` tuples,
+        keeping the memory it takes reserved in the decode budget (see
+        THUMBNAILS_DECODE_MEMORY) until the block exits. Raise
+        SourceDoesNotExist if it's missing and SourceTooLarge if it has more
+        than THUMBNAILS_MAX_PIXELS pixels. The header values of the source
+        are added to `info` (see `processors.get_image`).
+        """
+        from restthumbnails import defaults
+        if info is None:
+            info = {}
+        budget = defaults.decode_budget()
+        reservations = []
+        admit = lambda image: self._admit(image, budget, reservations)
+        try:
+            try:
+                with metrics.timer('generate.open', self.__class__):
+                    f = self.source_storage.open(self.source)
+                try:
+                    with metrics.timer('generate.decode', self.__class__):
+                        im = processors.get_image(f, exif_orientation=False,
+                            sizes=sizes, info=info, admit=admit)
+                finally:
+                    f.close()
+                metrics.incr('generate.pixels', im.size[0] * im.size[1],
+                    self.__class__)
+                index = defaults.source_index()
+                if index is not None:
+                    self._index_source(index, im, info)
+            except (IOError, OSError), e:
+                # The source isn't checked before being opened, which would
+                # cost another round trip on remote storages. Storages don't
+                # agree on the error raised for missing files, so only check
+                # when opening or decoding it failed for another reason.
+                if (getattr(e, 'errno', None) == errno.ENOENT or
+                        not self._source_exists()):
+                    raise exceptions.SourceDoesNotExist(self.source)
+                raise
+            yield im
+        finally:
+            for reservation in reservations:
+                budget.release(reservation)
+
+    def _index_source(self, index, im, info):
+        """
+        Add the header values of the source to the source index, with a
+        placeholder made from the decoded image unless it has one already.
+        """
+        from restthumbnails import defaults
+        width, height = info['size']
+        entry = SourceInfo(width, height, info['format'], info['orientation'])
+        if defaults.PLACEHOLDER_SIZE:
+            known = index.get(self.source)
+            if known is not None and known[:4] == entry[:4] and known.placeholder:
+                entry = known
+            else:
+                entry = entry._replace(placeholder=processors.get_placeholder(
+                    im, defaults.PLACEHOLDER_SIZE, info['orientation']))
+        index.add(self.source, entry)
+
+    def _save(self, im):
+        from restthumbnails import defaults
+        # JPEG can't store transparency, so use a white background
+        with metrics.timer('generate.colorspace', self.__class__):
+            im = processors.colorspace(im,
+                replace_alpha='#fff' if self.format == 'JPEG' else False)
+        with metrics.timer('generate.encode', self.__class__):
+            content = processors.save_image(im, self.format,
+                **defaults.ENCODER_OPTIONS.get(self.format, {}))
+        try:
+            with metrics.timer('generate.write', self.__class__):
+                name = self.storage.save(self.name, content)
+        finally:
+            content.close()
+        metrics.incr('generate.bytes', content.size, self.__class__)
+        if name != self.name:
+            # The storage backend can't overwrite files, and another worker
+            # saved this thumbnail in the meantime. Don't leave a duplicate
+            # around, it would never be served.
+            logger.warning("Storage saved '%s' as '%s', removing it.",
+                self.name, name)
+            self.storage.delete(name)
+
     def generate(self):
-        if self._source_exists():
-            if not self._exists():
-                im = processors.get_image(self.source_storage.open(self.source))
-                im = processors.scale_and_crop(im, self.size, self.method)
-                im = processors.colorspace(im)
-                im = processors.save_image(im)
-                self.storage.save(self.name, im)
-                return True
-            return False
-        raise exceptions.SourceDoesNotExist(self.source)
+        from restthumbnails import defaults
+        return self.generate_batch([self], defaults.ASSUME_MISSING)[0]
+
+    @classmethod
+    def generate_batch(cls, thumbnails, assume_missing=False):
+        """
+        Generate many thumbnails at once, decoding each source only once
+        and resizing smaller thumbnails from larger ones of the same source.
+        Return a list with the result of `generate` for each thumbnail.
+
+        Thumbnails are not checked for existence if `assume_missing` is True,
+        e.g. when the web server only forwards requests for missing files.
+
+        >>> ThumbnailFile.generate_batch([
+        ...     ThumbnailFile('path/to/file.jpg', (200, 200), 'crop', '.jpg'),
+        ...     ThumbnailFile('path/to/file.jpg', (100, 100), 'crop', '.jpg')])
+        [True, True]
+
+        """
+        from restthumbnails import defaults
+        sources = OrderedDict()
+        for thumbnail in thumbnails:
+            sources.setdefault(thumbnail.source, []).append(thumbnail)
+
+        generated = set()
+        for source, group in sources.items():
+            pending = OrderedDict()
+            for thumbnail in group:
+                if thumbnail.name not in pending and (
+                        assume_missing or not thumbnail._exists()):
+                    pending[thumbnail.name] = thumbnail
+            if not pending:
+                continue
+            sizes = [(thumbnail.size, thumbnail.method)
+                     for thumbnail in pending.values()]
+            info = {}
+            with group[0]._open_source_image(sizes, info) as im:
+                # Sizes apply to the upright image, but only the thumbnails
+                # get transposed.
+                with metrics.timer('generate.scale_and_crop', cls):
+                    images = processors.scale_and_crop_many(im, sizes,
+                        smart_proxy_size=defaults.SMART_CROP_PROXY_SIZE,
+                        reducing_gap=defaults.REDUCING_GAP,
+                        orientation=info['orientation'],
+                        image_size=info['size'])
+                for thumbnail, im in zip(pending.values(), images):
+                    thumbnail._save(im)
+                    generated.add(thumbnail.name)
+            metrics.incr('generate.thumbnails', len(images), cls)
+        return [thumbnail.name in generated for thumbnail in thumbnails]
@@ -1,13 +1,43 @@
 from django.conf import settings
+from django.core.cache import cache
 from django.utils.crypto import salted_hmac
+from django.utils.encoding import smart_str
 
 from restthumbnails import exceptions
 
+import hashlib
 import re
 
 
 RE_SIZE = re.compile(r'(\d+)?x(\d+)?$')
 
+# Image formats for each extension, as named by PIL
+FORMATS = {
+    '.jpg': 'JPEG',
+    '.jpeg': 'JPEG',
+    '.png': 'PNG',
+    '.gif': 'GIF',
+    '.webp': 'WEBP',
+    '.avif': 'AVIF',
+}
+
+# Preferred extension and MIME type for each format
+FORMAT_EXTENSIONS = {
+    'JPEG': '.jpg',
+    'PNG': '.png',
+    'GIF': '.gif',
+    'WEBP': '.webp',
+    'AVIF': '.avif',
+}
+
+FORMAT_MIMETYPES = {
+    'JPEG': 'image/jpeg',
+    'PNG': 'image/png',
+    'GIF': 'image/gif',
+    'WEBP': 'image/webp',
+    'AVIF': 'image/avif',
+}
+
 
 def parse_size(size):
     """
@@ -28,6 +58,31 @@ def parse_size(size):
     return map(lambda x: 0 if not x else int(x), match.groups())
 
 
+def snap_size(size, ladder):
+    """
+    Round the largest dimension of a size up to the next step of the ladder
+    (or down to the last one), and scale the other one in proportion, so
+    slightly different sizes share the same thumbnails.
+
+    >>> snap_size((198, 0), (100, 200, 400))
+    (200, 0)
+    >>> snap_size((300, 150), (100, 200, 400))
+    (400, 200)
+    """
+    width, height = size
+    longest = max(width, height)
+    steps = sorted(ladder)
+    step = steps[-1]
+    for candidate in steps:
+        if candidate >= longest:
+            step = candidate
+            break
+    if step == longest:
+        return (width, height)
+    ratio = float(step) / longest
+    return (int(round(width * ratio)), int(round(height * ratio)))
+
+
 def parse_method(method):
     # FIXME: available processors should be a setting
     if method not in ['crop', 'smart', 'scale']:
@@ -36,24 +91,98 @@ def parse_method(method):
     return method
 
 
+# Number of directory levels used by sharded layouts (256 directories each)
+SHARD_LEVELS = 2
+
+# Maximum number of HMAC instances kept by `get_secret`
+HMAC_CACHE_SIZE = 1024
+
+_hmac_cache = {}
+
+
+def parse_extension(extension):
+    """
+    Return the image format used to encode files with the given extension.
+    Raise InvalidExtensionError if the extension is not supported, or if
+    PIL can't encode its format (e.g. AVIF without a plugin).
+
+    >>> parse_extension(".jpg")
+    'JPEG'
+    """
+    from restthumbnails import processors
+    try:
+        format = FORMATS[str(extension).lower()]
+    except KeyError:
+        raise exceptions.InvalidExtensionError(
+            "'%s' is not a valid extension string." % extension)
+    if not processors.can_save(format):
+        raise exceptions.InvalidExtensionError(
+            "'%s' is not supported by PIL." % extension)
+    return format
+
+
 def get_secret(source, size, method, extension):
     """
     Get a unique hash based on file path, size, method and SECRET_KEY.
+
+    This is the same as `salted_hmac(source, ...)`, but the key derived
+    from the source and SECRET_KEY is reused for all thumbnails of a source.
     """
     secret_sauce = '-'.join((source, size, method, extension))
-    return salted_hmac(source, secret_sauce).hexdigest()
+    cache_key = (source, settings.SECRET_KEY)
+    try:
+        mac = _hmac_cache[cache_key]
+    except KeyError:
+        if len(_hmac_cache) >= HMAC_CACHE_SIZE:
+            _hmac_cache.clear()
+        mac = _hmac_cache[cache_key] = salted_hmac(source, '')
+    mac = mac.copy()
+    mac.update(secret_sauce)
+    return mac.hexdigest()
+
+
+def get_key(source, size, method, extension, secret=None):
+    """
+    Get a unique key suitable for the cache backend.
+    """
+    from restthumbnails import defaults
+    if secret is None:
+        secret = get_secret(source, size, method, extension)
+    return '-'.join((defaults.KEY_PREFIX, secret))
 
 
-def get_key(source, size, method, extension):
+def get_missing_key(source):
     """
-    Get a unique key suitable for the cache backend.
+    Get a key for the cache backend, used to remember that the source file
+    doesn't exist.
     """
     from restthumbnails import defaults
     return '-'.join((
-        defaults.KEY_PREFIX, get_secret(source, size, method, extension)))
+        defaults.KEY_PREFIX, 'missing', hashlib.sha1(smart_str(source)).hexdigest()))
+
+
+def invalidate_source(source):
+    """
+    Forget that the source file doesn't exist. Call this when the file is
+    (re-)uploaded, so its thumbnails can be generated right away.
+    """
+    from restthumbnails import defaults
+    source = getattr(source, 'name', source)
+    cache.delete(get_missing_key(source))
+    storage = defaults.source_storage_backend()
+    if hasattr(storage, 'forget'):
+        storage.forget(source)
 
 
-def get_thumbnail(source, size, method, extension, secret):
+def get_shard(secret):
+    """
+    Return the directory prefix of a thumbnail in sharded layouts, made of
+    SHARD_LEVELS levels of two hex digits taken from its secret.
+    """
+    return '/'.join([secret[i:i + 2] for i in range(0, SHARD_LEVELS * 2, 2)])
+
+
+def get_thumbnail(source, size, method, extension, secret, shard=None):
     from restthumbnails import defaults
     instance = defaults.thumbnail_file()(
         source=source,
@@ -63,13 +192,36 @@ def get_thumbnail(source, size, method, extension, secret):
     if instance.secret != secret:
         raise exceptions.InvalidSecretError(
             "Secret '%s' does not match." % secret)
+    if shard is not None and instance.shard != shard:
+        raise exceptions.InvalidSecretError(
+            "Shard '%s' does not match." % shard)
     return instance
 
 
 def get_thumbnail_proxy(source, size, method, extension):
     from restthumbnails import defaults
+    if defaults.SIZE_LADDER:
+        size = '%dx%d' % snap_size(parse_size(size), defaults.SIZE_LADDER)
     return defaults.thumbnail_proxy()(
         source=source,
         size=size,
         method=method,
         extension=extension)
+
+
+def get_thumbnail_srcset(source, size, method, extension, scales=(1, 2)):
+    """
+    Return a ThumbnailSrcset of the thumbnails of a source at the given size
+    multiplied by each scale, e.g. for high density displays.
+    """
+    from restthumbnails.proxies import ThumbnailSrcset
+    width, height = parse_size(size)
+    thumbnails = []
+    for scale in scales:
+        thumbnail = get_thumbnail_proxy(source,
+            '%dx%d' % (int(round(width * scale)), int(round(height * scale))),
+            method, extension)
+        # Scales can snap to the same step of the ladder
+        if thumbnail.size not in [other.size for other in thumbnails]:
+            thumbnails.append(thumbnail)
+    return ThumbnailSrcset(thumbnails, (width, height))
@@ -0,0 +1,148 @@
+from collections import namedtuple
+
+import errno
+import mmap
+import os
+import struct
+import threading
+
+
+# Each record is its length, followed by the fixed size fields and then
+# length-prefixed strings: the source path, its format, an optional
+# placeholder image and any fields added later, which older readers skip.
+RECORD_LENGTH = struct.Struct('>I')
+RECORD_FIELDS = struct.Struct('>IIB')
+STRING_LENGTH = struct.Struct('>H')
+
+SourceInfo = namedtuple('SourceInfo',
+    'width height format orientation placeholder')
+SourceInfo.__new__.__defaults__ = (None,)
+
+
+def _key(source):
+    if isinstance(source, unicode):
+        return source.encode('utf-8')
+    return source
+
+
+def pack(source, info):
+    """
+    Return the index record of a source.
+    """
+    data = [RECORD_FIELDS.pack(info.width, info.height, info.orientation or 0)]
+    strings = [_key(source), info.format or '']
+    if info.placeholder:
+        strings.append(info.placeholder)
+    for string in strings:
+        data.append(STRING_LENGTH.pack(len(string)))
+        data.append(string)
+    data = ''.join(data)
+    return RECORD_LENGTH.pack(len(data)) + data
+
+
+def unpack(data, offset=0):
+    """
+    Return the source path, as UTF-8 encoded bytes, and the SourceInfo of the
+    record at the given offset.
+    """
+    length, = RECORD_LENGTH.unpack_from(data, offset)
+    end = offset + RECORD_LENGTH.size + length
+    offset += RECORD_LENGTH.size
+    width, height, orientation = RECORD_FIELDS.unpack_from(data, offset)
+    offset += RECORD_FIELDS.size
+    strings = []
+    while offset < end:
+        size, = STRING_LENGTH.unpack_from(data, offset)
+        offset += STRING_LENGTH.size
+        strings.append(data[offset:offset + size])
+        offset += size
+    source, format, placeholder = (strings + [None])[:3]
+    return source, SourceInfo(width, height, format or None,
+        orientation or None, placeholder or None)
+
+
+class SourceIndex(object):
+    """
+    An append-only file of source dimensions, format, EXIF orientation and
+    placeholder images, shared by all processes on a host. Each process maps the file in memory
+    and keeps the offset of the last record of each source, so lookups don't
+    read from disk. Records appended by other processes are picked up on the
+    next lookup.
+
+    >>> index = SourceIndex('/var/lib/thumbnails/sources.idx')
+    >>> index.add('animals/kitten.jpg', SourceInfo(800, 600, 'JPEG', None))
+    True
+    >>> index.get('animals/kitten.jpg')
+    SourceInfo(width=800, height=600, format='JPEG', orientation=None, placeholder=None)
+
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.offsets = {}
+        self.data = ''
+        self.scanned = 0
+
+    def refresh(self):
+        """
+        Read the records appended since the last call.
+        """
+        with self.lock:
+            try:
+                size = os.stat(self.path).st_size
+            except OSError, e:
+                if e.errno != errno.ENOENT:
+                    raise
+                return
+            if size <= self.scanned:
+                return
+            with open(self.path, 'rb') as f:
+                self.data = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+            offset = self.scanned
+            while offset + RECORD_LENGTH.size <= size:
+                length, = RECORD_LENGTH.unpack_from(self.data, offset)
+                if offset + RECORD_LENGTH.size + length > size:
+                    # Still being written
+                    break
+                start = offset + RECORD_LENGTH.size + RECORD_FIELDS.size
+                source_length, = STRING_LENGTH.unpack_from(self.data, start)
+                start += STRING_LENGTH.size
+                self.offsets[self.data[start:start + source_length]] = offset
+                offset += RECORD_LENGTH.size + length
+            self.scanned = offset
+
+    def get(self, source):
+        """
+        Return the SourceInfo of a source, or None if it's not indexed.
+        """
+        self.refresh()
+        key = _key(source)
+        with self.lock:
+            offset = self.offsets.get(key)
+            if offset is None:
+                return None
+            return unpack(self.data, offset)[1]
+
+    def add(self, source, info):
+        """
+        Append the SourceInfo of a source, unless it's already indexed with
+        the same values. Return True if it was appended.
+        """
+        if self.get(source) == info:
+            return False
+        # Records are written with a single call in append mode, so
+        # concurrent writers don't interleave them.
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0666)
+        try:
+            os.write(fd, pack(source, info))
+        finally:
+            os.close(fd)
+        return True
+
+    def __contains__(self, source):
+        self.refresh()
+        return _key(source) in self.offsets
+
+    def __len__(self):
+        self.refresh()
+        return len(self.offsets)
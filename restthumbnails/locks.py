@@ -0,0 +1,153 @@
+from django.core.cache import cache
+
+import errno
+import os
+import threading
+import time
+import uuid
+
+
+class ThumbnailLockBase(object):
+    """
+    Abstract lock used to make only one worker busy on a thumbnail. Locks
+    expire after `timeout` seconds, so a crashed worker can't hold them
+    forever.
+    """
+    def __init__(self, thumbnail, timeout):
+        self.thumbnail = thumbnail
+        self.timeout = timeout
+        self.acquired = False
+
+    def acquire(self):
+        """
+        Try to acquire the lock without blocking. Return True on success.
+        """
+        if self._acquire():
+            self.acquired = True
+        return self.acquired
+
+    def release(self):
+        """
+        Release the lock, if it was acquired by this instance.
+        """
+        if self.acquired:
+            self._release()
+            self.acquired = False
+
+    def locked(self):
+        """
+        Check if the lock is currently held by any worker.
+        """
+        raise NotImplementedError
+
+    def _acquire(self):
+        raise NotImplementedError
+
+    def _release(self):
+        raise NotImplementedError
+
+
+class CacheLock(ThumbnailLockBase):
+    """
+    A lock using the default cache backend. Relies on `cache.add` being
+    atomic, which is the case for memcached and Redis backends.
+    """
+    def _acquire(self):
+        return cache.add(self.thumbnail.key, True, self.timeout)
+
+    def _release(self):
+        cache.delete(self.thumbnail.key)
+
+    def locked(self):
+        return cache.get(self.thumbnail.key) is not None
+
+
+class FileLock(ThumbnailLockBase):
+    """
+    A lock file created beside the thumbnail on the output storage. Works
+    across hosts sharing the same filesystem, as long as it supports
+    exclusive file creation (NFSv3 and later do).
+    """
+    @property
+    def path(self):
+        return '%s.lock' % self.thumbnail.path
+
+    def _is_stale(self):
+        try:
+            return os.path.getmtime(self.path) + self.timeout < time.time()
+        except OSError:
+            return False
+
+    def _acquire(self):
+        directory = os.path.dirname(self.path)
+        if not os.path.exists(directory):
+            try:
+                os.makedirs(directory)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+        try:
+            fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+            if not self._is_stale():
+                return False
+            # The worker holding the lock is gone, break it. Moving the lock
+            # file away is atomic, so only one of the workers racing for a
+            # stale lock gets to move it.
+            broken = '%s.%s' % (self.path, uuid.uuid4().hex)
+            try:
+                os.rename(self.path, broken)
+            except OSError, e:
+                if e.errno != errno.ENOENT:
+                    raise
+                return False
+            if os.path.getmtime(broken) + self.timeout >= time.time():
+                # Another worker broke the stale lock and acquired it since
+                # it was checked, put its lock back.
+                try:
+                    os.link(broken, self.path)
+                except OSError, e:
+                    if e.errno != errno.EEXIST:
+                        raise
+                os.unlink(broken)
+                return False
+            os.unlink(broken)
+            return self._acquire()
+        os.close(fd)
+        return True
+
+    def _release(self):
+        try:
+            os.unlink(self.path)
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def locked(self):
+        return os.path.exists(self.path) and not self._is_stale()
+
+
+class LocalLock(ThumbnailLockBase):
+    """
+    A lock local to the current process. Only useful for single process
+    deployments and tests.
+    """
+    _mutex = threading.Lock()
+    _expires = {}
+
+    def _acquire(self):
+        now = time.time()
+        with self._mutex:
+            if self._expires.get(self.thumbnail.key, 0) > now:
+                return False
+            self._expires[self.thumbnail.key] = now + self.timeout
+            return True
+
+    def _release(self):
+        with self._mutex:
+            self._expires.pop(self.thumbnail.key, None)
+
+    def locked(self):
+        return self._expires.get(self.thumbnail.key, 0) > time.time()
@@ -0,0 +1,69 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from restthumbnails import defaults, eviction
+
+from optparse import make_option
+
+import time
+
+
+class Command(BaseCommand):
+    """
+    Delete the least recently used thumbnails until the storage is within the
+    configured budget. Thumbnails are generated again when requested, so this
+    is safe to run at any time.
+    """
+    option_list = BaseCommand.option_list + (
+        make_option('--max-bytes',
+            dest='max_bytes', type='int', default=defaults.EVICTION_MAX_BYTES,
+            help="Maximum size of all thumbnails, in bytes. Defaults to "
+                 "THUMBNAILS_EVICTION_MAX_BYTES."),
+        make_option('--max-files',
+            dest='max_files', type='int', default=defaults.EVICTION_MAX_FILES,
+            help="Maximum number of thumbnails. Defaults to "
+                 "THUMBNAILS_EVICTION_MAX_FILES."),
+        make_option('--workers',
+            dest='workers', type='int', default=None,
+            help="Number of processes scanning the storage. Defaults to the "
+                 "number of CPUs."),
+        make_option('--loop',
+            dest='loop', type='int', default=None,
+            help="Keep running, checking the storage every LOOP seconds."),
+        make_option('--dry-run',
+            dest='dry_run', action='store_true', default=False,
+            help="Only show how many thumbnails would be deleted."),
+    )
+    help = "Delete the least recently used thumbnails."
+
+    def handle(self, *args, **options):
+        if options['max_bytes'] is None and options['max_files'] is None:
+            raise CommandError(
+                "Set THUMBNAILS_EVICTION_MAX_BYTES/FILES, or pass --max-bytes "
+                "or --max-files.")
+        storage = defaults.storage_backend()
+        try:
+            root = storage.path('')
+        except NotImplementedError:
+            raise CommandError(
+                "Only storages on the local filesystem can be scanned.")
+        while True:
+            self.run(storage, root, options)
+            if not options['loop']:
+                break
+            time.sleep(options['loop'])
+
+    def run(self, storage, root, options):
+        verbosity = int(options.get('verbosity', 1))
+        start = time.time()
+        if defaults.ACCESS_LOG:
+            eviction.apply_access_log(defaults.ACCESS_LOG, storage)
+        entries = eviction.scan(root, options['workers'])
+        files, bytes = eviction.evict(entries,
+            max_bytes=options['max_bytes'],
+            max_files=options['max_files'],
+            dry_run=options['dry_run'])
+        if verbosity > 0:
+            self.stdout.write(
+                "%d files (%d bytes), %d evicted (%d bytes) in %.1fs\n" % (
+                    len(entries), sum(entry[1] for entry in entries),
+                    files, bytes, time.time() - start))
@@ -0,0 +1,214 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from restthumbnails import defaults, helpers, queues
+from restthumbnails.exceptions import ThumbnailError
+
+from functools import partial
+from itertools import imap
+from multiprocessing import Pool
+from optparse import make_option
+
+import os
+import time
+
+
+def walk(storage, path=''):
+    """
+    Recursively yield the paths of all files under `path` on a storage.
+    """
+    directories, files = storage.listdir(path)
+    for name in sorted(files):
+        yield os.path.join(path, name)
+    for name in sorted(directories):
+        for name in walk(storage, os.path.join(path, name)):
+            yield name
+
+
+def parse_spec(spec):
+    """
+    Parse a string in the format "<size>:<method>:<extension>", as used in
+    thumbnail URLs, and return it as a tuple.
+    """
+    try:
+        size, method, extension = spec.split(':')
+    except ValueError:
+        raise CommandError(
+            "'%s' is not a valid spec, use <size>:<method>:<extension>." % spec)
+    try:
+        helpers.parse_size(size)
+        helpers.parse_method(method)
+        helpers.parse_extension(extension)
+    except ThumbnailError, e:
+        raise CommandError(e)
+    return size, method, extension
+
+
+def generate(args):
+    """
+    Generate all thumbnails of a source, decoding it only once. Runs on the
+    pool processes.
+    """
+    source, specs = args
+    thumbnail_file = defaults.thumbnail_file()
+    # A bad source fails its own thumbnails, not the whole run
+    try:
+        thumbnails = [thumbnail_file(
+                source=source,
+                size=size,
+                method=method,
+                extension=extension)
+            for size, method, extension in specs]
+        results = thumbnail_file.generate_batch(thumbnails)
+    except (ThumbnailError, IOError, OSError):
+        return source, 0, 0, len(specs)
+    generated = results.count(True)
+    return source, generated, len(results) - generated, 0
+
+
+def enqueue(args, priority=queues.BATCH):
+    """
+    Put the missing thumbnails of a source on the render queue, to be
+    generated by `runthumbnailworker` processes.
+    """
+    source, specs = args
+    queue = defaults.render_queue()
+    thumbnail_file = defaults.thumbnail_file()
+    queued = skipped = failed = 0
+    for size, method, extension in specs:
+        try:
+            thumbnail = thumbnail_file(
+                source=source,
+                size=size,
+                method=method,
+                extension=extension)
+            if not thumbnail.exists() and queue.put(
+                    queues.get_job(thumbnail, priority)):
+                queued += 1
+            else:
+                skipped += 1
+        except ThumbnailError:
+            failed += 1
+    return source, queued, skipped, failed
+
+
+class Command(BaseCommand):
+    """
+    Generate thumbnails in batch, from all files on the source storage or
+    from a list of paths.
+    """
+    option_list = BaseCommand.option_list + (
+        make_option('--paths',
+            dest='paths', default=None,
+            help="Read source paths from this file, one per line, instead of "
+                 "walking the source storage."),
+        make_option('--prefix',
+            dest='prefix', default='',
+            help="Only walk this directory of the source storage."),
+        make_option('--workers',
+            dest='workers', type='int', default=None,
+            help="Number of worker processes. Defaults to the number of CPUs."),
+        make_option('--checkpoint',
+            dest='checkpoint', default=None,
+            help="Record processed sources in this file, and skip the ones "
+                 "already recorded when running again. Sources with failed "
+                 "thumbnails are not recorded."),
+        make_option('--enqueue',
+            dest='enqueue', action='store_true', default=False,
+            help="Put thumbnails on the render queue, to be generated by "
+                 "runthumbnailworker processes, instead of generating them."),
+        make_option('--priority',
+            dest='priority', default='batch',
+            help="Priority class of the queued thumbnails: interactive, "
+                 "prefetch or batch (the default)."),
+    )
+    args = '<size>:<method>:<extension> [...]'
+    help = "Generate thumbnails for existing source files."
+
+    def get_sources(self, options):
+        if options['paths']:
+            with open(options['paths']) as paths:
+                for path in paths:
+                    path = path.strip()
+                    if path:
+                        yield path
+        else:
+            storage = defaults.source_storage_backend()
+            for path in walk(storage, options['prefix']):
+                yield path
+
+    def get_checkpoint(self, options):
+        if not options['checkpoint'] or not os.path.exists(options['checkpoint']):
+            return set()
+        with open(options['checkpoint']) as checkpoint:
+            return set(line.rstrip('\n') for line in checkpoint)
+
+    def handle(self, *args, **options):
+        if not args:
+            raise CommandError("At least one spec is required.")
+        specs = [parse_spec(spec) for spec in args]
+        verbosity = int(options.get('verbosity', 1))
+
+        done = self.get_checkpoint(options)
+        jobs = ((source, specs)
+            for source in self.get_sources(options) if source not in done)
+
+        if options['enqueue']:
+            try:
+                priority = queues.parse_priority(options['priority'])
+            except ValueError, e:
+                raise CommandError(e)
+            # Queueing is cheap, and the database connection can't be shared
+            # with pool processes
+            pool = None
+            results = imap(partial(enqueue, priority=priority), jobs)
+        elif options['workers'] == 1:
+            pool = None
+            results = imap(generate, jobs)
+        else:
+            pool = Pool(options['workers'])
+            results = pool.imap_unordered(generate, jobs)
+
+        checkpoint = None
+        if options['checkpoint']:
+            checkpoint = open(options['checkpoint'], 'a')
+
+        sources = generated = skipped = failed = 0
+        start = time.time()
+        try:
+            for source, source_generated, source_skipped, source_failed in results:
+                sources += 1
+                generated += source_generated
+                skipped += source_skipped
+                failed += source_failed
+                # Failed sources are tried again when resuming
+                if checkpoint and not source_failed:
+                    checkpoint.write('%s\n' % source)
+                    checkpoint.flush()
+                if verbosity > 1:
+                    self.stdout.write("%s: %d %s, %d skipped, %d failed\n" % (
+                        source, source_generated,
+                        'queued' if options['enqueue'] else 'generated',
+                        source_skipped, source_failed))
+        except:
+            if pool:
+                pool.terminate()
+            raise
+        else:
+            if pool:
+                pool.close()
+                pool.join()
+        finally:
+            if checkpoint:
+                checkpoint.close()
+
+        elapsed = max(time.time() - start, 1e-6)
+        if verbosity > 0 and options['enqueue']:
+            self.stdout.write(
+                "%d sources, %d queued, %d skipped, %d failed in %.1fs\n" % (
+                    sources, generated, skipped, failed, elapsed))
+        elif verbosity > 0:
+            self.stdout.write(
+                "%d sources, %d generated, %d skipped, %d failed in %.1fs "
+                "(%.1f sources/s, %.1f thumbnails/s)\n" % (
+                    sources, generated, skipped, failed, elapsed,
+                    sources / elapsed, generated / elapsed))
@@ -0,0 +1,141 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from restthumbnails import admission, defaults, exceptions, processors
+from restthumbnails.index import SourceInfo
+from restthumbnails.management.commands.generate_thumbnails import walk
+
+from itertools import imap
+from multiprocessing import Pool
+from optparse import make_option
+
+import time
+
+
+def read_header(args):
+    """
+    Return the SourceInfo of a source, reading only its header unless a
+    placeholder is wanted, or None if it can't be read. Sources too large to
+    be decoded get no placeholder. Runs on the pool processes.
+    """
+    source, placeholder_size = args
+    storage = defaults.source_storage_backend()
+    try:
+        f = storage.open(source)
+        try:
+            if placeholder_size:
+                info = {}
+                placeholder = None
+                try:
+                    im = processors.get_image(f, exif_orientation=False,
+                        sizes=[((placeholder_size, placeholder_size), False)],
+                        info=info, admit=lambda image: admission.check_pixels(
+                            image, defaults.MAX_PIXELS))
+                except exceptions.SourceTooLarge:
+                    # The header was read before the source was admitted,
+                    # unless PIL refused to open it
+                    if not info:
+                        raise
+                else:
+                    placeholder = processors.get_placeholder(im,
+                        placeholder_size, info['orientation'])
+                width, height = info['size']
+                return source, SourceInfo(width, height, info['format'],
+                    info['orientation'], placeholder)
+            image_file = f
+            if not processors._is_seekable(f):
+                image_file = processors._spool(f)
+            # Image.open only parses the header, pixels are read on load
+            im = processors.open_image(image_file)
+            return source, SourceInfo(im.size[0], im.size[1], im.format,
+                processors.get_orientation(im))
+        finally:
+            f.close()
+    except (IOError, OSError, SyntaxError, ValueError,
+            exceptions.SourceTooLarge):
+        return source, None
+
+
+class Command(BaseCommand):
+    """
+    Add the dimensions, format and EXIF orientation of source files to the
+    source index, so templates can tell the size of thumbnails that weren't
+    generated yet. Only file headers are read, unless placeholder images are
+    made too.
+    """
+    option_list = BaseCommand.option_list + (
+        make_option('--prefix',
+            dest='prefix', default='',
+            help="Only walk this directory of the source storage."),
+        make_option('--workers',
+            dest='workers', type='int', default=None,
+            help="Number of worker processes. Defaults to the number of CPUs."),
+        make_option('--refresh',
+            dest='refresh', action='store_true', default=False,
+            help="Read sources already in the index again."),
+        make_option('--placeholders',
+            dest='placeholders', action='store_true', default=False,
+            help="Also decode sources to make placeholder images, for the "
+                 "ones that don't have any."),
+    )
+    help = "Index the dimensions of source files."
+
+    def handle(self, *args, **options):
+        index = defaults.source_index()
+        if index is None:
+            raise CommandError("Set THUMBNAILS_SOURCE_INDEX first.")
+        verbosity = int(options.get('verbosity', 1))
+
+        placeholder_size = None
+        if options['placeholders']:
+            placeholder_size = defaults.PLACEHOLDER_SIZE
+            if not placeholder_size:
+                raise CommandError("THUMBNAILS_PLACEHOLDER_SIZE is disabled.")
+
+        def missing(source):
+            info = index.get(source)
+            return info is None or (placeholder_size and not info.placeholder)
+
+        storage = defaults.source_storage_backend()
+        sources = ((source, placeholder_size)
+            for source in walk(storage, options['prefix'])
+            if options['refresh'] or missing(source))
+
+        if options['workers'] == 1:
+            pool = None
+            results = imap(read_header, sources)
+        else:
+            pool = Pool(options['workers'])
+            results = pool.imap_unordered(read_header, sources, 64)
+
+        files = added = failed = 0
+        start = time.time()
+        try:
+            # Only this process writes to the index
+            for source, info in results:
+                files += 1
+                if info is None:
+                    failed += 1
+                    if verbosity > 1:
+                        self.stderr.write("Failed to read %s\n" % source)
+                    continue
+                if info.placeholder is None:
+                    # Keep the placeholder of sources that didn't change
+                    known = index.get(source)
+                    if known is not None and known[:4] == info[:4]:
+                        info = known
+                if index.add(source, info):
+                    added += 1
+        except:
+            if pool:
+                pool.terminate()
+            raise
+        else:
+            if pool:
+                pool.close()
+                pool.join()
+
+        elapsed = max(time.time() - start, 1e-6)
+        if verbosity > 0:
+            self.stdout.write(
+                "%d files, %d added, %d failed in %.1fs (%.1f files/s)\n" % (
+                    files, added, failed, elapsed, files / elapsed))
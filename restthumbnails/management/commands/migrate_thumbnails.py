@@ -0,0 +1,170 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from restthumbnails import defaults, helpers
+from restthumbnails.exceptions import ThumbnailError
+from restthumbnails.management.commands.generate_thumbnails import walk
+
+from itertools import imap
+from multiprocessing import Pool
+from optparse import make_option
+
+import errno
+import os
+import re
+import time
+
+
+_regexes = {}
+
+def parse_name(name, signature):
+    """
+    Parse the name of a thumbnail file laid out with another file signature,
+    and return the thumbnail it belongs to, or None if it doesn't match.
+    """
+    try:
+        regex = _regexes[signature]
+    except KeyError:
+        regex = _regexes[signature] = re.compile(
+            defaults.signature_regex(signature))
+    match = regex.match(name)
+    if match is None:
+        return None
+    kwargs = match.groupdict()
+    secret, extension = kwargs['secret'], kwargs['extension']
+    format = None
+    if '.' in secret:
+        # Negotiated formats are stored beside the requested file, with
+        # another extension (see ThumbnailFile.name)
+        secret, requested = secret.split('.', 1)
+        extension, variant = '.%s' % requested, extension
+        format = helpers.FORMATS.get(variant)
+        if format is None:
+            return None
+    try:
+        thumbnail = defaults.thumbnail_file()(
+            source=kwargs['source'],
+            size=kwargs['size'],
+            method=kwargs['method'],
+            extension=extension,
+            format=format)
+        if thumbnail.secret != secret:
+            return None
+    except ThumbnailError:
+        return None
+    return thumbnail
+
+
+def move(storage, name, new_name):
+    """
+    Move a file to another name on the same storage. The file is renamed
+    when the storage is on the local filesystem, otherwise it's copied and
+    deleted.
+    """
+    try:
+        path, new_path = storage.path(name), storage.path(new_name)
+    except NotImplementedError:
+        if not storage.exists(new_name):
+            f = storage.open(name)
+            try:
+                storage.save(new_name, f)
+            finally:
+                f.close()
+        storage.delete(name)
+        return
+    try:
+        os.rename(path, new_path)
+    except OSError, e:
+        if e.errno != errno.ENOENT or not os.path.exists(path):
+            raise
+        try:
+            os.makedirs(os.path.dirname(new_path))
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+        os.rename(path, new_path)
+
+
+def migrate(args):
+    """
+    Move a thumbnail file to its name in the current layout. Runs on the pool
+    processes.
+    """
+    name, signature = args
+    thumbnail = parse_name(name, signature)
+    if thumbnail is None or thumbnail.name == name:
+        return name, None, False
+    try:
+        move(defaults.storage_backend(), name, thumbnail.name)
+    except (IOError, OSError):
+        return name, thumbnail.name, False
+    return name, thumbnail.name, True
+
+
+class Command(BaseCommand):
+    """
+    Move existing thumbnails to the layout given by THUMBNAILS_FILE_SIGNATURE,
+    e.g. after switching to the sharded layout.
+    """
+    option_list = BaseCommand.option_list + (
+        make_option('--from',
+            dest='signature', default=defaults.DEFAULT_FILE_SIGNATURE,
+            help="File signature of the current layout. Defaults to the "
+                 "default file signature."),
+        make_option('--prefix',
+            dest='prefix', default='',
+            help="Only walk this directory of the storage."),
+        make_option('--workers',
+            dest='workers', type='int', default=None,
+            help="Number of worker processes. Defaults to the number of CPUs."),
+    )
+    help = "Move existing thumbnails to the current file layout."
+
+    def handle(self, *args, **options):
+        signature = options['signature']
+        if signature == defaults.FILE_SIGNATURE:
+            raise CommandError(
+                "Thumbnails already use this file signature, set "
+                "THUMBNAILS_FILE_SIGNATURE to the new layout first.")
+        verbosity = int(options.get('verbosity', 1))
+
+        storage = defaults.storage_backend()
+        jobs = ((name, signature)
+            for name in walk(storage, options['prefix']))
+
+        if options['workers'] == 1:
+            pool = None
+            results = imap(migrate, jobs)
+        else:
+            pool = Pool(options['workers'])
+            results = pool.imap_unordered(migrate, jobs, 64)
+
+        files = moved = skipped = failed = 0
+        start = time.time()
+        try:
+            for name, new_name, success in results:
+                files += 1
+                if new_name is None:
+                    skipped += 1
+                elif success:
+                    moved += 1
+                    if verbosity > 1:
+                        self.stdout.write("%s -> %s\n" % (name, new_name))
+                else:
+                    failed += 1
+                    if verbosity > 0:
+                        self.stderr.write("Failed to move %s\n" % name)
+        except:
+            if pool:
+                pool.terminate()
+            raise
+        else:
+            if pool:
+                pool.close()
+                pool.join()
+
+        elapsed = max(time.time() - start, 1e-6)
+        if verbosity > 0:
+            self.stdout.write(
+                "%d files, %d moved, %d skipped, %d failed in %.1fs "
+                "(%.1f files/s)\n" % (
+                    files, moved, skipped, failed, elapsed, files / elapsed))
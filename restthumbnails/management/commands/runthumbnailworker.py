@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+
+from restthumbnails import defaults, queues
+
+from optparse import make_option
+
+import time
+
+
+class Command(BaseCommand):
+    """
+    Generate thumbnails queued on the render queue by views using the
+    QueueExecutor. Run as many workers as needed, on any host sharing the
+    queue and the storage.
+    """
+    option_list = BaseCommand.option_list + (
+        make_option('--poll',
+            dest='poll', type='float', default=0.5,
+            help="Seconds to wait before checking an empty queue again."),
+        make_option('--max-jobs',
+            dest='max_jobs', type='int', default=None,
+            help="Exit after generating this many thumbnails, e.g. to "
+                 "release memory when running under a supervisor."),
+        make_option('--burst',
+            dest='burst', action='store_true', default=False,
+            help="Exit as soon as the queue is empty."),
+        make_option('--stats',
+            dest='stats', action='store_true', default=False,
+            help="Show the number of pending and running jobs of each "
+                 "priority class, and exit."),
+    )
+    help = "Generate thumbnails from the render queue."
+
+    def handle(self, *args, **options):
+        verbosity = int(options.get('verbosity', 1))
+        queue = defaults.render_queue()
+        if options['stats']:
+            stats = queue.stats()
+            for name, priority in sorted(queues.PRIORITIES.items(),
+                    key=lambda item: item[1]):
+                self.stdout.write("%s: %d pending, %d running\n" % (
+                    name, stats[name]['pending'], stats[name]['running']))
+            return
+        start = time.time()
+        done = queues.work(queue,
+            max_jobs=options['max_jobs'],
+            burst=options['burst'],
+            poll_interval=options['poll'])
+        if verbosity > 0:
+            self.stdout.write("%d jobs in %.1fs\n" % (
+                done, time.time() - start))
@@ -0,0 +1,179 @@
+from django.utils.log import getLogger
+
+from restthumbnails import signals
+
+import bisect
+import socket
+import threading
+import time
+
+
+logger = getLogger(__name__)
+
+# Upper bounds of the latency histogram buckets, in milliseconds
+BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+
+def timing(name, seconds, sender=None):
+    """
+    Record how long a stage took, on the metrics sink and through the
+    `timing` signal.
+    """
+    from restthumbnails import defaults
+    defaults.metrics_sink().timing(name, seconds)
+    signals.timing.send(sender=sender, name=name, seconds=seconds)
+
+
+def incr(name, value=1, sender=None):
+    """
+    Add to a counter, on the metrics sink and through the `counter` signal.
+    """
+    from restthumbnails import defaults
+    defaults.metrics_sink().incr(name, value)
+    signals.counter.send(sender=sender, name=name, value=value)
+
+
+def gauge(name, value, sender=None):
+    """
+    Set a gauge, on the metrics sink and through the `gauge` signal.
+    """
+    from restthumbnails import defaults
+    defaults.metrics_sink().gauge(name, value)
+    signals.gauge.send(sender=sender, name=name, value=value)
+
+
+class timer(object):
+    """
+    Context manager recording how long its block took, unless it raised an
+    exception.
+
+    >>> with timer('generate.decode'):
+    ...     im.load()
+
+    """
+    def __init__(self, name, sender=None):
+        self.name = name
+        self.sender = sender
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            timing(self.name, time.time() - self.start, self.sender)
+
+
+class MetricsSinkBase(object):
+    """
+    Abstract class for the destination of timings, counters and gauges.
+    """
+    def timing(self, name, seconds):
+        raise NotImplementedError
+
+    def incr(self, name, value=1):
+        raise NotImplementedError
+
+    def gauge(self, name, value):
+        raise NotImplementedError
+
+
+class NullSink(MetricsSinkBase):
+    """
+    Discard all metrics. Receivers of the signals still get them.
+    """
+    def timing(self, name, seconds):
+        pass
+
+    def incr(self, name, value=1):
+        pass
+
+    def gauge(self, name, value):
+        pass
+
+
+class MemorySink(MetricsSinkBase):
+    """
+    Keep counters, gauges and latency histograms in memory, for the lifetime
+    of the process. They're served as JSON by `StatsView`.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.gauges = {}
+            self.timings = {}
+
+    def timing(self, name, seconds):
+        ms = seconds * 1000
+        with self.lock:
+            try:
+                histogram = self.timings[name]
+            except KeyError:
+                histogram = self.timings[name] = {
+                    'count': 0,
+                    'sum': 0.0,
+                    'max': 0.0,
+                    'buckets': [0] * (len(BUCKETS) + 1),
+                }
+            histogram['count'] += 1
+            histogram['sum'] += ms
+            histogram['max'] = max(histogram['max'], ms)
+            histogram['buckets'][bisect.bisect_left(BUCKETS, ms)] += 1
+
+    def incr(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge(self, name, value):
+        with self.lock:
+            self.gauges[name] = value
+
+    def stats(self):
+        """
+        Return a copy of the counters and gauges, and of the histograms with
+        their buckets keyed by upper bound in milliseconds ("+Inf" for the
+        last).
+        """
+        labels = [str(bound) for bound in BUCKETS] + ['+Inf']
+        with self.lock:
+            return {
+                'counters': dict(self.counters),
+                'gauges': dict(self.gauges),
+                'timings': dict((name, {
+                        'count': histogram['count'],
+                        'sum': histogram['sum'],
+                        'max': histogram['max'],
+                        'buckets': dict(zip(labels, histogram['buckets'])),
+                    }) for name, histogram in self.timings.items()),
+            }
+
+
+class StatsdSink(MetricsSinkBase):
+    """
+    Send metrics to a statsd compatible daemon over UDP, usually listening
+    on the same host. Lost packets and network errors are ignored.
+    """
+    def __init__(self, host='127.0.0.1', port=8125, prefix='restthumbnails'):
+        self.address = (host, port)
+        self.prefix = prefix and prefix + '.' or ''
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def send(self, data):
+        try:
+            self.socket.sendto(data, self.address)
+        except socket.error, e:
+            logger.debug("Failed to send metrics to %s:%d: %s",
+                self.address[0], self.address[1], e)
+
+    def timing(self, name, seconds):
+        self.send('%s%s:%d|ms' % (self.prefix, name, round(seconds * 1000)))
+
+    def incr(self, name, value=1):
+        self.send('%s%s:%d|c' % (self.prefix, name, value))
+
+    def gauge(self, name, value):
+        self.send('%s%s:%d|g' % (self.prefix, name, value))
@@ -0,0 +1,37 @@
+from django.db import models
+
+
+class RenderJob(models.Model):
+    """
+    A thumbnail queued to be generated by `runthumbnailworker` processes,
+    used by `restthumbnails.queues.DatabaseQueue`.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    key = models.CharField(max_length=255, unique=True)
+    source = models.TextField()
+    size = models.CharField(max_length=32)
+    method = models.CharField(max_length=32)
+    extension = models.CharField(max_length=32)
+    format = models.CharField(max_length=32, blank=True)
+    # The priority class, see `restthumbnails.queues.PRIORITIES`
+    priority = models.PositiveSmallIntegerField(default=0, db_index=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES,
+                              default=PENDING, db_index=True)
+    result = models.NullBooleanField()
+    error = models.TextField(blank=True)
+    queued = models.DateTimeField(db_index=True)
+    started = models.DateTimeField(null=True)
+    finished = models.DateTimeField(null=True)
+
+    def __unicode__(self):
+        return self.key
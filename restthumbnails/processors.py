@@ -29,11 +29,6 @@ ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
 SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 
-try:
-    from cStringIO import StringIO
-except ImportError:
-    from StringIO import StringIO
-
 try:
     from PIL import Image, ImageChops, ImageFilter
 except ImportError:
@@ -41,12 +36,43 @@ except ImportError:
     import ImageChops
     import ImageFilter
 
-from django.core.files.base import ContentFile
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from django.core.files.base import File
 
 from restthumbnails import exceptions
 
-import re
+import inspect
 import math
+import re
+import tempfile
+
+
+# Files up to this size are kept in memory when spooling, bigger ones are
+# rolled over to a temporary file on disk.
+SPOOL_MAX_SIZE = 1024 * 1024
+
+# Operations turning an image stored with an EXIF orientation value upright.
+ORIENTATION_TRANSPOSE = {
+    2: Image.FLIP_LEFT_RIGHT,
+    3: Image.ROTATE_180,
+    4: Image.FLIP_TOP_BOTTOM,
+    5: Image.TRANSPOSE,
+    6: Image.ROTATE_270,
+    7: Image.TRANSVERSE,
+    8: Image.ROTATE_90,
+}
+
+# Arguments of Image.resize, which vary between PIL versions.
+_RESIZE_ARGS = inspect.getargspec(Image.Image.resize).args
+
+# Raised by Image.open for huge images, on Pillow 5 and later. Older
+# versions only warn.
+DecompressionBombError = getattr(Image, 'DecompressionBombError', ())
+
 
 
 def _is_transparent(image):
@@ -65,29 +91,68 @@ def _exif_orientation(im):
     """
     Rotate and/or flip an image to respect the image's EXIF orientation data.
     """
-    try:
-        exif = im._getexif()
-    except (AttributeError, IndexError, KeyError, IOError):
-        exif = None
-    if exif:
-        orientation = exif.get(0x0112)
-        if orientation == 2:
-            im = im.transpose(Image.FLIP_LEFT_RIGHT)
-        elif orientation == 3:
-            im = im.rotate(180)
-        elif orientation == 4:
-            im = im.transpose(Image.FLIP_TOP_BOTTOM)
-        elif orientation == 5:
-            im = im.rotate(-90).transpose(Image.FLIP_LEFT_RIGHT)
-        elif orientation == 6:
-            im = im.rotate(-90)
-        elif orientation == 7:
-            im = im.rotate(90).transpose(Image.FLIP_LEFT_RIGHT)
-        elif orientation == 8:
-            im = im.rotate(90)
+    return _transpose(im, get_orientation(im))
+
+
+def _transpose(im, orientation):
+    """
+    Rotate and/or flip an image according to an EXIF orientation value.
+    Transposing is lossless, and much cheaper than rotating.
+    """
+    if orientation in ORIENTATION_TRANSPOSE:
+        im = im.transpose(ORIENTATION_TRANSPOSE[orientation])
     return im
 
 
+def _orient_size(size, orientation):
+    """
+    Return the size of an image once transposed according to an EXIF
+    orientation value, or the other way around.
+    """
+    if orientation in (5, 6, 7, 8):
+        return (size[1], size[0])
+    return tuple(size)
+
+
+def _orient_box(box, size, orientation):
+    """
+    Map a box of an oriented image of the given ``size`` to the same region
+    of the image before being transposed.
+    """
+    if box is None or orientation not in ORIENTATION_TRANSPOSE:
+        return box
+    width, height = size
+    left, top, right, bottom = box
+    if orientation == 2:
+        box = (width - right, top, width - left, bottom)
+    elif orientation == 3:
+        box = (width - right, height - bottom, width - left, height - top)
+    elif orientation == 4:
+        box = (left, height - bottom, right, height - top)
+    elif orientation == 5:
+        box = (top, left, bottom, right)
+    elif orientation == 6:
+        box = (top, width - right, bottom, width - left)
+    elif orientation == 7:
+        box = (height - bottom, width - right, height - top, width - left)
+    elif orientation == 8:
+        box = (height - bottom, left, height - top, right)
+    return box
+
+
+def _histogram_entropy(hist):
+    """
+    Calculate the entropy of an image histogram.
+    """
+    if numpy is not None:
+        hist = numpy.array(hist, numpy.float64)
+        hist = hist[hist.nonzero()]
+        total = hist.sum()
+        return float(numpy.log2(total) - (hist * numpy.log2(hist)).sum() / total)
+    total = float(sum(hist))
+    return math.log(total, 2) - sum([h * math.log(h, 2) for h in hist if h]) / total
+
+
 def _image_entropy(im):
     """
     Calculate the entropy of an image. Used for "smart cropping".
@@ -95,21 +160,16 @@ def _image_entropy(im):
     if not isinstance(im, Image.Image):
         # Can only deal with PIL images. Fall back to a constant entropy.
         return 0
-    hist = im.histogram()
-    hist_size = float(sum(hist))
-    hist = [h / hist_size for h in hist]
-    return -sum([p * math.log(p, 2) for p in hist if p != 0])
+    return _histogram_entropy(im.histogram())
 
 
-def _compare_entropy(start_slice, end_slice, slice, difference):
+def _compare_entropy(start_entropy, end_entropy, slice, difference):
     """
-    Calculate the entropy of two slices (from the start and end of an axis),
+    Compare the entropy of two slices (from the start and end of an axis),
     returning a tuple containing the amount that should be added to the start
     and removed from the end of the axis.
 
     """
-    start_entropy = _image_entropy(start_slice)
-    end_entropy = _image_entropy(end_slice)
     if end_entropy and abs(start_entropy / end_entropy - 1) < 0.01:
         # Less than 1% difference, remove from both sides.
         if difference >= slice * 2:
@@ -122,24 +182,346 @@ def _compare_entropy(start_slice, end_slice, slice, difference):
         return slice, 0
 
 
-def get_image(source, exif_orientation=True, **options):
+def _smart_crop_box(im, diff_x, diff_y, proxy_size=None, size=None,
+                    orientation=None):
+    """
+    Calculate the box for "smart cropping" an image by ``diff_x`` and
+    ``diff_y`` pixels, incrementally removing slices from the edges with the
+    least entropy.
+
+    If ``proxy_size`` is given and the image is larger than that, entropy is
+    calculated on a copy downsampled to fit within ``proxy_size`` pixels, and
+    the box is scaled back. The box then has the same size, but its position
+    may be off by a few proxy pixels compared to the one calculated on the
+    full image (within 10% of the image size with a proxy of 200 pixels).
+    The proxy can also be taken from a larger version of the image, in which
+    case ``size`` is the size of the image the box is calculated for, and
+    from a version not transposed to its EXIF ``orientation`` yet.
+    """
+    source_x, source_y = size or im.size
+    if proxy_size and max(source_x, source_y) > proxy_size:
+        factor = float(proxy_size) / max(source_x, source_y)
+        proxy = im.resize(_orient_size((max(1, int(round(source_x * factor))),
+                                        max(1, int(round(source_y * factor)))),
+                                       orientation),
+                          resample=Image.NEAREST)
+        proxy = _transpose(proxy, orientation)
+        left, top, right, bottom = _smart_crop_box(proxy,
+            min(int(round(diff_x * factor)), proxy.size[0] - 1),
+            min(int(round(diff_y * factor)), proxy.size[1] - 1))
+        left = min(int(round(left / factor)), diff_x)
+        top = min(int(round(top / factor)), diff_y)
+        return (left, top,
+                left + source_x - diff_x,
+                top + source_y - diff_y)
+
+    left = top = 0
+    right, bottom = source_x, source_y
+    while diff_x:
+        slice = min(diff_x, max(diff_x // 5, 10))
+        start = im.crop((left, 0, left + slice, source_y))
+        end = im.crop((right - slice, 0, right, source_y))
+        add, remove = _compare_entropy(
+            _image_entropy(start), _image_entropy(end), slice, diff_x)
+        left += add
+        right -= remove
+        diff_x = diff_x - add - remove
+    while diff_y:
+        slice = min(diff_y, max(diff_y // 5, 10))
+        start = im.crop((0, top, source_x, top + slice))
+        end = im.crop((0, bottom - slice, source_x, bottom))
+        add, remove = _compare_entropy(
+            _image_entropy(start), _image_entropy(end), slice, diff_y)
+        top += add
+        bottom -= remove
+        diff_y = diff_y - add - remove
+    return (left, top, right, bottom)
+
+
+def get_orientation(im):
+    """
+    Return the EXIF orientation tag of an image, or None if there's none.
+    """
+    try:
+        exif = im._getexif()
+    except (AttributeError, IndexError, KeyError, IOError):
+        exif = None
+    if exif:
+        return exif.get(0x0112)
+    return None
+
+
+def _scale(image_size, size, crop=False):
+    """
+    Calculate the factor used by :func:`scale_and_crop` to scale an image to
+    the target size boundary.
+    """
+    source_x, source_y = [float(v) for v in image_size]
+    target_x, target_y = [float(v) for v in size]
+    if crop or not target_x or not target_y:
+        return max(target_x / source_x, target_y / source_y)
+    return min(target_x / source_x, target_y / source_y)
+
+
+def _plan(image_size, size, crop=False, upscale=True):
+    """
+    Plan the work done by :func:`scale_and_crop`, without touching any pixel.
+
+    Return a ``(scaled_size, box)`` tuple, where ``scaled_size`` is the size
+    the image is scaled to, and ``box`` is the region of the scaled image
+    that is kept, or None if nothing is cropped. For smart crops, the box
+    position depends on the image contents, so it's returned as
+    ``('smart', diff_x, diff_y)``.
+    """
+    source_x, source_y = [float(v) for v in image_size]
+    target_x, target_y = [float(v) for v in size]
+    scale = _scale(image_size, size, crop)
+
+    # Handle one-dimensional targets.
+    if not target_x:
+        target_x = source_x * scale
+    elif not target_y:
+        target_y = source_y * scale
+
+    if scale < 1.0 or (scale > 1.0 and upscale):
+        # Round the scaled boundary sizes to avoid floating point errors.
+        scaled_size = (int(round(source_x * scale)),
+                       int(round(source_y * scale)))
+    else:
+        scaled_size = tuple(image_size)
+
+    if not crop or crop == 'scale':
+        return scaled_size, None
+
+    # Use integer values now.
+    source_x, source_y = scaled_size
+    # Difference between new image size and requested size.
+    diff_x = int(source_x - min(source_x, target_x))
+    diff_y = int(source_y - min(source_y, target_y))
+    if not diff_x and not diff_y:
+        return scaled_size, None
+
+    # Center cropping (default).
+    halfdiff_x, halfdiff_y = diff_x // 2, diff_y // 2
+    box = [halfdiff_x, halfdiff_y,
+           min(source_x, int(target_x) + halfdiff_x),
+           min(source_y, int(target_y) + halfdiff_y)]
+    # See if an edge cropping argument was provided.
+    edge_crop = (isinstance(crop, basestring) and
+                 re.match(r'(?:(-?)(\d+))?,(?:(-?)(\d+))?$', crop))
+    if edge_crop and filter(None, edge_crop.groups()):
+        x_right, x_crop, y_bottom, y_crop = edge_crop.groups()
+        if x_crop:
+            offset = min(int(target_x) * int(x_crop) // 100, diff_x)
+            if x_right:
+                box[0] = diff_x - offset
+                box[2] = source_x - offset
+            else:
+                box[0] = offset
+                box[2] = source_x - (diff_x - offset)
+        if y_crop:
+            offset = min(int(target_y) * int(y_crop) // 100, diff_y)
+            if y_bottom:
+                box[1] = diff_y - offset
+                box[3] = source_y - offset
+            else:
+                box[1] = offset
+                box[3] = source_y - (diff_y - offset)
+    # See if the image should be "smart cropped".
+    elif crop == 'smart':
+        return scaled_size, ('smart', diff_x, diff_y)
+    return scaled_size, tuple(box)
+
+
+def get_thumbnail_size(image_size, size, crop=False, upscale=True,
+                       orientation=None):
+    """
+    Return the size of the image returned by :func:`scale_and_crop` for an
+    image of the given size, without opening it.
+    """
+    scaled_size, box = _plan(_orient_size(image_size, orientation), size,
+                             crop, upscale)
+    if box is None:
+        return scaled_size
+    if box[0] == 'smart':
+        __, diff_x, diff_y = box
+        return (scaled_size[0] - diff_x, scaled_size[1] - diff_y)
+    return (box[2] - box[0], box[3] - box[1])
+
+
+def _resize_options(reducing_gap=None):
+    """
+    Return the options supported by the installed PIL version for
+    :meth:`Image.resize`, along with the resampling filter.
+    """
+    options = {'resample': Image.ANTIALIAS}
+    if reducing_gap and 'reducing_gap' in _RESIZE_ARGS:
+        options['reducing_gap'] = reducing_gap
+    return options
+
+
+def _resize(im, scaled_size, box=None, reducing_gap=None):
+    """
+    Scale an image to ``scaled_size`` and crop the result to ``box``. Only
+    the region of the image within the box is resampled, which gives the
+    same result as scaling the whole image, for a fraction of the work.
+    """
+    if tuple(scaled_size) == im.size:
+        if box is None:
+            return im
+        return im.crop(box)
+    options = _resize_options(reducing_gap)
+    if box is None:
+        return im.resize(scaled_size, **options)
+    if 'box' not in _RESIZE_ARGS:
+        # PIL < 4.2 can't resample a region.
+        return im.resize(scaled_size, **options).crop(box)
+    factor_x = float(im.size[0]) / scaled_size[0]
+    factor_y = float(im.size[1]) / scaled_size[1]
+    return im.resize((box[2] - box[0], box[3] - box[1]),
+                     box=(box[0] * factor_x, box[1] * factor_y,
+                          box[2] * factor_x, box[3] * factor_y),
+                     **options)
+
+
+def _draft_size(image_size, size, crop=False, orientation=None):
+    """
+    Calculate the smallest decoded size that can still be downscaled to the
+    requested thumbnail size, following the same scaling rules as
+    :func:`scale_and_crop`. Return None if the image must be decoded at full
+    resolution.
+    """
+    source_x, source_y = [float(v) for v in image_size]
+    if orientation in (5, 6, 7, 8):
+        # The target is given in the oriented coordinates, but the image is
+        # decoded before being rotated.
+        size = tuple(reversed(size))
+
+    scale = _scale(image_size, size, crop)
+    if not 0 < scale < 1.0:
+        return None
+    return (int(math.ceil(source_x * scale)),
+            int(math.ceil(source_y * scale)))
+
+
+def _is_seekable(source):
+    """
+    Check if a file-like object supports random access, as required by PIL.
+    """
+    try:
+        source.seek(source.tell())
+    except (AttributeError, IOError, OSError, ValueError):
+        return False
+    return True
+
+
+def _spool(source):
+    """
+    Copy a non-seekable file-like object into a temporary file, which is
+    kept in memory only when it's small.
+    """
+    spooled = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    if hasattr(source, 'chunks'):
+        for chunk in source.chunks():
+            spooled.write(chunk)
+    else:
+        while True:
+            chunk = source.read(File.DEFAULT_CHUNK_SIZE)
+            if not chunk:
+                break
+            spooled.write(chunk)
+    spooled.seek(0)
+    return spooled
+
+
+def open_image(source):
+    """
+    Open an image with PIL, reading only its header. Raise SourceTooLarge
+    instead of the DecompressionBombError PIL raises for images with much
+    more than `Image.MAX_IMAGE_PIXELS` pixels.
+    """
+    try:
+        return Image.open(source)
+    except DecompressionBombError, e:
+        raise exceptions.SourceTooLarge(str(e))
+
+
+def get_decoded_size(image):
+    """
+    Estimate the bytes PIL needs to hold an opened image once it's decoded,
+    at its draft size. PIL keeps most modes in 32 bits per pixel.
+    """
+    width, height = image.size
+    if image.mode in ('1', 'L', 'P'):
+        depth = 1
+    elif image.mode.startswith('I;16'):
+        depth = 2
+    else:
+        depth = 4
+    return width * height * depth
+
+
+def get_image(source, exif_orientation=True, size=None, crop=False,
+              sizes=None, info=None, admit=None, **options):
     """
     Try to open the source file directly using PIL, ignoring any errors.
 
     exif_orientation
 
         If EXIF orientation data is present, perform any required reorientation
-        before passing the data along the processing pipeline.
+        before passing the data along the processing pipeline. It's cheaper
+        to pass False, and the value returned by :func:`get_orientation` to
+        :func:`scale_and_crop` instead, so only the thumbnail is transposed.
 
-    """
-    # Use a StringIO wrapper because if the source is an incomplete file like
-    # object, PIL may have problems with it. For example, some image types
-    # require tell and seek methods that are not present on all storage
-    # File objects.
+    size
+
+        The requested thumbnail size. When given, JPEG sources are decoded
+        using PIL's draft mode at the smallest scale (1/2, 1/4 or 1/8) that
+        is still larger than the thumbnail, which is much cheaper than
+        decoding at full resolution. Use the same ``crop`` argument that will
+        be passed to :func:`scale_and_crop`.
+
+    sizes
+
+        A list of ``(size, crop)`` tuples, when the image is going to be
+        scaled to many sizes. The image is decoded at a scale suitable for
+        all of them.
+
+    info
+
+        A dict updated with the ``size``, ``format`` and ``orientation`` of
+        the source, as read from its header, before it's decoded at a smaller
+        scale.
 
-    source = StringIO(source.read())
+    admit
 
-    image = Image.open(source)
+        A function called with the image once its header is read and its
+        draft scale is set, before it's decoded. It can raise an exception
+        to keep the image from being decoded, e.g. when it's too large.
+
+    """
+    # PIL reads the source lazily and some image types require tell and seek
+    # methods that are not present on all storage File objects, so only
+    # spool the source when it can't be read directly.
+    if not _is_seekable(source):
+        source = _spool(source)
+
+    image = open_image(source)
+    orientation = get_orientation(image)
+    if info is not None:
+        info.update(size=image.size, format=image.format,
+                    orientation=orientation)
+    targets = list(sizes or ())
+    if size:
+        targets.append((size, crop))
+    if targets and image.format == 'JPEG':
+        draft_sizes = [_draft_size(image.size, target, target_crop, orientation)
+                       for target, target_crop in targets]
+        if None not in draft_sizes:
+            image.draft(image.mode, (max(x for x, y in draft_sizes),
+                                     max(y for x, y in draft_sizes)))
+    if admit is not None:
+        admit(image)
     # Fully load the image now to catch any problems with the image
     # contents.
     image.load()
@@ -149,25 +531,43 @@ def get_image(source, exif_orientation=True, **options):
     return image
 
 
+def can_save(format):
+    """
+    Check if PIL is able to encode images in the given format.
+    """
+    Image.init()
+    return format in Image.SAVE
+
+
 def save_image(image, format='JPEG', **options):
     """
-    Save a PIL image to memory and return a StringIO instance.
+    Save a PIL image to a temporary file and return a File instance, ready to
+    be written to a storage backend.
+
+    Options are passed to the PIL encoder, like ``quality``, ``progressive``
+    and ``subsampling`` for JPEG images.
     """
-    destination = StringIO()
+    destination = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
     if format == 'JPEG':
         options.setdefault('quality', 85)
-        try:
-            image.save(destination, format=format, optimize=1, **options)
-        except IOError:
-            # Try again, without optimization (PIL can't optimize an image
-            # larger than ImageFile.MAXBLOCK, which is 64k by default)
-            pass
-    image.save(destination, format=format, **options)
-    if hasattr(destination, 'seek'):
+        options.setdefault('optimize', True)
+    elif format == 'PNG':
+        options.setdefault('optimize', True)
+    elif format == 'WEBP':
+        options.setdefault('quality', 80)
+    try:
+        image.save(destination, format=format, **options)
+    except IOError:
+        if not options.pop('optimize', False):
+            raise
+        # Try again, without optimization (PIL can't optimize an image
+        # larger than ImageFile.MAXBLOCK, which is 64k by default)
         destination.seek(0)
-    # FIXME: Copying to memory back and forth just because
-    # storage expects an object which implements a `chunks` method
-    return ContentFile(destination.read())
+        destination.truncate()
+        image.save(destination, format=format, **options)
+    content = File(destination)
+    content.size = destination.tell()
+    return content
 
 
 def colorspace(im, bw=False, replace_alpha=False, **kwargs):
@@ -213,6 +613,27 @@ def colorspace(im, bw=False, replace_alpha=False, **kwargs):
     return im.convert('RGB')
 
 
+def get_placeholder(im, size=20, orientation=None):
+    """
+    Return a tiny, heavily compressed JPEG version of an image that may not
+    be transposed to its EXIF ``orientation`` yet, as a string of at most a
+    few hundred bytes. It's meant to be inlined in pages while the thumbnail
+    loads, and looks blurred once scaled up by browsers.
+    """
+    placeholder = colorspace(im, replace_alpha='#fff')
+    scaled_size = _plan(_orient_size(im.size, orientation), (size, size),
+                        upscale=False)[0]
+    placeholder = _transpose(
+        _resize(placeholder, _orient_size(scaled_size, orientation)),
+        orientation)
+    content = save_image(placeholder, 'JPEG', quality=30)
+    try:
+        content.seek(0)
+        return content.read()
+    finally:
+        content.close()
+
+
 def autocrop(im, **kwargs):
     """
     Remove any unnecessary whitespace from the edges of the source image.
@@ -228,7 +649,8 @@ def autocrop(im, **kwargs):
     return im
 
 
-def scale_and_crop(im, size, crop=False, upscale=True, **kwargs):
+def scale_and_crop(im, size, crop=False, upscale=True, smart_proxy_size=None,
+                   reducing_gap=None, orientation=None, **kwargs):
     """
     Handle scaling and cropping the source image.
 
@@ -266,86 +688,97 @@ def scale_and_crop(im, size, crop=False, upscale=True, **kwargs):
     upscale
         Allow upscaling of the source image during scaling.
 
+    smart_proxy_size
+        When smart cropping images larger than this size, calculate the
+        entropy on a downsampled copy. This is faster, but the crop box may be
+        slightly off (see :func:`_smart_crop_box`).
+
+    reducing_gap
+        Passed to :meth:`Image.resize` on PIL versions supporting it, to
+        speed up large downscales at the cost of some precision.
+
+    orientation
+        The EXIF orientation of an image that wasn't transposed yet (see
+        :func:`get_image`). The size and crop apply to the upright image, but
+        only the thumbnail is transposed.
+
     """
-    source_x, source_y = [float(v) for v in im.size]
-    target_x, target_y = [float(v) for v in size]
+    scaled_size, box = _plan(_orient_size(im.size, orientation), size, crop,
+                             upscale)
+    return _scale_and_crop(im, scaled_size, box, smart_proxy_size,
+                           reducing_gap, orientation)[0]
 
-    if crop or not target_x or not target_y:
-        scale = max(target_x / source_x, target_y / source_y)
-    else:
-        scale = min(target_x / source_x, target_y / source_y)
 
-    # Handle one-dimensional targets.
-    if not target_x:
-        target_x = source_x * scale
-    elif not target_y:
-        target_y = source_y * scale
+def _scale_and_crop(im, scaled_size, box, smart_proxy_size=None,
+                    reducing_gap=None, orientation=None):
+    """
+    Carry out the plan returned by :func:`_plan`, on an image that may not be
+    transposed to its EXIF ``orientation`` yet. Return a tuple of the final
+    image and, when the whole image had to be scaled on the way, the scaled
+    image (not transposed).
+    """
+    if box is not None and box[0] == 'smart':
+        __, diff_x, diff_y = box
+        if smart_proxy_size and max(scaled_size) > smart_proxy_size:
+            # The proxy is taken from the unscaled image, so only the kept
+            # region needs to be scaled.
+            box = _smart_crop_box(im, diff_x, diff_y, smart_proxy_size,
+                                  scaled_size, orientation)
+        else:
+            # Entropy is calculated on the scaled image.
+            scaled = _resize(im, _orient_size(scaled_size, orientation),
+                             reducing_gap=reducing_gap)
+            im = _transpose(scaled, orientation)
+            return im.crop(_smart_crop_box(im, diff_x, diff_y)), scaled
+    scaled = _resize(im, _orient_size(scaled_size, orientation),
+                     _orient_box(box, scaled_size, orientation), reducing_gap)
+    im = _transpose(scaled, orientation)
+    if box is None:
+        return im, scaled
+    return im, None
+
+
+def scale_and_crop_many(im, sizes, upscale=True, smart_proxy_size=None,
+                        reducing_gap=None, orientation=None, image_size=None,
+                        **kwargs):
+    """
+    Handle scaling and cropping the source image to many sizes at once.
 
-    if scale < 1.0 or (scale > 1.0 and upscale):
-        # Resize the image to the target size boundary. Round the scaled
-        # boundary sizes to avoid floating point errors.
-        im = im.resize((int(round(source_x * scale)),
-                        int(round(source_y * scale))),
-                       resample=Image.ANTIALIAS)
-
-    if crop:
-        # Use integer values now.
-        source_x, source_y = im.size
-        # Difference between new image size and requested size.
-        diff_x = int(source_x - min(source_x, target_x))
-        diff_y = int(source_y - min(source_y, target_y))
-        if diff_x or diff_y:
-            # Center cropping (default).
-            halfdiff_x, halfdiff_y = diff_x // 2, diff_y // 2
-            box = [halfdiff_x, halfdiff_y,
-                   min(source_x, int(target_x) + halfdiff_x),
-                   min(source_y, int(target_y) + halfdiff_y)]
-            # See if an edge cropping argument was provided.
-            edge_crop = (isinstance(crop, basestring) and
-                         re.match(r'(?:(-?)(\d+))?,(?:(-?)(\d+))?$', crop))
-            if edge_crop and filter(None, edge_crop.groups()):
-                x_right, x_crop, y_bottom, y_crop = edge_crop.groups()
-                if x_crop:
-                    offset = min(int(target_x) * int(x_crop) // 100, diff_x)
-                    if x_right:
-                        box[0] = diff_x - offset
-                        box[2] = source_x - offset
-                    else:
-                        box[0] = offset
-                        box[2] = source_x - (diff_x - offset)
-                if y_crop:
-                    offset = min(int(target_y) * int(y_crop) // 100, diff_y)
-                    if y_bottom:
-                        box[1] = diff_y - offset
-                        box[3] = source_y - offset
-                    else:
-                        box[1] = offset
-                        box[3] = source_y - (diff_y - offset)
-            # See if the image should be "smart cropped".
-            elif crop == 'smart':
-                left = top = 0
-                right, bottom = source_x, source_y
-                while diff_x:
-                    slice = min(diff_x, max(diff_x // 5, 10))
-                    start = im.crop((left, 0, left + slice, source_y))
-                    end = im.crop((right - slice, 0, right, source_y))
-                    add, remove = _compare_entropy(start, end, slice, diff_x)
-                    left += add
-                    right -= remove
-                    diff_x = diff_x - add - remove
-                while diff_y:
-                    slice = min(diff_y, max(diff_y // 5, 10))
-                    start = im.crop((0, top, source_x, top + slice))
-                    end = im.crop((0, bottom - slice, source_x, bottom))
-                    add, remove = _compare_entropy(start, end, slice, diff_y)
-                    top += add
-                    bottom -= remove
-                    diff_y = diff_y - add - remove
-                box = (left, top, right, bottom)
-            # Finally, crop the image!
-            if crop != 'scale':
-                im = im.crop(box)
-    return im
+    ``sizes`` is a list of ``(size, crop)`` tuples, with the same meaning as
+    in :func:`scale_and_crop`, and a list of images is returned in the same
+    order.
+
+    Instead of resizing the full source image every time, images are scaled
+    from the largest to the smallest, and each one is resized from the
+    smallest intermediate image that is still larger than it.
+
+    Pass the size of the source before it was decoded at a smaller scale
+    as ``image_size`` (see the ``info`` argument of :func:`get_image`), so
+    thumbnail sizes don't depend on the rounding of the decoded size, and
+    match :func:`get_thumbnail_size`.
+
+    """
+    image_size = _orient_size(image_size or im.size, orientation)
+    plans = [_plan(image_size, size, crop, upscale) for size, crop in sizes]
+    levels = [im]
+    images = [None] * len(sizes)
+    order = sorted(range(len(sizes)), reverse=True,
+                   key=lambda i: plans[i][0])
+    for i in order:
+        scaled_size, box = plans[i]
+        # Intermediate images are not transposed yet.
+        raw_x, raw_y = _orient_size(scaled_size, orientation)
+        if raw_x > im.size[0] or raw_y > im.size[1]:
+            base = im
+        else:
+            base = min((level for level in levels
+                        if level.size[0] >= raw_x and level.size[1] >= raw_y),
+                       key=lambda level: level.size)
+        images[i], scaled = _scale_and_crop(base, scaled_size, box,
+            smart_proxy_size, reducing_gap, orientation)
+        if scaled is not None and scaled is not base:
+            levels.append(scaled)
+    return images
 
 
 def filters(im, detail=False, sharpen=False, **kwargs):
@@ -3,10 +3,13 @@ from django.utils.encoding import filepath_to_uri
 
 from restthumbnails.base import ThumbnailBase
 
+import base64
 import urlparse
 
 
 class ThumbnailProxyBase(ThumbnailBase):
+    __slots__ = ()
+
     @property
     def url(self):
         raise NotImplementedError
@@ -21,26 +24,81 @@ class ThumbnailProxy(ThumbnailProxyBase):
     'http://example.com/path/to/file.jpg/200x200/crop/<random_hash>.jpg'
 
     """
+    __slots__ = ('base_url', '_url', '_info', '_dimensions')
+
     def __init__(self, **kwargs):
         from restthumbnails import defaults
+        self._url = None
+        self._info = self._dimensions = False
         self.base_url = defaults.THUMBNAIL_PROXY_BASE_URL
         super(ThumbnailProxy, self).__init__(**kwargs)
 
+    @property
+    def info(self):
+        """
+        The SourceInfo of the source found in the source index (see
+        THUMBNAILS_SOURCE_INDEX), or None if it's not indexed.
+        """
+        if self._info is False:
+            from restthumbnails import defaults
+            index = defaults.source_index()
+            self._info = index.get(self.source) if index is not None else None
+        return self._info
+
+    @property
+    def dimensions(self):
+        """
+        The size of the thumbnail, computed from the size of the source, or
+        None if it's unknown.
+        """
+        if self._dimensions is False:
+            self._dimensions = None
+            if self.info is not None:
+                from restthumbnails import processors
+                self._dimensions = processors.get_thumbnail_size(
+                    (self.info.width, self.info.height), self.size,
+                    self.method, orientation=self.info.orientation)
+        return self._dimensions
+
+    @property
+    def width(self):
+        return self.dimensions and self.dimensions[0]
+
+    @property
+    def height(self):
+        return self.dimensions and self.dimensions[1]
+
+    @property
+    def placeholder(self):
+        """
+        A tiny version of the source as a data URI, to show while the
+        thumbnail loads, or None if there's none.
+        """
+        if self.info is None or not self.info.placeholder:
+            return None
+        return 'data:image/jpeg;base64,' + base64.b64encode(
+            self.info.placeholder)
+
     @property
     def url(self):
-        url = self.file_signature % {
-            'source': filepath_to_uri(self.source),
-            'size': self.size_string,
-            'method': self.method,
-            'secret': self.secret,
-            'extension': self.extension}
-        return urlparse.urljoin(self.base_url, url)
+        if self._url is None:
+            url = self.file_signature % {
+                'shard': self.shard,
+                'source': filepath_to_uri(self.source),
+                'size': self.size_string,
+                'method': self.method,
+                'secret': self.secret,
+                'extension': self.extension}
+            self._url = urlparse.urljoin(self.base_url, url)
+        return self._url
 
 
 class DummyImageProxy(ThumbnailBase):
     """
     A dummy proxy that always returns a URL from the dummyimage.com site.
     """
+    __slots__ = ()
+
     url_template = 'http://dummyimage.com/%(width)sx%(height)s'
 
     @property
@@ -48,3 +106,51 @@ class DummyImageProxy(ThumbnailBase):
         return self.url_template % {
             'width': self.size[0] or self.size[1],
             'height': self.size[1]}
+
+
+class ThumbnailSrcset(object):
+    """
+    The thumbnails of a source at several sizes, rendered as the `srcset`
+    attribute of an image. Thumbnails are described by their width when the
+    source is indexed, and by their density otherwise, relative to `size`,
+    the size the thumbnails were requested at before any snapping (see
+    THUMBNAILS_SIZE_LADDER). It defaults to the size of the first thumbnail.
+
+    >>> thumbs = get_thumbnail_srcset('path/to/file.jpg', '200x', 'scale', '.jpg')
+    >>> thumbs.src
+    '/thumbnails/path/to/file.jpg/200x0/scale/<random_hash>.jpg'
+    >>> thumbs.srcset
+    '/thumbnails/path/to/file.jpg/200x0/scale/<random_hash>.jpg 1x, /thumbnails/path/to/file.jpg/400x0/scale/<random_hash>.jpg 2x'
+
+    """
+    __slots__ = ('thumbnails', 'size')
+
+    def __init__(self, thumbnails, size=None):
+        self.thumbnails = thumbnails
+        self.size = size or thumbnails[0].size
+
+    def __iter__(self):
+        return iter(self.thumbnails)
+
+    def __len__(self):
+        return len(self.thumbnails)
+
+    @property
+    def src(self):
+        return self.thumbnails[0].url
+
+    @property
+    def srcset(self):
+        widths = [getattr(thumbnail, 'width', None)
+            for thumbnail in self.thumbnails]
+        if all(widths):
+            descriptors = ['%dw' % width for width in widths]
+        else:
+            base = float(max(self.size))
+            descriptors = ['%gx' % round(max(thumbnail.size) / base, 2)
+                for thumbnail in self.thumbnails]
+        return ', '.join('%s %s' % (thumbnail.url, descriptor)
+            for thumbnail, descriptor in zip(self.thumbnails, descriptors))
+
+    def __unicode__(self):
+        return self.srcset
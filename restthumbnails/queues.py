@@ -0,0 +1,571 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Min
+from django.utils import timezone
+from django.utils.log import getLogger
+
+from restthumbnails import exceptions, metrics
+
+import datetime
+import errno
+import hashlib
+import json
+import os
+import time
+
+
+logger = getLogger(__name__)
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# Priority classes, from the most to the least urgent
+INTERACTIVE = 0
+PREFETCH = 1
+BATCH = 2
+PRIORITIES = {
+    'interactive': INTERACTIVE,
+    'prefetch': PREFETCH,
+    'batch': BATCH,
+}
+PRIORITY_NAMES = dict((value, name) for name, value in PRIORITIES.items())
+
+STRICT = 'strict'
+WEIGHTED = 'weighted'
+
+
+def parse_priority(priority):
+    """
+    Return the priority class given by its name or value.
+    """
+    if priority in PRIORITY_NAMES:
+        return priority
+    try:
+        return PRIORITIES[priority]
+    except (KeyError, TypeError):
+        raise ValueError("'%s' is not a priority class, use one of %s." % (
+            priority, ', '.join(sorted(PRIORITIES))))
+
+
+def get_job(thumbnail, priority=INTERACTIVE):
+    """
+    Return the job generating a thumbnail, as a dict of plain values.
+    """
+    return {
+        'key': thumbnail.key,
+        'source': thumbnail.source,
+        'size': thumbnail.size_string,
+        'method': thumbnail.method,
+        'extension': thumbnail.extension,
+        'format': thumbnail.format,
+        'priority': priority,
+    }
+
+
+class RenderQueueBase(object):
+    """
+    Abstract queue of thumbnails to be generated by `runthumbnailworker`
+    processes. Jobs are identified by the key of their thumbnail, so a
+    thumbnail is only queued once at a time.
+
+    Each job belongs to a priority class. With `strict` scheduling, workers
+    always take jobs from the most urgent class first; with `weighted`
+    scheduling, classes share workers in proportion to their `weights`.
+    Classes whose oldest job has been pending for more than `max_age`
+    seconds get a job at least every `max_age` seconds on each worker, so
+    none starve, and `concurrency` limits how many jobs of a class run at
+    once on all workers.
+
+    Jobs running for more than `stale_after` seconds are considered abandoned
+    by a crashed worker, and queued again. The status of finished jobs is
+    kept for `keep_finished` seconds. Workers look for both at least every
+    `stale_after / 2` seconds, and whenever they run out of jobs.
+
+    Workers also send the number of pending and running jobs of each class
+    to the metrics sink every `report_interval` seconds.
+    """
+    report_interval = 10
+    def __init__(self, location=None, stale_after=60, keep_finished=60,
+                 scheduling=STRICT, weights=None, max_age=None,
+                 concurrency=None):
+        if scheduling not in (STRICT, WEIGHTED):
+            raise ValueError("'%s' is not a scheduling policy, use '%s' or "
+                             "'%s'." % (scheduling, STRICT, WEIGHTED))
+        self.location = location
+        self.stale_after = stale_after
+        self.keep_finished = keep_finished
+        self.scheduling = scheduling
+        self.weights = dict((parse_priority(priority), weight)
+            for priority, weight in (weights or {}).items())
+        self.max_age = max_age
+        self.concurrency = dict((parse_priority(priority), limit)
+            for priority, limit in (concurrency or {}).items())
+        self.credits = dict.fromkeys(PRIORITY_NAMES, 0)
+        self.served = {}
+        self.cleaned = 0
+        self.reported = 0
+
+    def put(self, job):
+        """
+        Queue a job, unless it's already pending or running. A pending job
+        is moved to the class of the new one if that's more urgent. Return
+        True if it was queued.
+        """
+        raise NotImplementedError
+
+    def get(self):
+        """
+        Claim the next job as given by the scheduling policy, and return it,
+        or None if there's none.
+        """
+        # Abandoned jobs are queued again while there's a backlog too, but
+        # the queue isn't cleaned up on every call.
+        if time.time() - self.cleaned >= self.stale_after / 2.0:
+            self.cleanup()
+            self.cleaned = time.time()
+        # Workers poll the queue even when it's empty, so the gauges stay up
+        # to date
+        if time.time() - self.reported >= self.report_interval:
+            self.report()
+            self.reported = time.time()
+        for retry in (True, False):
+            for priority in self.schedule():
+                job = self.claim(priority)
+                if job is not None:
+                    self.served[priority] = time.time()
+                    return job
+            if retry and not self.cleanup():
+                break
+        return None
+
+    def schedule(self):
+        """
+        Return the priority classes to take a job from, in order.
+        """
+        ages = self.pending_ages()
+        if self.concurrency:
+            running = self.running_counts()
+            for priority, limit in self.concurrency.items():
+                if running.get(priority, 0) >= limit:
+                    ages.pop(priority, None)
+        order = sorted(ages)
+        if not order:
+            return order
+        if self.scheduling == WEIGHTED:
+            # Smooth weighted round robin between the classes with pending
+            # jobs: each gets its weight in credits, and the richest pays
+            # for the others.
+            total = 0
+            for priority in order:
+                weight = self.weights.get(priority, 1)
+                self.credits[priority] += weight
+                total += weight
+            chosen = max(order, key=lambda priority: self.credits[priority])
+            self.credits[chosen] -= total
+            order.remove(chosen)
+            order.insert(0, chosen)
+        if self.max_age is not None:
+            # Classes this worker didn't serve for `max_age` seconds get a
+            # job, so a backlog of old jobs can't take over either.
+            now = time.time()
+            starving = [priority for priority in order
+                if ages[priority] > self.max_age and
+                    now - self.served.get(priority, 0) > self.max_age]
+            starving.sort(key=lambda priority: -ages[priority])
+            order = starving + [priority for priority in order
+                if priority not in starving]
+        return order
+
+    def claim(self, priority):
+        """
+        Claim the oldest pending job of a priority class, and return it, or
+        None if there's none.
+        """
+        raise NotImplementedError
+
+    def cleanup(self):
+        """
+        Queue abandoned jobs again, and delete old finished jobs. Return the
+        number of jobs queued again.
+        """
+        raise NotImplementedError
+
+    def finish(self, job, result=None, error=None):
+        """
+        Record the result of `generate` for a job, or the name and message of
+        the exception it raised.
+        """
+        raise NotImplementedError
+
+    def status(self, key):
+        """
+        Return a ``(status, result, error)`` tuple for the job with the given
+        key, or None if it's unknown.
+        """
+        raise NotImplementedError
+
+    def pending_ages(self):
+        """
+        Return the age in seconds of the oldest pending job of each priority
+        class with pending jobs.
+        """
+        raise NotImplementedError
+
+    def running_counts(self):
+        """
+        Return the number of running jobs of each priority class.
+        """
+        raise NotImplementedError
+
+    def depth(self, priority=None):
+        """
+        Return the number of pending jobs, of a single priority class if
+        given.
+        """
+        raise NotImplementedError
+
+    def report(self):
+        """
+        Send the number of pending and running jobs of each priority class to
+        the metrics sink, as the `queue.pending.<class>` and
+        `queue.running.<class>` gauges.
+        """
+        for name, counts in self.stats().items():
+            for status, count in counts.items():
+                metrics.gauge('queue.%s.%s' % (status, name), count,
+                    self.__class__)
+
+    def stats(self):
+        """
+        Return the number of pending and running jobs of each priority class,
+        by name.
+        """
+        running = self.running_counts()
+        return dict((name, {
+                'pending': self.depth(priority),
+                'running': running.get(priority, 0),
+            }) for priority, name in PRIORITY_NAMES.items())
+
+
+class DatabaseQueue(RenderQueueBase):
+    """
+    A queue stored in the database, using the RenderJob model. Requires
+    `restthumbnails` in INSTALLED_APPS.
+    """
+    def put(self, job):
+        from restthumbnails.models import RenderJob
+        now = timezone.now()
+        priority = job.get('priority', INTERACTIVE)
+        fields = dict(job, format=job.get('format') or '', priority=priority,
+                      status=PENDING, result=None, error='', queued=now,
+                      started=None, finished=None)
+        if RenderJob.objects.filter(key=job['key'],
+                status__in=(DONE, FAILED)).update(**fields):
+            return True
+        if RenderJob.objects.filter(key=job['key']).exists():
+            RenderJob.objects.filter(key=job['key'], status=PENDING,
+                priority__gt=priority).update(priority=priority)
+            return False
+        try:
+            with transaction.commit_on_success():
+                RenderJob.objects.create(**fields)
+        except IntegrityError:
+            # Queued by another process in the meantime
+            return False
+        return True
+
+    def claim(self, priority):
+        from restthumbnails.models import RenderJob
+        pending = RenderJob.objects.filter(status=PENDING,
+            priority=priority).order_by('queued').values_list('pk', flat=True)
+        for pk in pending[:10]:
+            # Only one worker gets to update the status
+            if RenderJob.objects.filter(pk=pk, status=PENDING).update(
+                    status=RUNNING, started=timezone.now()):
+                job = RenderJob.objects.get(pk=pk)
+                return {
+                    'key': job.key,
+                    'source': job.source,
+                    'size': job.size,
+                    'method': job.method,
+                    'extension': job.extension,
+                    'format': job.format or None,
+                    'priority': job.priority,
+                }
+        return None
+
+    def cleanup(self):
+        from restthumbnails.models import RenderJob
+        now = timezone.now()
+        RenderJob.objects.filter(status__in=(DONE, FAILED),
+            finished__lt=now - datetime.timedelta(
+                seconds=self.keep_finished)).delete()
+        return RenderJob.objects.filter(status=RUNNING,
+            started__lt=now - datetime.timedelta(
+                seconds=self.stale_after)).update(status=PENDING)
+
+    def finish(self, job, result=None, error=None):
+        from restthumbnails.models import RenderJob
+        RenderJob.objects.filter(key=job['key'], status=RUNNING).update(
+            status=FAILED if error else DONE,
+            result=result,
+            error=error and ':'.join(error) or '',
+            finished=timezone.now())
+
+    def status(self, key):
+        from restthumbnails.models import RenderJob
+        # End the transaction left open by earlier reads, or databases with
+        # REPEATABLE READ isolation (e.g. MySQL) keep returning the snapshot
+        # taken before a worker updated the job
+        transaction.commit_unless_managed()
+        try:
+            job = RenderJob.objects.get(key=key)
+        except RenderJob.DoesNotExist:
+            return None
+        error = job.error and tuple(job.error.split(':', 1)) or None
+        return job.status, job.result, error
+
+    def pending_ages(self):
+        from restthumbnails.models import RenderJob
+        now = timezone.now()
+        return dict((row['priority'], (now - row['oldest']).total_seconds())
+            for row in RenderJob.objects.filter(status=PENDING).values(
+                'priority').annotate(oldest=Min('queued')))
+
+    def running_counts(self):
+        from restthumbnails.models import RenderJob
+        return dict((row['priority'], row['count'])
+            for row in RenderJob.objects.filter(status=RUNNING).values(
+                'priority').annotate(count=Count('pk')))
+
+    def depth(self, priority=None):
+        from restthumbnails.models import RenderJob
+        pending = RenderJob.objects.filter(status=PENDING)
+        if priority is not None:
+            pending = pending.filter(priority=priority)
+        return pending.count()
+
+
+class SpoolQueue(RenderQueueBase):
+    """
+    A queue stored as files in a spool directory, which can be shared by many
+    hosts over NFS. Jobs are moved between the `pending/<class>`,
+    `running/<class>`, `done` and `failed` subdirectories with atomic renames.
+    """
+    def __init__(self, *args, **kwargs):
+        super(SpoolQueue, self).__init__(*args, **kwargs)
+        directories = [DONE, FAILED]
+        for status in (PENDING, RUNNING):
+            for name in PRIORITIES:
+                directories.append(os.path.join(status, name))
+        for directory in directories:
+            try:
+                os.makedirs(os.path.join(self.location, directory))
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+    def directory(self, status, priority=None):
+        if priority is None:
+            return os.path.join(self.location, status)
+        return os.path.join(self.location, status, PRIORITY_NAMES[priority])
+
+    def path(self, status, key, priority=None):
+        return os.path.join(self.directory(status, priority),
+            hashlib.sha1(key).hexdigest())
+
+    def find(self, status, key):
+        """
+        Return the priority class of a pending or running job, or None if
+        it's not found.
+        """
+        for priority in sorted(PRIORITY_NAMES):
+            if os.path.exists(self.path(status, key, priority)):
+                return priority
+        return None
+
+    def _write(self, path, data):
+        temp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(temp_path, 'w') as f:
+            json.dump(data, f)
+        return temp_path
+
+    def _read(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except IOError, e:
+            if e.errno != errno.ENOENT:
+                raise
+        return None
+
+    def _unlink(self, path):
+        try:
+            os.unlink(path)
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def _list(self, directory):
+        """
+        Return ``(mtime, name)`` tuples for the jobs in a directory, oldest
+        first.
+        """
+        entries = []
+        for name in os.listdir(directory):
+            if name.endswith('.tmp'):
+                continue
+            try:
+                entries.append(
+                    (os.path.getmtime(os.path.join(directory, name)), name))
+            except OSError, e:
+                if e.errno != errno.ENOENT:
+                    raise
+        entries.sort()
+        return entries
+
+    def put(self, job):
+        if self.find(RUNNING, job['key']) is not None:
+            return False
+        priority = job.get('priority', INTERACTIVE)
+        pending = self.find(PENDING, job['key'])
+        if pending is not None:
+            if pending > priority:
+                try:
+                    os.rename(self.path(PENDING, job['key'], pending),
+                              self.path(PENDING, job['key'], priority))
+                except OSError, e:
+                    # Claimed in the meantime
+                    if e.errno != errno.ENOENT:
+                        raise
+            return False
+        path = self.path(PENDING, job['key'], priority)
+        temp_path = self._write(path, job)
+        try:
+            # Linking fails if the job is pending already
+            os.link(temp_path, path)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+            return False
+        finally:
+            os.unlink(temp_path)
+        self._unlink(self.path(DONE, job['key']))
+        self._unlink(self.path(FAILED, job['key']))
+        return True
+
+    def claim(self, priority):
+        for mtime, name in self._list(self.directory(PENDING, priority)):
+            running = os.path.join(self.directory(RUNNING, priority), name)
+            try:
+                # Only one worker gets to move the job
+                os.rename(os.path.join(self.directory(PENDING, priority), name),
+                          running)
+            except OSError, e:
+                if e.errno != errno.ENOENT:
+                    raise
+                continue
+            # Record when the job started
+            os.utime(running, None)
+            job = self._read(running)
+            if job is not None:
+                # The job may have been moved to a more urgent class
+                job['priority'] = priority
+                return job
+        return None
+
+    def cleanup(self):
+        now = time.time()
+        for status in (DONE, FAILED):
+            for mtime, name in self._list(self.directory(status)):
+                if mtime < now - self.keep_finished:
+                    self._unlink(os.path.join(self.directory(status), name))
+        queued = 0
+        for priority in PRIORITY_NAMES:
+            directory = self.directory(RUNNING, priority)
+            for mtime, name in self._list(directory):
+                if mtime >= now - self.stale_after:
+                    continue
+                try:
+                    os.rename(os.path.join(directory, name), os.path.join(
+                        self.directory(PENDING, priority), name))
+                    queued += 1
+                except OSError, e:
+                    if e.errno != errno.ENOENT:
+                        raise
+        return queued
+
+    def finish(self, job, result=None, error=None):
+        status = FAILED if error else DONE
+        path = self.path(status, job['key'])
+        os.rename(
+            self._write(path, dict(job, result=result, error=error)), path)
+        self._unlink(self.path(RUNNING, job['key'],
+            job.get('priority', INTERACTIVE)))
+
+    def status(self, key):
+        for status in (PENDING, RUNNING):
+            if self.find(status, key) is not None:
+                return status, None, None
+        for status in (DONE, FAILED):
+            job = self._read(self.path(status, key))
+            if job is not None:
+                error = job['error'] and tuple(job['error']) or None
+                return status, job['result'], error
+        return None
+
+    def pending_ages(self):
+        now = time.time()
+        ages = {}
+        for priority in PRIORITY_NAMES:
+            pending = self._list(self.directory(PENDING, priority))
+            if pending:
+                ages[priority] = now - pending[0][0]
+        return ages
+
+    def running_counts(self):
+        return dict((priority, len(self._list(
+                self.directory(RUNNING, priority))))
+            for priority in PRIORITY_NAMES)
+
+    def depth(self, priority=None):
+        if priority is None:
+            return sum(self.depth(priority) for priority in PRIORITY_NAMES)
+        return len(self._list(self.directory(PENDING, priority)))
+
+
+def run_job(queue, job):
+    """
+    Generate the thumbnail of a job, and record its result on the queue.
+    """
+    from restthumbnails.executors import render
+    try:
+        result = render(job['source'], job['size'], job['method'],
+                        job['extension'], job.get('format'))
+    except Exception, e:
+        if not isinstance(e, exceptions.ThumbnailError):
+            logger.exception("Failed to generate '%s'", job['key'])
+        queue.finish(job, error=(e.__class__.__name__, unicode(e)))
+        return False
+    queue.finish(job, result=result)
+    return True
+
+
+def work(queue, max_jobs=None, burst=False, poll_interval=0.5):
+    """
+    Generate thumbnails from the queue until `max_jobs` jobs are done, or,
+    in `burst` mode, until the queue is empty. Return the number of jobs
+    done.
+    """
+    done = 0
+    while max_jobs is None or done < max_jobs:
+        job = queue.get()
+        if job is None:
+            if burst:
+                break
+            time.sleep(poll_interval)
+            continue
+        run_job(queue, job)
+        done += 1
+    return done
@@ -0,0 +1,186 @@
+from django import http
+from django.utils.cache import patch_cache_control
+from django.utils.http import http_date, parse_etags, quote_etag
+from django.views.static import was_modified_since
+
+from restthumbnails.helpers import FORMAT_MIMETYPES
+
+from collections import OrderedDict
+
+import os
+import re
+import threading
+import time
+
+
+RE_RANGE = re.compile(r'bytes=(\d*)-(\d*)$')
+
+CHUNK_SIZE = 64 * 1024
+
+
+class LRUCache(object):
+    """
+    Keep the content of recently served thumbnails in memory, up to
+    `max_size` bytes in total. Files larger than `max_file_size` are never
+    kept.
+    """
+    def __init__(self, max_size, max_file_size):
+        self.max_size = max_size
+        self.max_file_size = max_file_size
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        with self._lock:
+            try:
+                value = self._entries.pop(name)
+            except KeyError:
+                return None
+            # Move it to the end, as the most recently used
+            self._entries[name] = value
+            return value
+
+    def set(self, name, content, modified):
+        if len(content) > self.max_file_size:
+            return
+        with self._lock:
+            old = self._entries.pop(name, None)
+            if old is not None:
+                self.size -= len(old[0])
+            self._entries[name] = (content, modified)
+            self.size += len(content)
+            while self.size > self.max_size:
+                content, modified = self._entries.popitem(last=False)[1]
+                self.size -= len(content)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def get_etag(thumbnail):
+    """
+    Return a strong ETag for the thumbnail. Its URL is signed, so the secret
+    changes whenever the content would.
+    """
+    return quote_etag('%s-%s' % (thumbnail.secret, thumbnail.format.lower()))
+
+
+def get_range(header, size):
+    """
+    Return the (start, end) offsets of a single byte range, or None if the
+    header asks for several ranges or can't be parsed. Raise ValueError if
+    the range can't be satisfied.
+    """
+    match = RE_RANGE.match(header.strip())
+    if match is None:
+        return None
+    start, end = match.groups()
+    if not start:
+        if not end:
+            return None
+        # The last `end` bytes
+        start, end = max(size - int(end), 0), size - 1
+    else:
+        start = int(start)
+        end = min(int(end), size - 1) if end else size - 1
+    if start > end or start >= size:
+        raise ValueError(header)
+    return start, end
+
+
+def _stat(storage, name):
+    try:
+        st = os.stat(storage.path(name))
+    except NotImplementedError:
+        modified = storage.modified_time(name)
+        return storage.size(name), time.mktime(modified.timetuple())
+    return st.st_size, st.st_mtime
+
+
+def _read(f, offset, length):
+    try:
+        f.seek(offset)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+def _not_modified(request, etag, modified):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        etags = parse_etags(if_none_match)
+        return '*' in etags or etag.strip('"') in etags
+    if_modified_since = request.META.get('HTTP_IF_MODIFIED_SINCE')
+    if if_modified_since is not None:
+        return not was_modified_since(if_modified_since, int(modified))
+    return False
+
+
+def sendfile(request, thumbnail, **kwargs):
+    """
+    Serve the thumbnail from Python, for deployments without a front end
+    server. Small thumbnails are kept in memory (see
+    THUMBNAILS_DIRECT_CACHE_SIZE), conditional requests get a 304 response
+    and single byte ranges are supported.
+    """
+    from restthumbnails import defaults
+    storage = defaults.storage_backend()
+    cache = defaults.direct_cache()
+
+    entry = cache.get(thumbnail.name) if cache is not None else None
+    if entry is not None:
+        content, modified = entry
+        size = len(content)
+    else:
+        content = None
+        size, modified = _stat(storage, thumbnail.name)
+
+    etag = get_etag(thumbnail)
+    if _not_modified(request, etag, modified):
+        response = http.HttpResponseNotModified()
+    else:
+        byte_range = None
+        header = request.META.get('HTTP_RANGE')
+        if_range = request.META.get('HTTP_IF_RANGE')
+        if header and (if_range is None or if_range == etag):
+            try:
+                byte_range = get_range(header, size)
+            except ValueError:
+                response = http.HttpResponse(status=416)
+                response['Content-Range'] = 'bytes */%d' % size
+                return response
+
+        if content is None and cache is not None and \
+                size <= cache.max_file_size:
+            f = storage.open(thumbnail.name)
+            try:
+                content = f.read()
+            finally:
+                f.close()
+            cache.set(thumbnail.name, content, modified)
+
+        start, end = byte_range or (0, size - 1)
+        if content is not None:
+            body = content[start:end + 1]
+        else:
+            body = _read(storage.open(thumbnail.name), start, end + 1 - start)
+        response = http.HttpResponse(body,
+            content_type=FORMAT_MIMETYPES[thumbnail.format])
+        response['Content-Length'] = str(end + 1 - start)
+        response['Accept-Ranges'] = 'bytes'
+        if byte_range is not None:
+            response.status_code = 206
+            response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, size)
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(modified)
+    # Thumbnail URLs are signed, a new URL is made for new content
+    patch_cache_control(response, public=True, immutable=True,
+        max_age=defaults.DIRECT_MAX_AGE)
+    return response
@@ -0,0 +1,12 @@
+from django.dispatch import Signal
+
+
+# Sent with the name of a stage (e.g. "generate.decode") and how long it took,
+# in seconds
+timing = Signal(providing_args=['name', 'seconds'])
+
+# Sent with the name of a counter (e.g. "view.hit") and how much to add to it
+counter = Signal(providing_args=['name', 'value'])
+
+# Sent with the name of a gauge (e.g. "queue.pending.batch") and its value
+gauge = Signal(providing_args=['name', 'value'])
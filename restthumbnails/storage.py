@@ -0,0 +1,125 @@
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+
+import binascii
+import errno
+import os
+import threading
+import time
+
+
+class ThumbnailStorage(FileSystemStorage):
+    """
+    A file system storage writing files atomically, under the exact name
+    they're given.
+
+    Files are written to a temporary name in the same directory, then
+    renamed, so the web server never serves a partially written file.
+    Thumbnail names are derived from the source and options, so two files
+    with the same name have the same contents. Instead of looking for an
+    available name (one stat call per attempt), existing files are
+    replaced.
+    """
+    def get_available_name(self, name):
+        return name
+
+    def _open_temporary(self, full_path):
+        temp_path = '%s.%d.%s.tmp' % (
+            full_path, os.getpid(), binascii.hexlify(os.urandom(4)))
+        flags = (os.O_WRONLY | os.O_CREAT | os.O_EXCL |
+                 getattr(os, 'O_BINARY', 0))
+        try:
+            return temp_path, os.open(temp_path, flags, 0666)
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+        # Only create the directory when it's missing, which saves a stat
+        # call when it's there already.
+        try:
+            os.makedirs(os.path.dirname(full_path))
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+        return temp_path, os.open(temp_path, flags, 0666)
+
+    def _save(self, name, content):
+        full_path = self.path(name)
+        temp_path, fd = self._open_temporary(full_path)
+        renamed = False
+        try:
+            try:
+                for chunk in content.chunks():
+                    os.write(fd, chunk)
+            finally:
+                os.close(fd)
+            if settings.FILE_UPLOAD_PERMISSIONS is not None:
+                os.chmod(temp_path, settings.FILE_UPLOAD_PERMISSIONS)
+            try:
+                os.rename(temp_path, full_path)
+                renamed = True
+            except OSError:
+                # Windows can't rename onto an existing file, which has the
+                # same contents anyway.
+                if not os.path.exists(full_path):
+                    raise
+        finally:
+            if not renamed:
+                try:
+                    os.unlink(temp_path)
+                except OSError:
+                    pass
+        return name
+
+
+class CachedMetadataStorage(object):
+    """
+    Wrap a storage backend, remembering the results of `exists`, `size` and
+    `modified_time` for `timeout` seconds, so checking the same file again
+    doesn't cost another round trip on remote storages. Everything else is
+    passed through to the wrapped storage.
+
+    The cache is local to the process and holds at most `max_entries` files.
+    """
+    def __init__(self, storage, timeout, max_entries=1024):
+        self.storage = storage
+        self.timeout = timeout
+        self.max_entries = max_entries
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.storage, name)
+
+    def _get(self, method, name):
+        key = (method, name)
+        now = time.time()
+        try:
+            expires, value = self._cache[key]
+        except KeyError:
+            pass
+        else:
+            if expires > now:
+                return value
+        value = getattr(self.storage, method)(name)
+        with self._lock:
+            if len(self._cache) >= self.max_entries:
+                self._cache.clear()
+            self._cache[key] = (now + self.timeout, value)
+        return value
+
+    def exists(self, name):
+        return self._get('exists', name)
+
+    def size(self, name):
+        return self._get('size', name)
+
+    def modified_time(self, name):
+        return self._get('modified_time', name)
+
+    def forget(self, name):
+        """
+        Drop the cached metadata of a file, e.g. when it's (re-)uploaded.
+        """
+        with self._lock:
+            for method in ('exists', 'size', 'modified_time'):
+                self._cache.pop((method, name), None)
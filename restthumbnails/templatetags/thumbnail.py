@@ -1,6 +1,6 @@
 from django.template import Library
 
-from restthumbnails.helpers import get_thumbnail_proxy
+from restthumbnails.helpers import get_thumbnail_proxy, get_thumbnail_srcset
 
 
 register = Library()
@@ -10,3 +10,11 @@ def thumbnail(context, source, size, method, extension):
     if source:
         return get_thumbnail_proxy(source, size, method, extension)
     return None
+
+
+@register.assignment_tag(takes_context=True)
+def thumbnail_srcset(context, source, size, method, extension, scales='1,2'):
+    if source:
+        return get_thumbnail_srcset(source, size, method, extension,
+            [float(scale) for scale in str(scales).split(',')])
+    return None
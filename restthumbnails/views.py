@@ -1,42 +1,223 @@
 from django import http
-from django.core.cache import cache
 from django.conf import settings
+from django.core.cache import cache
+from django.utils.encoding import filepath_to_uri, iri_to_uri
+from django.utils.cache import (patch_cache_control, patch_response_headers,
+    patch_vary_headers)
 from django.views.decorators.cache import add_never_cache_headers
 from django.views.generic import View
 
-from restthumbnails import defaults
-from restthumbnails.exceptions import ThumbnailError
-from restthumbnails.helpers import get_thumbnail
+from restthumbnails import defaults, eviction, metrics, processors
+from restthumbnails.exceptions import (ThumbnailError, InvalidSecretError,
+    InvalidSizeError, RenderUnavailable, SourceDoesNotExist)
+from restthumbnails.helpers import (get_thumbnail, get_missing_key, snap_size,
+    FORMAT_MIMETYPES)
+
+import json
+import time
 
 
 class ThumbnailView(View):
     def __init__(self, *args, **kwargs):
         self.lock_timeout = defaults.LOCK_TIMEOUT
+        self.lock_wait = defaults.LOCK_WAIT
+        self.lock_poll_interval = defaults.LOCK_POLL_INTERVAL
+        self.lock_poll_backoff = defaults.LOCK_POLL_BACKOFF
+        self.lock_poll_max_interval = defaults.LOCK_POLL_MAX_INTERVAL
+        self.lock_backend = defaults.lock_backend()
+        self.executor = defaults.render_executor()
+        self.retry_after = defaults.RETRY_AFTER
+        self.error_cache_timeout = defaults.ERROR_CACHE_TIMEOUT
+        self.missing_cache_timeout = defaults.MISSING_CACHE_TIMEOUT
+        self.access_log = defaults.ACCESS_LOG
+        self.negotiate_formats = [format for format in defaults.NEGOTIATE_FORMATS
+            if processors.can_save(format)]
         self.sendfile = defaults.response_backend()
+        self.size_ladder = defaults.SIZE_LADDER
+        self.size_ladder_policy = defaults.SIZE_LADDER_POLICY
         super(ThumbnailView, self).__init__(*args, **kwargs)
 
+    def wait_for(self, thumbnail, lock):
+        """
+        Wait until the worker holding the lock is done with the thumbnail,
+        polling with an exponential backoff. Return True if the thumbnail
+        was generated within `lock_wait` seconds.
+        """
+        start = time.time()
+        deadline = start + self.lock_wait
+        interval = self.lock_poll_interval
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                metrics.incr('view.lock_timeout', sender=self.__class__)
+                return False
+            time.sleep(min(interval, remaining))
+            if not lock.locked():
+                metrics.timing('view.lock_wait', time.time() - start,
+                    self.__class__)
+                return thumbnail.exists()
+            interval = min(
+                interval * self.lock_poll_backoff,
+                self.lock_poll_max_interval)
+
+    def negotiate(self, request, thumbnail):
+        """
+        Return a variant of the thumbnail in a more efficient format, like
+        WebP, if the client accepts it.
+        """
+        if thumbnail.format not in ('JPEG', 'PNG'):
+            return thumbnail
+        accept = request.META.get('HTTP_ACCEPT', '')
+        for format in self.negotiate_formats:
+            if format == thumbnail.format:
+                break
+            if FORMAT_MIMETYPES[format] in accept:
+                return defaults.thumbnail_file()(
+                    source=thumbnail.source,
+                    size=thumbnail.size_string,
+                    method=thumbnail.method,
+                    extension=thumbnail.extension,
+                    format=format)
+        return thumbnail
+
+    def ladder_redirect(self, request, thumbnail, size):
+        """
+        Return a redirect to the thumbnail at the given size, or None if the
+        URL of the request doesn't end with the file signature.
+        """
+        signature = dict(self.kwargs, shard=self.kwargs.get('shard'))
+        path = thumbnail.file_signature % signature
+        if not request.path.endswith(path):
+            return None
+        snapped = defaults.thumbnail_file()(
+            source=thumbnail.source,
+            size=size,
+            method=thumbnail.method,
+            extension=thumbnail.extension)
+        signature.update(
+            shard=snapped.shard,
+            source=filepath_to_uri(snapped.source),
+            size=snapped.size_string,
+            secret=snapped.secret)
+        response = http.HttpResponseRedirect(
+            iri_to_uri(request.path[:-len(path)]) +
+            snapped.file_signature % signature)
+        # Not permanent, the ladder may change
+        patch_response_headers(response, self.error_cache_timeout)
+        patch_cache_control(response, public=True)
+        return response
+
+    def sendfile_response(self, request, thumbnail):
+        if self.access_log:
+            eviction.log_access(self.access_log, thumbnail.name)
+        response = self.sendfile(request, thumbnail)
+        if self.negotiate_formats:
+            patch_vary_headers(response, ('Accept',))
+        return response
+
+    def error(self, e):
+        """
+        Return a response for a ThumbnailError. Invalid requests and missing
+        sources get cacheable responses, so proxies can keep bogus URLs from
+        hitting the backend all the time.
+        """
+        if isinstance(e, SourceDoesNotExist):
+            metrics.incr('view.not_found', sender=self.__class__)
+        elif isinstance(e, InvalidSecretError):
+            metrics.incr('view.unauthorized', sender=self.__class__)
+        elif isinstance(e, RenderUnavailable):
+            metrics.incr('view.unavailable', sender=self.__class__)
+        else:
+            metrics.incr('view.error', sender=self.__class__)
+        response = http.HttpResponse(status=e.status, content=e)
+        if isinstance(e, RenderUnavailable):
+            # Ask the client to come back later when the executor is
+            # overloaded
+            response['Retry-After'] = str(self.retry_after)
+            add_never_cache_headers(response)
+        elif e.status >= 500:
+            add_never_cache_headers(response)
+        elif isinstance(e, SourceDoesNotExist):
+            patch_response_headers(response, self.missing_cache_timeout)
+            patch_cache_control(response, public=True)
+        else:
+            patch_response_headers(response, self.error_cache_timeout)
+            patch_cache_control(response, public=True)
+        return response
+
     def get(self, request, *args, **kwargs):
+        with metrics.timer('view.request', self.__class__):
+            return self.respond(request)
+
+    def respond(self, request):
         # Return appropriate status code on invalid requests
         try:
             thumbnail = get_thumbnail(**self.kwargs)
         except ThumbnailError, e:
-            # FIXME: Handle SourceDoesNotExist with a different,
-            # cacheable response to keep bogus URLs from hitting
-            # the backend all the time.
-            return http.HttpResponse(status=e.status, content=e)
+            return self.error(e)
+
+        # Keep clients from rendering sizes off the ladder
+        if self.size_ladder and self.size_ladder_policy:
+            size = snap_size(thumbnail.size, self.size_ladder)
+            if size != tuple(thumbnail.size):
+                response = None
+                if self.size_ladder_policy == 'redirect':
+                    response = self.ladder_redirect(request, thumbnail,
+                        '%dx%d' % size)
+                if response is not None:
+                    metrics.incr('view.redirect', sender=self.__class__)
+                    return response
+                return self.error(InvalidSizeError(
+                    "'%s' is not on the size ladder." % thumbnail.size_string))
+
+        # Don't hit the storage backend for sources known to be missing
+        missing_key = get_missing_key(thumbnail.source)
+        if cache.get(missing_key):
+            return self.error(SourceDoesNotExist(thumbnail.source))
+
+        if self.negotiate_formats:
+            thumbnail = self.negotiate(request, thumbnail)
 
         # Make only one worker busy on this thumbnail by managing a lock
-        if cache.get(thumbnail.key) is None:
+        lock = self.lock_backend(thumbnail, self.lock_timeout)
+        if lock.acquire():
             try:
-                cache.set(thumbnail.key, True, self.lock_timeout)
-                thumbnail.generate()
+                with metrics.timer('view.render', self.__class__):
+                    generated = self.executor.render(thumbnail)
+                metrics.incr('view.miss' if generated else 'view.hit',
+                    sender=self.__class__)
+            except SourceDoesNotExist, e:
+                cache.set(missing_key, True, self.missing_cache_timeout)
+                return self.error(e)
+            except ThumbnailError, e:
+                return self.error(e)
             finally:
-                cache.delete(thumbnail.key)
+                lock.release()
             # Internal redirect to the generated file
-            return self.sendfile(request, thumbnail)
+            return self.sendfile_response(request, thumbnail)
+
+        # Another worker is busy on this thumbnail, wait for it to finish
+        metrics.incr('view.lock_contention', sender=self.__class__)
+        if self.wait_for(thumbnail, lock):
+            return self.sendfile_response(request, thumbnail)
 
-        # Return 404 while there's a lock. Also, make sure user agents and
-        # proxies don't cache this intermediate response.
+        # Return 404 if the lock is still held. Also, make sure user agents
+        # and proxies don't cache this intermediate response.
         response = http.HttpResponse(status=404)
         add_never_cache_headers(response)
         return response
+
+
+class StatsView(View):
+    """
+    Serve the counters, gauges and latency histograms kept by the MemorySink
+    as JSON. Not routed by default, see the README.
+    """
+    def get(self, request, *args, **kwargs):
+        sink = defaults.metrics_sink()
+        if not hasattr(sink, 'stats'):
+            raise http.Http404("THUMBNAILS_METRICS_SINK doesn't keep stats.")
+        response = http.HttpResponse(json.dumps(sink.stats(), sort_keys=True),
+            content_type='application/json')
+        add_never_cache_headers(response)
+        return response
@@ -26,6 +26,8 @@ setup(
     author_email='hcarvalhoalves@gmail.com',
     packages=[
         'restthumbnails',
+        'restthumbnails.management',
+        'restthumbnails.management.commands',
         'restthumbnails.responses',
         'restthumbnails.templatetags',
     ],
@@ -1,12 +1,13 @@
-from django.core.files.storage import FileSystemStorage
 from django.conf import settings
 
+from restthumbnails.storage import ThumbnailStorage
+
 import os
 import shutil
 import tempfile
 
 
-class TemporaryStorage(FileSystemStorage):
+class TemporaryStorage(ThumbnailStorage):
     def cleanup(self):
         try:
             shutil.rmtree(self.location)
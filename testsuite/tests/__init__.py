@@ -1,3 +1,15 @@
+from admission import *
+from commands import *
+from defaults import *
+from eviction import *
+from executors import *
 from files import *
+from helpers import *
+from index import *
+from locks import *
+from metrics import *
+from processors import *
+from queues import *
+from storage import *
 from templatetags import *
 from views import *
@@ -0,0 +1,205 @@
+from django.conf import settings
+from django.test.utils import override_settings
+from django.utils import unittest
+
+from restthumbnails import defaults, exceptions, processors
+from restthumbnails.admission import MemoryBudget, SharedMemoryBudget
+from restthumbnails.files import ThumbnailFile
+
+from testsuite.tests.views import ResponseBackendTestBase
+
+import multiprocessing
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import zlib
+
+
+def png_chunk(kind, data):
+    return (struct.pack('>I', len(data)) + kind + data +
+        struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+
+
+# The header of a 100000x100000 PNG, without any pixels
+BOMB = ('\x89PNG\r\n\x1a\n' +
+    png_chunk('IHDR', struct.pack('>IIBBBBB', 100000, 100000, 8, 2, 0, 0, 0)) +
+    png_chunk('IEND', ''))
+
+
+def hold(path, size, unit, ready, done):
+    budget = SharedMemoryBudget(size, path, unit=unit)
+    budget.acquire(size)
+    ready.set()
+    done.wait(10)
+
+
+class MemoryBudgetTest(unittest.TestCase):
+    def test_acquire(self):
+        budget = MemoryBudget(100, timeout=0)
+        first = budget.acquire(60)
+        self.assertIsNotNone(
+            first)
+        self.assertIsNone(
+            budget.acquire(60))
+        budget.release(first)
+        self.assertIsNotNone(
+            budget.acquire(60))
+
+    def test_larger_than_budget(self):
+        budget = MemoryBudget(100, timeout=0)
+        reservation = budget.acquire(1000)
+        self.assertEqual(
+            budget.used,
+            100)
+        budget.release(reservation)
+        self.assertEqual(
+            budget.used,
+            0)
+
+    def test_concurrent_threads(self):
+        budget = MemoryBudget(100, timeout=5)
+        used = []
+
+        def decode():
+            reservation = budget.acquire(40)
+            used.append(budget.used)
+            time.sleep(0.02)
+            budget.release(reservation)
+
+        threads = [threading.Thread(target=decode) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(
+            max(used),
+            80)
+
+
+class SharedMemoryBudgetTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'decode.lock')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_threads_of_one_process(self):
+        budget = SharedMemoryBudget(40, self.path, timeout=0, unit=10)
+        first = budget.acquire(25)
+        self.assertEqual(
+            len(first),
+            3)
+        self.assertIsNone(
+            budget.acquire(20))
+        self.assertIsNotNone(
+            budget.acquire(10))
+
+    def test_other_processes(self):
+        ready = multiprocessing.Event()
+        done = multiprocessing.Event()
+        process = multiprocessing.Process(target=hold,
+            args=(self.path, 30, 10, ready, done))
+        process.start()
+        try:
+            self.assertTrue(
+                ready.wait(10))
+            budget = SharedMemoryBudget(40, self.path, timeout=0, unit=10)
+            self.assertIsNone(
+                budget.acquire(20))
+            self.assertIsNotNone(
+                budget.acquire(10))
+        finally:
+            done.set()
+            process.join()
+        # Locks are dropped with the process
+        budget = SharedMemoryBudget(40, self.path, timeout=0, unit=10)
+        self.assertIsNotNone(
+            budget.acquire(30))
+
+
+class AdmissionTest(ResponseBackendTestBase):
+    def setUp(self):
+        super(AdmissionTest, self).setUp()
+        self.max_pixels = defaults.MAX_PIXELS
+        defaults.MAX_PIXELS = 1000 * 1000
+
+    def tearDown(self):
+        defaults.MAX_PIXELS = self.max_pixels
+        super(AdmissionTest, self).tearDown()
+
+    def test_max_pixels(self):
+        # 2048x1536 pixels, decoded at 1/8 of its size
+        self.assertTrue(
+            ThumbnailFile('pil_tests/1.jpg', '100x100', 'crop',
+                '.jpg').generate())
+        self.assertRaises(
+            exceptions.SourceTooLarge,
+            ThumbnailFile('pil_tests/1.jpg', '1000x1000', 'crop',
+                '.jpg').generate)
+
+    def test_422_is_cacheable(self):
+        response = self.get(
+            source='pil_tests/1.jpg',
+            size='1000x1000',
+            method='crop',
+            extension='.jpg')
+        self.assertEqual(
+            response.status_code,
+            422)
+        self.assertIn(
+            'public',
+            response['Cache-Control'])
+
+    @override_settings(THUMBNAILS_DECODE_MEMORY=1024 * 1024,
+                       THUMBNAILS_DECODE_MEMORY_TIMEOUT=0)
+    def test_decode_memory(self):
+        budget = defaults.decode_budget()
+        ThumbnailFile('animals/kitten.jpg', '100x100', 'crop',
+            '.jpg').generate()
+        self.assertEqual(
+            budget.used,
+            0)
+        reservation = budget.acquire(budget.size)
+        try:
+            self.assertRaises(
+                exceptions.RenderUnavailable,
+                ThumbnailFile('animals/kitten.jpg', '50x50', 'crop',
+                    '.jpg').generate)
+        finally:
+            budget.release(reservation)
+        self.assertEqual(
+            budget.used,
+            0)
+
+
+class DecompressionBombTest(ResponseBackendTestBase):
+    def setUp(self):
+        super(DecompressionBombTest, self).setUp()
+        self.directory = os.path.join(settings.MEDIA_ROOT, 'bombs')
+        os.mkdir(self.directory)
+        with open(os.path.join(self.directory, 'bomb.png'), 'wb') as f:
+            f.write(BOMB)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super(DecompressionBombTest, self).tearDown()
+
+    def test_get_image(self):
+        with open(os.path.join(self.directory, 'bomb.png'), 'rb') as f:
+            self.assertRaises(
+                exceptions.SourceTooLarge,
+                processors.get_image, f)
+
+    def test_422(self):
+        response = self.get(
+            source='bombs/bomb.png',
+            size='100x100',
+            method='crop',
+            extension='.jpg')
+        self.assertEqual(
+            response.status_code,
+            422)
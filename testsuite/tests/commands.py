@@ -0,0 +1,182 @@
+from django.conf import settings
+from django.core.management import call_command
+from django.core.files.base import ContentFile
+from django.core.management.base import CommandError
+
+from restthumbnails import defaults
+from restthumbnails.files import ThumbnailFile
+from restthumbnails.management.commands.generate_thumbnails import parse_spec
+from restthumbnails.management.commands.migrate_thumbnails import parse_name
+
+from testsuite.tests.admission import BOMB
+from testsuite.tests.utils import StorageTestCase
+
+import os
+import shutil
+import StringIO
+import tempfile
+
+
+class GenerateThumbnailsTest(StorageTestCase):
+    def setUp(self):
+        super(GenerateThumbnailsTest, self).setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.stdout = StringIO.StringIO()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+        super(GenerateThumbnailsTest, self).tearDown()
+
+    def thumbnail(self, source, size, method, extension):
+        return ThumbnailFile(source, size, method, extension)
+
+    def test_generate_from_storage(self):
+        call_command('generate_thumbnails', '100x100:crop:.jpg', '50x:scale:.jpg',
+            prefix='animals', workers=1, stdout=self.stdout)
+        self.assertTrue(
+            self.thumbnail('animals/kitten.jpg', '100x100', 'crop', '.jpg').exists())
+        self.assertTrue(
+            self.thumbnail('animals/kitten.jpg', '50x', 'scale', '.jpg').exists())
+        self.assertFalse(
+            self.thumbnail('pil_tests/1.jpg', '100x100', 'crop', '.jpg').exists())
+        self.assertIn(
+            '1 sources, 2 generated, 0 skipped, 0 failed',
+            self.stdout.getvalue())
+
+    def test_generate_from_paths_with_pool(self):
+        paths = os.path.join(self.tmp, 'paths')
+        with open(paths, 'w') as f:
+            f.write('pil_tests/1.jpg\npil_tests/2.jpg\nanimals/puppy.jpg\n')
+        call_command('generate_thumbnails', '100x100:crop:.jpg',
+            paths=paths, workers=2, stdout=self.stdout)
+        self.assertTrue(
+            self.thumbnail('pil_tests/1.jpg', '100x100', 'crop', '.jpg').exists())
+        self.assertTrue(
+            self.thumbnail('pil_tests/2.jpg', '100x100', 'crop', '.jpg').exists())
+        self.assertIn(
+            '3 sources, 2 generated, 0 skipped, 1 failed',
+            self.stdout.getvalue())
+
+    def test_resume_from_checkpoint(self):
+        checkpoint = os.path.join(self.tmp, 'checkpoint')
+        with open(checkpoint, 'w') as f:
+            f.write('pil_tests/1.jpg\n')
+        call_command('generate_thumbnails', '100x100:crop:.jpg',
+            prefix='pil_tests', checkpoint=checkpoint, workers=1,
+            stdout=self.stdout)
+        self.assertFalse(
+            self.thumbnail('pil_tests/1.jpg', '100x100', 'crop', '.jpg').exists())
+        self.assertTrue(
+            self.thumbnail('pil_tests/2.jpg', '100x100', 'crop', '.jpg').exists())
+        with open(checkpoint) as f:
+            self.assertEqual(
+                f.read(),
+                'pil_tests/1.jpg\npil_tests/2.jpg\n')
+
+    def test_failed_sources_are_not_checkpointed(self):
+        checkpoint = os.path.join(self.tmp, 'checkpoint')
+        paths = os.path.join(self.tmp, 'paths')
+        with open(paths, 'w') as f:
+            f.write('animals/puppy.jpg\nanimals/kitten.jpg\n')
+        call_command('generate_thumbnails', '100x100:crop:.jpg',
+            paths=paths, checkpoint=checkpoint, workers=1, stdout=self.stdout)
+        with open(checkpoint) as f:
+            self.assertEqual(
+                f.read(),
+                'animals/kitten.jpg\n')
+
+    def test_bad_sources_dont_stop_the_others(self):
+        directory = os.path.join(settings.MEDIA_ROOT, 'broken')
+        os.mkdir(directory)
+        try:
+            shutil.copy(
+                os.path.join(settings.MEDIA_ROOT, 'animals', 'kitten.jpg'),
+                directory)
+            with open(os.path.join(directory, 'bomb.png'), 'wb') as f:
+                f.write(BOMB)
+            with open(os.path.join(directory, 'text.jpg'), 'w') as f:
+                f.write('Not an image')
+            call_command('generate_thumbnails', '100x100:crop:.jpg',
+                prefix='broken', workers=1, stdout=self.stdout)
+        finally:
+            shutil.rmtree(directory)
+        self.assertIn(
+            '3 sources, 1 generated, 0 skipped, 2 failed',
+            self.stdout.getvalue())
+
+    def test_skip_existing(self):
+        self.thumbnail('animals/kitten.jpg', '100x100', 'crop', '.jpg').generate()
+        call_command('generate_thumbnails', '100x100:crop:.jpg',
+            prefix='animals', workers=1, stdout=self.stdout)
+        self.assertIn(
+            '1 sources, 0 generated, 1 skipped, 0 failed',
+            self.stdout.getvalue())
+
+    def test_parse_spec(self):
+        self.assertEqual(
+            parse_spec('100x100:crop:.jpg'),
+            ('100x100', 'crop', '.jpg'))
+        self.assertRaises(
+            CommandError,
+            parse_spec, '100x100:crop')
+        self.assertRaises(
+            CommandError,
+            parse_spec, 'derp:crop:.jpg')
+        self.assertRaises(
+            CommandError,
+            parse_spec, '100x100:crop:.derp')
+
+
+class MigrateThumbnailsTest(StorageTestCase):
+    def setUp(self):
+        super(MigrateThumbnailsTest, self).setUp()
+        self.stdout = StringIO.StringIO()
+        self.thumbnails = [
+            ThumbnailFile('animals/kitten.jpg', '100x100', 'crop', '.jpg'),
+            ThumbnailFile('animals/kitten.jpg', '100x100', 'crop', '.jpg',
+                          format='WEBP'),
+            ThumbnailFile('pil_tests/1.jpg', '50x', 'scale', '.png')]
+        for thumbnail in self.thumbnails:
+            thumbnail.generate()
+        self.storage.save('animals/kitten.jpg/100x100/crop/foo.jpg',
+            ContentFile('foo'))
+        self.file_signature = defaults.FILE_SIGNATURE
+        defaults.FILE_SIGNATURE = defaults.SHARDED_FILE_SIGNATURE
+
+    def tearDown(self):
+        defaults.FILE_SIGNATURE = self.file_signature
+        super(MigrateThumbnailsTest, self).tearDown()
+
+    def assertMigrated(self):
+        for thumbnail in self.thumbnails:
+            self.assertFalse(
+                self.storage.exists(thumbnail.name))
+            self.assertTrue(
+                ThumbnailFile(thumbnail.source, thumbnail.size_string,
+                    thumbnail.method, thumbnail.extension,
+                    format=thumbnail.format).exists())
+        self.assertIn(
+            '4 files, 3 moved, 1 skipped, 0 failed',
+            self.stdout.getvalue())
+
+    def test_migrate(self):
+        call_command('migrate_thumbnails', workers=1, stdout=self.stdout)
+        self.assertMigrated()
+
+    def test_migrate_with_pool(self):
+        call_command('migrate_thumbnails', workers=2, stdout=self.stdout)
+        self.assertMigrated()
+
+    def test_parse_name(self):
+        thumbnail = parse_name(self.thumbnails[1].name,
+            defaults.DEFAULT_FILE_SIGNATURE)
+        self.assertEqual(
+            (thumbnail.source, thumbnail.size_string, thumbnail.method,
+             thumbnail.extension, thumbnail.format),
+            ('animals/kitten.jpg', '100x100', 'crop', '.jpg', 'WEBP'))
+        self.assertTrue(
+            thumbnail.name.startswith('%s/animals/' % thumbnail.shard))
+        self.assertEqual(
+            parse_name('animals/kitten.jpg/100x100/crop/foo.jpg',
+                       defaults.DEFAULT_FILE_SIGNATURE),
+            None)
@@ -0,0 +1,30 @@
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from restthumbnails import defaults
+
+import os
+
+
+class MemoizeTestCase(TestCase):
+    def test_same_instance(self):
+        self.assertIs(
+            defaults.storage_backend(),
+            defaults.storage_backend())
+        self.assertIs(
+            defaults.source_storage_backend(),
+            defaults.source_storage_backend())
+
+    def test_clear_on_setting_changed(self):
+        storage = defaults.storage_backend()
+        location = os.path.abspath('/tmp/thumbnails')
+        with override_settings(THUMBNAILS_STORAGE_ROOT=location):
+            self.assertEqual(
+                defaults.storage_backend().location,
+                location)
+        self.assertIsNot(
+            defaults.storage_backend(),
+            storage)
+        self.assertEqual(
+            defaults.storage_backend().location,
+            storage.location)
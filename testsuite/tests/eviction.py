@@ -0,0 +1,86 @@
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+
+from restthumbnails import eviction
+
+from testsuite.tests.utils import StorageTestCase
+
+import os
+import StringIO
+import time
+
+
+class EvictionTest(StorageTestCase):
+    def setUp(self):
+        super(EvictionTest, self).setUp()
+        self.now = int(time.time())
+        # Oldest first
+        self.names = ['a/b/1.jpg', 'a/2.jpg', 'c/3.jpg', '4.jpg']
+        for i, name in enumerate(self.names):
+            self.storage.save(name, ContentFile('x' * 100))
+            atime = self.now - 1000 + i * 100
+            os.utime(self.storage.path(name), (atime, atime))
+        self.storage.save('c/5.jpg.lock', ContentFile(''))
+        self.root = self.storage.path('')
+
+    def remaining(self):
+        return [name for name in self.names if self.storage.exists(name)]
+
+    def test_scan(self):
+        for workers in (1, 2):
+            self.assertEqual(
+                sorted(eviction.scan(self.root, workers)),
+                [(self.now - 1000 + i * 100, 100, self.storage.path(name))
+                 for i, name in enumerate(self.names)])
+
+    def test_evict_bytes(self):
+        self.assertEqual(
+            eviction.evict(eviction.scan(self.root, 1), max_bytes=250),
+            (2, 200))
+        self.assertEqual(
+            self.remaining(),
+            ['c/3.jpg', '4.jpg'])
+
+    def test_evict_files(self):
+        self.assertEqual(
+            eviction.evict(eviction.scan(self.root, 1), max_files=3),
+            (1, 100))
+        self.assertEqual(
+            self.remaining(),
+            self.names[1:])
+
+    def test_dry_run(self):
+        self.assertEqual(
+            eviction.evict(eviction.scan(self.root, 1), max_files=0,
+                           dry_run=True),
+            (4, 400))
+        self.assertEqual(
+            self.remaining(),
+            self.names)
+
+    def test_access_log(self):
+        log = os.path.join(self.root, 'access.log.tmp')
+        eviction.log_access(log, u'a/b/1.jpg')
+        eviction.log_access(log, u'missing.jpg')
+        self.assertEqual(
+            eviction.apply_access_log(log, self.storage),
+            1)
+        self.assertFalse(
+            os.path.exists(log))
+        self.assertTrue(
+            os.stat(self.storage.path('a/b/1.jpg')).st_atime >= self.now)
+        eviction.evict(eviction.scan(self.root, 1), max_files=1)
+        self.assertEqual(
+            self.remaining(),
+            ['a/b/1.jpg'])
+
+    def test_command(self):
+        stdout = StringIO.StringIO()
+        call_command('evict_thumbnails', max_bytes=300, workers=1,
+            stdout=stdout)
+        self.assertEqual(
+            self.remaining(),
+            self.names[1:])
+        self.assertIn(
+            '4 files (400 bytes), 1 evicted (100 bytes)',
+            stdout.getvalue())
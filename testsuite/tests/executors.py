@@ -0,0 +1,120 @@
+from django.test.utils import override_settings
+from django.utils import unittest
+
+from restthumbnails import exceptions, executors
+from restthumbnails.files import ThumbnailFile
+
+from testsuite.tests.utils import StorageTestCase
+from testsuite.tests.views import ResponseBackendTestBase
+
+import os
+import signal
+
+
+class FullExecutor(executors.RenderExecutorBase):
+    def render(self, thumbnail):
+        raise exceptions.RenderQueueFull()
+
+
+class KillingThumbnailFile(ThumbnailFile):
+    def generate(self):
+        os.kill(os.getpid(), signal.SIGKILL)
+
+
+class ExecutorTestBase(object):
+    executor_class = None
+
+    def setUp(self):
+        super(ExecutorTestBase, self).setUp()
+        self.executor = self.executor_class(max_workers=1, max_queue=0)
+        self.thumbnail = ThumbnailFile(
+            'animals/kitten.jpg',
+            '100x100',
+            'crop',
+            '.jpg')
+
+    def tearDown(self):
+        self.executor.shutdown()
+        super(ExecutorTestBase, self).tearDown()
+
+    def test_render(self):
+        self.assertTrue(
+            self.executor.render(self.thumbnail))
+        self.assertTrue(
+            self.thumbnail.exists())
+        self.assertFalse(
+            self.executor.render(self.thumbnail))
+
+    def test_raise_exception_on_missing_source(self):
+        thumbnail = ThumbnailFile(
+            'animals/puppy.jpg',
+            '100x100',
+            'crop',
+            '.jpg')
+        self.assertRaises(
+            exceptions.SourceDoesNotExist,
+            self.executor.render, thumbnail)
+
+
+class InlineExecutorTest(ExecutorTestBase, StorageTestCase):
+    executor_class = executors.InlineExecutor
+
+
+@unittest.skipIf(executors.futures is None, "'futures' is not installed")
+class ProcessPoolExecutorTest(ExecutorTestBase, StorageTestCase):
+    executor_class = executors.ProcessPoolExecutor
+
+    def test_raise_exception_on_full_queue(self):
+        self.executor.slots.acquire()
+        try:
+            self.assertRaises(
+                exceptions.RenderQueueFull,
+                self.executor.render, self.thumbnail)
+        finally:
+            self.executor.slots.release()
+
+    def test_retry_waits_for_running_job(self):
+        self.executor.timeout = 0.001
+        self.assertRaises(
+            exceptions.RenderTimeout,
+            self.executor.render, self.thumbnail)
+        # The job still holds the only slot, retries don't submit another one
+        self.executor.timeout = None
+        self.assertTrue(
+            self.executor.render(self.thumbnail))
+        self.assertEqual(
+            self.executor.running,
+            {})
+        self.assertTrue(
+            self.executor.slots.acquire(False))
+        self.executor.slots.release()
+
+    def test_dead_worker(self):
+        self.executor.poll_interval = 0.05
+        with override_settings(
+                THUMBNAILS_FILE='testsuite.tests.executors.KillingThumbnailFile'):
+            self.assertRaises(
+                exceptions.RenderFailed,
+                self.executor.render, self.thumbnail)
+        # The slot is freed and the pool replaced
+        self.assertEqual(
+            self.executor.running,
+            {})
+        self.assertTrue(
+            self.executor.render(self.thumbnail))
+
+
+@override_settings(THUMBNAILS_RENDER_EXECUTOR='testsuite.tests.executors.FullExecutor')
+class BackpressureTest(ResponseBackendTestBase):
+    def test_503_on_full_queue(self):
+        response = self.get(
+            source='animals/kitten.jpg',
+            size='100x100',
+            method='crop',
+            extension='.jpg')
+        self.assertEqual(
+            response.status_code,
+            503)
+        self.assertEqual(
+            response['Retry-After'],
+            '1')
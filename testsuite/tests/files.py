@@ -1,7 +1,14 @@
+from django.core.files.storage import FileSystemStorage
+
+from restthumbnails import exceptions
 from restthumbnails.files import ThumbnailFile
+from restthumbnails.processors import Image
 
+from testsuite.tests.storage import CountingStorage
 from testsuite.tests.utils import StorageTestCase
 
+import os
+
 
 class ThumbnailFileTestCase(StorageTestCase):
     def test_pil_can_identify_jpeg(self):
@@ -19,3 +26,92 @@ class ThumbnailFileTestCase(StorageTestCase):
             '.jpg')
         self.assertTrue(
             thumb.generate())
+
+    def test_generate_batch(self):
+        thumbs = [
+            ThumbnailFile('pil_tests/1.jpg', '400x300', 'crop', '.jpg'),
+            ThumbnailFile('pil_tests/1.jpg', '100x100', 'crop', '.jpg'),
+            ThumbnailFile('animals/kitten.jpg', '100x100', 'crop', '.jpg'),
+            ThumbnailFile('pil_tests/1.jpg', '50x', 'scale', '.jpg')]
+        thumbs[2].generate()
+        self.assertEqual(
+            ThumbnailFile.generate_batch(thumbs),
+            [True, True, False, True])
+        for thumb in thumbs:
+            self.assertTrue(
+                thumb.exists())
+
+    def test_generate_batch_missing_source(self):
+        thumbs = [
+            ThumbnailFile('animals/puppy.jpg', '100x100', 'crop', '.jpg')]
+        self.assertRaises(
+            exceptions.SourceDoesNotExist,
+            ThumbnailFile.generate_batch, thumbs)
+
+    def test_missing_source_not_checked(self):
+        thumb = ThumbnailFile('animals/puppy.jpg', '100x100', 'crop', '.jpg')
+        thumb.source_storage = CountingStorage()
+        self.assertRaises(
+            exceptions.SourceDoesNotExist,
+            thumb.generate)
+        self.assertEqual(
+            thumb.source_storage.calls,
+            [])
+
+    def test_assume_missing(self):
+        thumb = ThumbnailFile('animals/kitten.jpg', '100x100', 'crop', '.jpg')
+        thumb.storage = CountingStorage(location=self.storage.location)
+        self.assertEqual(
+            ThumbnailFile.generate_batch([thumb], assume_missing=True),
+            [True])
+        self.assertEqual(
+            thumb.storage.calls,
+            [])
+        self.assertEqual(
+            ThumbnailFile.generate_batch([thumb]),
+            [False])
+        self.assertEqual(
+            thumb.storage.calls,
+            [('exists', thumb.name)])
+
+    def test_no_duplicates_on_renaming_storage(self):
+        thumb = ThumbnailFile('animals/kitten.jpg', '100x100', 'crop', '.jpg')
+        thumb.storage = FileSystemStorage(location=self.storage.location)
+        for i in range(2):
+            self.assertEqual(
+                ThumbnailFile.generate_batch([thumb], assume_missing=True),
+                [True])
+        self.assertEqual(
+            thumb.storage.listdir(os.path.dirname(thumb.name)),
+            ([], [os.path.basename(thumb.name)]))
+
+    def test_format_from_extension(self):
+        for extension, format in [
+                ('.jpg', 'JPEG'),
+                ('.png', 'PNG'),
+                ('.webp', 'WEBP')]:
+            thumb = ThumbnailFile(
+                'animals/kitten.jpg',
+                '100x100',
+                'crop',
+                extension)
+            self.assertTrue(
+                thumb.generate())
+            self.assertEqual(
+                Image.open(thumb.path).format,
+                format)
+
+    def test_negotiated_format(self):
+        thumb = ThumbnailFile(
+            'animals/kitten.jpg',
+            '100x100',
+            'crop',
+            '.jpg',
+            format='WEBP')
+        self.assertTrue(
+            thumb.name.endswith('.jpg.webp'))
+        self.assertTrue(
+            thumb.generate())
+        self.assertEqual(
+            Image.open(thumb.path).format,
+            'WEBP')
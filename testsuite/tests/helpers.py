@@ -0,0 +1,119 @@
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils.crypto import salted_hmac
+
+from restthumbnails import exceptions, helpers
+
+import re
+
+
+class GetSecretTestCase(TestCase):
+    def salted_hmac(self, source, size, method, extension):
+        return salted_hmac(
+            source, '-'.join((source, size, method, extension))).hexdigest()
+
+    def test_same_as_salted_hmac(self):
+        for args in [
+                ('animals/kitten.jpg', '100x100', 'crop', '.jpg'),
+                ('animals/kitten.jpg', '200x', 'scale', '.png'),
+                ('animals/puppy.jpg', '100x100', 'crop', '.jpg')]:
+            self.assertEqual(
+                helpers.get_secret(*args),
+                self.salted_hmac(*args))
+
+    def test_secret_key_change(self):
+        args = ('animals/kitten.jpg', '100x100', 'crop', '.jpg')
+        secret = helpers.get_secret(*args)
+        with override_settings(SECRET_KEY='barfoo'):
+            self.assertNotEqual(
+                helpers.get_secret(*args),
+                secret)
+            self.assertEqual(
+                helpers.get_secret(*args),
+                self.salted_hmac(*args))
+
+
+class ShardTestCase(TestCase):
+    def setUp(self):
+        from restthumbnails import defaults
+        self.defaults = defaults
+        self.file_signature = defaults.FILE_SIGNATURE
+        defaults.FILE_SIGNATURE = defaults.SHARDED_FILE_SIGNATURE
+
+    def tearDown(self):
+        self.defaults.FILE_SIGNATURE = self.file_signature
+
+    def test_get_shard(self):
+        self.assertEqual(
+            helpers.get_shard('04c8f5c392a8d2b6ac86ad4e4c1dc5884a3ac317'),
+            '04/c8')
+
+    def test_url_matches_regex(self):
+        proxy = helpers.get_thumbnail_proxy(
+            'animals/kitten.jpg', '100x100', 'crop', '.jpg')
+        match = re.match(
+            self.defaults.signature_regex(self.defaults.FILE_SIGNATURE),
+            proxy.url[len(proxy.base_url):])
+        thumbnail = helpers.get_thumbnail(**match.groupdict())
+        self.assertEqual(
+            thumbnail.name,
+            '%s/animals/kitten.jpg/100x100/crop/%s.jpg' % (
+                proxy.shard, proxy.secret))
+
+    def test_shard_mismatch(self):
+        proxy = helpers.get_thumbnail_proxy(
+            'animals/kitten.jpg', '100x100', 'crop', '.jpg')
+        self.assertRaises(
+            exceptions.InvalidSecretError,
+            helpers.get_thumbnail, 'animals/kitten.jpg', '100x100', 'crop',
+            '.jpg', proxy.secret, shard='00/00')
+
+
+class SizeLadderTestCase(TestCase):
+    def setUp(self):
+        from restthumbnails import defaults
+        self.defaults = defaults
+        self.size_ladder = defaults.SIZE_LADDER
+        defaults.SIZE_LADDER = (400, 100, 200)
+
+    def tearDown(self):
+        self.defaults.SIZE_LADDER = self.size_ladder
+
+    def test_snap_size(self):
+        for size, snapped in [
+                ((100, 100), (100, 100)),
+                ((198, 0), (200, 0)),
+                ((0, 150), (0, 200)),
+                ((300, 150), (400, 200)),
+                ((120, 90), (200, 150)),
+                ((1000, 500), (400, 200)),
+                ((50, 50), (100, 100))]:
+            self.assertEqual(
+                helpers.snap_size(size, self.defaults.SIZE_LADDER),
+                snapped)
+
+    def test_proxy_size_is_snapped(self):
+        proxy = helpers.get_thumbnail_proxy(
+            'animals/kitten.jpg', '150x', 'scale', '.jpg')
+        self.assertEqual(
+            proxy.size_string,
+            '200x0')
+        self.assertEqual(
+            proxy.url,
+            helpers.get_thumbnail_proxy(
+                'animals/kitten.jpg', '200x', 'scale', '.jpg').url)
+
+    def test_srcset_scales_are_snapped(self):
+        srcset = helpers.get_thumbnail_srcset(
+            'animals/kitten.jpg', '150x150', 'crop', '.jpg', (1, 1.5, 2, 3))
+        self.assertEqual(
+            [thumbnail.size_string for thumbnail in srcset],
+            ['200x200', '400x400'])
+
+    def test_srcset_density_of_snapped_scales(self):
+        srcset = helpers.get_thumbnail_srcset(
+            'animals/kitten.jpg', '150x150', 'crop', '.jpg', (1, 1.5, 2))
+        # Relative to the requested size, not to the snapped one
+        self.assertEqual(
+            [entry.rsplit(' ', 1)[1] for entry in srcset.srcset.split(', ')],
+            ['1.33x', '2.67x'])
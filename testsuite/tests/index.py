@@ -0,0 +1,228 @@
+from django.core.management import call_command
+from django.test.utils import override_settings
+from django.utils import unittest
+
+from restthumbnails import defaults, index, processors
+from restthumbnails.files import ThumbnailFile
+from restthumbnails.index import SourceIndex, SourceInfo
+from restthumbnails.proxies import ThumbnailProxy
+
+from testsuite.tests.utils import StorageTestCase
+
+import os
+import shutil
+import StringIO
+import tempfile
+
+
+class SourceIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'sources.idx')
+        self.index = SourceIndex(self.path)
+        self.info = SourceInfo(500, 342, 'JPEG', None)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_empty(self):
+        self.assertEqual(
+            self.index.get('animals/kitten.jpg'),
+            None)
+        self.assertEqual(
+            len(self.index),
+            0)
+
+    def test_add(self):
+        self.assertTrue(
+            self.index.add('animals/kitten.jpg', self.info))
+        self.assertEqual(
+            self.index.get('animals/kitten.jpg'),
+            self.info)
+        self.assertIn(
+            'animals/kitten.jpg',
+            self.index)
+        # Unchanged sources aren't appended again
+        self.assertFalse(
+            self.index.add('animals/kitten.jpg', self.info))
+
+    def test_last_record_wins(self):
+        self.index.add('animals/kitten.jpg', self.info)
+        info = SourceInfo(342, 500, 'JPEG', 6)
+        self.assertTrue(
+            self.index.add('animals/kitten.jpg', info))
+        self.assertEqual(
+            self.index.get('animals/kitten.jpg'),
+            info)
+        self.assertEqual(
+            SourceIndex(self.path).get('animals/kitten.jpg'),
+            info)
+
+    def test_unicode_source(self):
+        self.index.add(u'animals/g\xe2teau.jpg', self.info)
+        self.assertEqual(
+            SourceIndex(self.path).get(u'animals/g\xe2teau.jpg'),
+            self.info)
+
+    def test_records_appended_by_other_processes(self):
+        self.index.get('animals/kitten.jpg')
+        SourceIndex(self.path).add('animals/kitten.jpg', self.info)
+        self.assertEqual(
+            self.index.get('animals/kitten.jpg'),
+            self.info)
+
+    def test_partial_records_are_skipped(self):
+        self.index.add('animals/kitten.jpg', self.info)
+        record = index.pack('animals/puppy.jpg', self.info)
+        with open(self.path, 'ab') as f:
+            f.write(record[:-3])
+        reader = SourceIndex(self.path)
+        self.assertEqual(
+            len(reader),
+            1)
+        with open(self.path, 'ab') as f:
+            f.write(record[-3:])
+        self.assertEqual(
+            reader.get('animals/puppy.jpg'),
+            self.info)
+
+    def test_placeholder(self):
+        info = self.info._replace(placeholder='\xff\xd8\x00\xff')
+        self.index.add('animals/kitten.jpg', info)
+        self.assertEqual(
+            SourceIndex(self.path).get('animals/kitten.jpg'),
+            info)
+
+    def test_unknown_fields_are_skipped(self):
+        self.info = self.info._replace(placeholder='\xff\xd8')
+        record = index.pack('animals/kitten.jpg', self.info)
+        extra = index.STRING_LENGTH.pack(3) + 'foo'
+        length, = index.RECORD_LENGTH.unpack_from(record)
+        record = (index.RECORD_LENGTH.pack(length + len(extra)) +
+            record[index.RECORD_LENGTH.size:] + extra)
+        with open(self.path, 'wb') as f:
+            f.write(record * 2)
+        self.assertEqual(
+            self.index.get('animals/kitten.jpg'),
+            self.info)
+
+
+class SourceIndexIntegrationTest(StorageTestCase):
+    def setUp(self):
+        super(SourceIndexIntegrationTest, self).setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.settings = override_settings(
+            THUMBNAILS_SOURCE_INDEX=os.path.join(self.tmp, 'sources.idx'))
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.tmp)
+        super(SourceIndexIntegrationTest, self).tearDown()
+
+    def test_generate_adds_source(self):
+        ThumbnailFile('pil_tests/1.jpg', '100x100', 'crop', '.jpg').generate()
+        # The header size is indexed, not the size it was decoded at
+        info = defaults.source_index().get('pil_tests/1.jpg')
+        self.assertEqual(
+            info[:4],
+            (2048, 1536, 'JPEG', 1))
+        placeholder = processors.Image.open(StringIO.StringIO(info.placeholder))
+        self.assertEqual(
+            placeholder.size,
+            (20, 15))
+        self.assertTrue(
+            len(info.placeholder) < 1024)
+
+    def test_placeholder_is_made_once(self):
+        ThumbnailFile('animals/kitten.jpg', '100x100', 'crop', '.jpg').generate()
+        size = os.path.getsize(defaults.source_index().path)
+        ThumbnailFile('animals/kitten.jpg', '50x50', 'crop', '.jpg').generate()
+        self.assertEqual(
+            os.path.getsize(defaults.source_index().path),
+            size)
+
+    def test_proxy_placeholder(self):
+        proxy = ThumbnailProxy(source='animals/kitten.jpg', size='100x100',
+            method='crop', extension='.jpg')
+        self.assertEqual(
+            proxy.placeholder,
+            None)
+        ThumbnailFile('animals/kitten.jpg', '100x100', 'crop', '.jpg').generate()
+        proxy = ThumbnailProxy(source='animals/kitten.jpg', size='100x100',
+            method='crop', extension='.jpg')
+        self.assertTrue(
+            proxy.placeholder.startswith('data:image/jpeg;base64,/9j/'))
+
+    def test_oriented_placeholder(self):
+        im = processors.Image.new('RGB', (60, 40))
+        self.assertEqual(
+            processors.Image.open(StringIO.StringIO(
+                processors.get_placeholder(im, 20, 6))).size,
+            (13, 20))
+
+    def test_proxy_dimensions(self):
+        self.assertEqual(
+            ThumbnailProxy(source='animals/kitten.jpg', size='100x100',
+                method='crop', extension='.png').dimensions,
+            None)
+        for size, method in (('100x100', 'crop'), ('100x100', 'scale'),
+                             ('120x', 'scale'), ('x40', 'scale'),
+                             ('90x60', 'smart'), ('1000x1000', 'crop')):
+            thumbnail = ThumbnailFile('animals/kitten.jpg', size, method,
+                '.png')
+            thumbnail.generate()
+            proxy = ThumbnailProxy(source='animals/kitten.jpg', size=size,
+                method=method, extension='.png')
+            f = thumbnail.storage.open(thumbnail.name)
+            try:
+                self.assertEqual(
+                    (proxy.width, proxy.height),
+                    processors.Image.open(f).size)
+            finally:
+                f.close()
+
+    def test_oriented_source(self):
+        defaults.source_index().add('animals/kitten.jpg',
+            SourceInfo(342, 500, 'JPEG', 6))
+        proxy = ThumbnailProxy(source='animals/kitten.jpg', size='100x',
+            method='scale', extension='.jpg')
+        self.assertEqual(
+            proxy.dimensions,
+            (100, 68))
+
+    def test_index_sources(self):
+        stdout = StringIO.StringIO()
+        call_command('index_sources', workers=1, stdout=stdout)
+        self.assertIn(
+            '3 files, 3 added',
+            stdout.getvalue())
+        self.assertEqual(
+            defaults.source_index().get('pil_tests/2.jpg'),
+            SourceInfo(1920, 1080, 'JPEG', None))
+        stdout = StringIO.StringIO()
+        call_command('index_sources', workers=1, stdout=stdout)
+        self.assertIn(
+            '0 files',
+            stdout.getvalue())
+        stdout = StringIO.StringIO()
+        call_command('index_sources', workers=1, placeholders=True,
+            stdout=stdout)
+        self.assertIn(
+            '3 files, 3 added',
+            stdout.getvalue())
+        self.assertTrue(
+            defaults.source_index().get('pil_tests/2.jpg').placeholder)
+
+    def test_refresh_keeps_placeholders(self):
+        call_command('index_sources', workers=1, placeholders=True,
+            stdout=StringIO.StringIO())
+        placeholder = defaults.source_index().get('pil_tests/2.jpg').placeholder
+        stdout = StringIO.StringIO()
+        call_command('index_sources', workers=1, refresh=True, stdout=stdout)
+        self.assertIn(
+            '3 files, 0 added',
+            stdout.getvalue())
+        self.assertEqual(
+            defaults.source_index().get('pil_tests/2.jpg').placeholder,
+            placeholder)
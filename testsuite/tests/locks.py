@@ -0,0 +1,101 @@
+from restthumbnails import locks
+from restthumbnails.files import ThumbnailFile
+
+from testsuite.tests.utils import StorageTestCase
+
+import os
+import time
+
+
+class LockTestBase(object):
+    lock_class = None
+
+    def setUp(self):
+        super(LockTestBase, self).setUp()
+        self.thumbnail = ThumbnailFile(
+            'animals/kitten.jpg',
+            '100x100',
+            'crop',
+            '.jpg')
+
+    def test_acquire_is_exclusive(self):
+        lock = self.lock_class(self.thumbnail, 10)
+        other = self.lock_class(self.thumbnail, 10)
+        self.assertTrue(
+            lock.acquire())
+        self.assertTrue(
+            other.locked())
+        self.assertFalse(
+            other.acquire())
+        lock.release()
+        self.assertFalse(
+            other.locked())
+        self.assertTrue(
+            other.acquire())
+        other.release()
+
+    def test_release_without_acquire(self):
+        lock = self.lock_class(self.thumbnail, 10)
+        other = self.lock_class(self.thumbnail, 10)
+        self.assertTrue(
+            lock.acquire())
+        other.release()
+        self.assertTrue(
+            other.locked())
+        lock.release()
+
+
+class CacheLockTest(LockTestBase, StorageTestCase):
+    lock_class = locks.CacheLock
+
+
+class FileLockTest(LockTestBase, StorageTestCase):
+    lock_class = locks.FileLock
+
+    def test_break_stale_lock(self):
+        lock = self.lock_class(self.thumbnail, 10)
+        self.assertTrue(
+            lock.acquire())
+        stale = time.time() - 60
+        os.utime(lock.path, (stale, stale))
+        other = self.lock_class(self.thumbnail, 10)
+        self.assertFalse(
+            other.locked())
+        self.assertTrue(
+            other.acquire())
+        other.release()
+
+    def test_two_workers_break_stale_lock(self):
+        lock = self.lock_class(self.thumbnail, 10)
+        self.assertTrue(
+            lock.acquire())
+        stale = time.time() - 60
+        os.utime(lock.path, (stale, stale))
+        second = self.lock_class(self.thumbnail, 10)
+        results = []
+
+        class FirstLock(self.lock_class):
+            def _is_stale(self):
+                stale = super(FirstLock, self)._is_stale()
+                # The second worker breaks the lock right after the first
+                # one found it stale
+                if stale and not results:
+                    results.append(second.acquire())
+                return stale
+
+        first = FirstLock(self.thumbnail, 10)
+        self.assertFalse(
+            first.acquire())
+        self.assertEqual(
+            results,
+            [True])
+        self.assertTrue(
+            first.locked())
+        self.assertEqual(
+            os.listdir(os.path.dirname(lock.path)),
+            [os.path.basename(lock.path)])
+        second.release()
+
+
+class LocalLockTest(LockTestBase, StorageTestCase):
+    lock_class = locks.LocalLock
@@ -0,0 +1,167 @@
+from django.test.utils import override_settings
+from django.utils import unittest
+
+from restthumbnails import defaults, metrics, signals
+from restthumbnails.files import ThumbnailFile
+
+from testsuite.tests.views import ResponseBackendTestBase
+
+import json
+import socket
+
+
+class MemorySinkTest(unittest.TestCase):
+    def setUp(self):
+        self.sink = metrics.MemorySink()
+
+    def test_counters(self):
+        self.sink.incr('view.hit')
+        self.sink.incr('view.hit', 2)
+        self.assertEqual(
+            self.sink.stats()['counters'],
+            {'view.hit': 3})
+
+    def test_gauges(self):
+        self.sink.gauge('queue.pending.batch', 3)
+        self.sink.gauge('queue.pending.batch', 2)
+        self.assertEqual(
+            self.sink.stats()['gauges'],
+            {'queue.pending.batch': 2})
+
+    def test_histograms(self):
+        self.sink.timing('generate.decode', 0.0005)
+        self.sink.timing('generate.decode', 0.015)
+        self.sink.timing('generate.decode', 60)
+        histogram = self.sink.stats()['timings']['generate.decode']
+        self.assertEqual(
+            histogram['count'],
+            3)
+        self.assertEqual(
+            histogram['max'],
+            60000)
+        self.assertEqual(
+            histogram['buckets']['1'],
+            1)
+        self.assertEqual(
+            histogram['buckets']['20'],
+            1)
+        self.assertEqual(
+            histogram['buckets']['+Inf'],
+            1)
+        self.assertEqual(
+            sum(histogram['buckets'].values()),
+            3)
+
+
+class StatsdSinkTest(unittest.TestCase):
+    def setUp(self):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.settimeout(5)
+        self.sink = metrics.StatsdSink(port=self.server.getsockname()[1])
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_timing(self):
+        self.sink.timing('generate.decode', 0.0123)
+        self.assertEqual(
+            self.server.recv(512),
+            'restthumbnails.generate.decode:12|ms')
+
+    def test_incr(self):
+        self.sink.incr('view.hit')
+        self.assertEqual(
+            self.server.recv(512),
+            'restthumbnails.view.hit:1|c')
+
+    def test_gauge(self):
+        self.sink.gauge('queue.pending.batch', 3)
+        self.assertEqual(
+            self.server.recv(512),
+            'restthumbnails.queue.pending.batch:3|g')
+
+
+@override_settings(THUMBNAILS_METRICS_SINK='restthumbnails.metrics.MemorySink')
+class InstrumentationTest(ResponseBackendTestBase):
+    def setUp(self):
+        super(InstrumentationTest, self).setUp()
+        self.received = []
+        signals.timing.connect(self.receive)
+        signals.counter.connect(self.receive)
+
+    def tearDown(self):
+        signals.timing.disconnect(self.receive)
+        signals.counter.disconnect(self.receive)
+        super(InstrumentationTest, self).tearDown()
+
+    def receive(self, signal, sender, name, **kwargs):
+        self.received.append(name)
+
+    def test_generate_stages(self):
+        ThumbnailFile(
+            'animals/kitten.jpg',
+            '100x100',
+            'crop',
+            '.jpg').generate()
+        stats = defaults.metrics_sink().stats()
+        for stage in ('open', 'decode', 'scale_and_crop', 'colorspace',
+                      'encode', 'write'):
+            self.assertEqual(
+                stats['timings']['generate.%s' % stage]['count'],
+                1)
+        self.assertTrue(
+            stats['counters']['generate.pixels'] > 0)
+        self.assertTrue(
+            stats['counters']['generate.bytes'] > 0)
+        self.assertIn(
+            'generate.decode',
+            self.received)
+
+    def test_view_counters(self):
+        self.get(
+            source='animals/kitten.jpg',
+            size='100x100',
+            method='crop',
+            extension='.jpg')
+        self.get(
+            source='animals/kitten.jpg',
+            size='100x100',
+            method='crop',
+            extension='.jpg')
+        self.get(
+            source='animals/puppy.jpg',
+            size='100x100',
+            method='crop',
+            extension='.jpg')
+        self.get(
+            source='animals/kitten.jpg',
+            size='100x100',
+            method='crop',
+            extension='.jpg',
+            secret='derp')
+        stats = defaults.metrics_sink().stats()
+        self.assertEqual(
+            stats['counters'],
+            {'view.miss': 1, 'view.hit': 1, 'view.not_found': 1,
+             'view.unauthorized': 1})
+        self.assertEqual(
+            stats['timings']['view.request']['count'],
+            4)
+
+    def test_stats_view(self):
+        defaults.metrics_sink().incr('view.hit')
+        response = self.client.get('/stats/')
+        self.assertEqual(
+            response['Content-Type'],
+            'application/json')
+        self.assertEqual(
+            json.loads(response.content)['counters'],
+            {'view.hit': 1})
+
+
+class StatsViewTest(ResponseBackendTestBase):
+    def test_404_without_memory_sink(self):
+        self.assertEqual(
+            self.client.get('/stats/').status_code,
+            404)
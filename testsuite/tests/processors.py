@@ -0,0 +1,310 @@
+from django.test import TestCase
+
+from restthumbnails import processors
+from restthumbnails.processors import Image, ImageChops
+
+from StringIO import StringIO
+
+import os
+import re
+import struct
+
+
+MEDIA_ROOT = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'media')
+
+
+def legacy_scale_and_crop(im, size, crop=False, upscale=True):
+    """
+    scale_and_crop, before it was changed to only resample the region kept
+    by crops.
+    """
+    source_x, source_y = [float(v) for v in im.size]
+    target_x, target_y = [float(v) for v in size]
+    scale = processors._scale(im.size, size, crop)
+
+    # Handle one-dimensional targets.
+    if not target_x:
+        target_x = source_x * scale
+    elif not target_y:
+        target_y = source_y * scale
+
+    if scale < 1.0 or (scale > 1.0 and upscale):
+        # Resize the image to the target size boundary. Round the scaled
+        # boundary sizes to avoid floating point errors.
+        im = im.resize((int(round(source_x * scale)),
+                        int(round(source_y * scale))),
+                       resample=Image.ANTIALIAS)
+
+    if crop:
+        # Use integer values now.
+        source_x, source_y = im.size
+        # Difference between new image size and requested size.
+        diff_x = int(source_x - min(source_x, target_x))
+        diff_y = int(source_y - min(source_y, target_y))
+        if diff_x or diff_y:
+            # Center cropping (default).
+            halfdiff_x, halfdiff_y = diff_x // 2, diff_y // 2
+            box = [halfdiff_x, halfdiff_y,
+                   min(source_x, int(target_x) + halfdiff_x),
+                   min(source_y, int(target_y) + halfdiff_y)]
+            # See if an edge cropping argument was provided.
+            edge_crop = (isinstance(crop, basestring) and
+                         re.match(r'(?:(-?)(\d+))?,(?:(-?)(\d+))?$', crop))
+            if edge_crop and filter(None, edge_crop.groups()):
+                x_right, x_crop, y_bottom, y_crop = edge_crop.groups()
+                if x_crop:
+                    offset = min(int(target_x) * int(x_crop) // 100, diff_x)
+                    if x_right:
+                        box[0] = diff_x - offset
+                        box[2] = source_x - offset
+                    else:
+                        box[0] = offset
+                        box[2] = source_x - (diff_x - offset)
+                if y_crop:
+                    offset = min(int(target_y) * int(y_crop) // 100, diff_y)
+                    if y_bottom:
+                        box[1] = diff_y - offset
+                        box[3] = source_y - offset
+                    else:
+                        box[1] = offset
+                        box[3] = source_y - (diff_y - offset)
+            # See if the image should be "smart cropped".
+            elif crop == 'smart':
+                box = processors._smart_crop_box(im, diff_x, diff_y)
+            # Finally, crop the image!
+            if crop != 'scale':
+                im = im.crop(box)
+    return im
+
+
+class NonSeekableFile(object):
+    def __init__(self, file):
+        self.file = file
+
+    def read(self, *args):
+        return self.file.read(*args)
+
+
+class GetImageTestCase(TestCase):
+    def open(self, path):
+        return open(os.path.join(MEDIA_ROOT, path), 'rb')
+
+    def test_full_decode_without_size(self):
+        im = processors.get_image(self.open('pil_tests/1.jpg'))
+        self.assertEqual(
+            im.size,
+            (2048, 1536))
+
+    def test_draft_decode_for_downscale(self):
+        im = processors.get_image(
+            self.open('pil_tests/1.jpg'), size=(100, 100), crop='crop')
+        self.assertEqual(
+            im.size,
+            (256, 192))
+        im = processors.scale_and_crop(im, (100, 100), 'crop')
+        self.assertEqual(
+            im.size,
+            (100, 100))
+
+    def test_no_draft_on_upscale(self):
+        im = processors.get_image(
+            self.open('animals/kitten.jpg'), size=(1000, 1000), crop='crop')
+        self.assertEqual(
+            im.size,
+            (500, 342))
+
+    def test_spool_non_seekable_source(self):
+        source = self.open('animals/kitten.jpg')
+        im = processors.get_image(NonSeekableFile(source))
+        self.assertEqual(
+            im.size,
+            (500, 342))
+
+
+class SaveImageTestCase(TestCase):
+    def test_save_single_copy(self):
+        im = processors.get_image(
+            open(os.path.join(MEDIA_ROOT, 'animals/kitten.jpg'), 'rb'))
+        content = processors.save_image(im)
+        data = ''.join(content.chunks())
+        self.assertEqual(
+            len(data),
+            content.size)
+        self.assertEqual(
+            data.count('\xff\xd8\xff'),
+            1)
+
+
+class SaveImageOptionsTestCase(TestCase):
+    def setUp(self):
+        self.im = processors.get_image(
+            open(os.path.join(MEDIA_ROOT, 'animals/kitten.jpg'), 'rb'))
+
+    def test_progressive_jpeg(self):
+        content = processors.save_image(self.im, 'JPEG', progressive=True)
+        self.assertTrue(
+            Image.open(content).info.get('progressive'))
+
+    def test_png(self):
+        content = processors.save_image(self.im, 'PNG')
+        self.assertEqual(
+            Image.open(content).format,
+            'PNG')
+
+
+class SmartCropTestCase(TestCase):
+    sizes = [(100, 100), (400, 400), (300, 900), (900, 200)]
+
+    def setUp(self):
+        self.im = processors.get_image(
+            open(os.path.join(MEDIA_ROOT, 'pil_tests/2.jpg'), 'rb'))
+
+    def boxes(self, proxy_size=None):
+        boxes = []
+        for size in self.sizes:
+            im = processors.scale_and_crop(self.im, size, 'scale')
+            diff_x = im.size[0] - min(im.size[0], size[0])
+            diff_y = im.size[1] - min(im.size[1], size[1])
+            boxes.append((im.size, processors._smart_crop_box(
+                im, diff_x, diff_y, proxy_size)))
+        return boxes
+
+    def test_same_box_without_numpy(self):
+        boxes = self.boxes()
+        numpy, processors.numpy = processors.numpy, None
+        try:
+            self.assertEqual(
+                self.boxes(),
+                boxes)
+        finally:
+            processors.numpy = numpy
+
+    def test_proxy_box_tolerance(self):
+        for (size, box), (proxy_size, proxy_box) in zip(
+                self.boxes(), self.boxes(200)):
+            self.assertEqual(
+                (box[2] - box[0], box[3] - box[1]),
+                (proxy_box[2] - proxy_box[0], proxy_box[3] - proxy_box[1]))
+            self.assertTrue(
+                abs(box[0] - proxy_box[0]) <= max(size) * 0.1)
+            self.assertTrue(
+                abs(box[1] - proxy_box[1]) <= max(size) * 0.1)
+
+
+class ScaleAndCropTestCase(TestCase):
+    def test_same_as_legacy(self):
+        for path in ('pil_tests/2.jpg', 'animals/kitten.jpg'):
+            im = processors.get_image(
+                open(os.path.join(MEDIA_ROOT, path), 'rb'))
+            for size in ((100, 100), (50, 300), (0, 100), (1000, 1000)):
+                for crop in ('crop', '0,0', '-10,-0', ',0', 'scale', 'smart'):
+                    for upscale in (True, False):
+                        image = processors.scale_and_crop(
+                            im, size, crop, upscale)
+                        expected = legacy_scale_and_crop(
+                            im, size, crop, upscale)
+                        self.assertEqual(
+                            image.size,
+                            expected.size)
+                        # Resampling only the kept region gives the same
+                        # pixels, save for rounding.
+                        diff = ImageChops.difference(image, expected)
+                        self.assertTrue(
+                            max(band[1] for band in diff.getextrema()) <= 2)
+
+
+class OrientationTestCase(TestCase):
+    # Operations storing an upright image with each EXIF orientation value
+    inverse = {
+        2: Image.FLIP_LEFT_RIGHT,
+        3: Image.ROTATE_180,
+        4: Image.FLIP_TOP_BOTTOM,
+        5: Image.TRANSPOSE,
+        6: Image.ROTATE_90,
+        7: Image.TRANSVERSE,
+        8: Image.ROTATE_270,
+    }
+
+    def setUp(self):
+        self.im = processors.get_image(
+            open(os.path.join(MEDIA_ROOT, 'animals/kitten.jpg'), 'rb'))
+
+    def exif(self, orientation):
+        return ('Exif\x00\x00II*\x00' + struct.pack('<IHHHIHHI',
+            8, 1, 0x0112, 3, 1, orientation, 0, 0))
+
+    def assertSimilar(self, image, expected):
+        self.assertEqual(
+            image.size,
+            expected.size)
+        # Transposing before or after resampling only changes the rounding,
+        # so the mean difference stays below one level per band.
+        histogram = ImageChops.difference(image, expected).histogram()
+        pixels = image.size[0] * image.size[1]
+        for band in range(0, len(histogram), 256):
+            self.assertTrue(
+                sum(i * n for i, n in enumerate(histogram[band:band + 256]))
+                < pixels)
+
+    def test_transpose(self):
+        for orientation, method in self.inverse.items():
+            raw = self.im.transpose(method)
+            self.assertEqual(
+                processors._transpose(raw, orientation).tobytes(),
+                self.im.tobytes())
+
+    def test_scale_and_crop(self):
+        for orientation, method in self.inverse.items():
+            raw = self.im.transpose(method)
+            for size in ((100, 100), (50, 300), (0, 100), (1000, 1000)):
+                for crop in ('crop', '0,0', '-10,-0', 'scale'):
+                    self.assertSimilar(
+                        processors.scale_and_crop(raw, size, crop,
+                            orientation=orientation),
+                        processors.scale_and_crop(self.im, size, crop))
+
+    def test_scale_and_crop_many(self):
+        sizes = [((100, 100), 'crop'), ((200, 0), 'scale'), ((50, 300), '0,0')]
+        raw = self.im.transpose(Image.ROTATE_90)
+        images = processors.scale_and_crop_many(raw, sizes, orientation=6)
+        for (size, crop), image in zip(sizes, images):
+            self.assertSimilar(
+                image,
+                processors.scale_and_crop(self.im, size, crop))
+
+    def test_get_image(self):
+        source = StringIO()
+        self.im.transpose(Image.ROTATE_90).save(
+            source, 'JPEG', exif=self.exif(6))
+        source.seek(0)
+        im = processors.get_image(source, exif_orientation=False,
+                                  size=(100, 100), crop='crop')
+        self.assertEqual(
+            (im.size, processors.get_orientation(im)),
+            ((171, 250), 6))
+        source.seek(0)
+        self.assertEqual(
+            processors.get_image(source).size,
+            (500, 342))
+
+
+class ScaleAndCropManyTestCase(TestCase):
+    def test_same_sizes_as_scale_and_crop(self):
+        im = processors.get_image(
+            open(os.path.join(MEDIA_ROOT, 'pil_tests/2.jpg'), 'rb'))
+        sizes = [
+            ((100, 100), 'crop'),
+            ((640, 0), 'scale'),
+            ((1000, 1000), 'smart'),
+            ((200, 150), 'crop'),
+            ((4000, 0), 'scale')]
+        images = processors.scale_and_crop_many(im, sizes)
+        for (size, crop), image in zip(sizes, images):
+            expected = processors.scale_and_crop(im, size, crop)
+            self.assertEqual(
+                image.size,
+                expected.size)
+            diff = ImageChops.difference(image, expected)
+            self.assertTrue(
+                max(band[1] for band in diff.getextrema()) < 16)
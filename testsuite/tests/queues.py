@@ -0,0 +1,349 @@
+from django.core.management import call_command
+from django.test.utils import override_settings
+
+from restthumbnails import defaults, exceptions, executors, queues
+from restthumbnails.files import ThumbnailFile
+
+from testsuite.tests.utils import StorageTestCase
+
+import shutil
+import StringIO
+import tempfile
+import threading
+import time
+
+
+class QueueTestBase(object):
+    def get_queue(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        super(QueueTestBase, self).setUp()
+        self.queue = self.get_queue()
+        self.thumbnail = ThumbnailFile(
+            'animals/kitten.jpg',
+            '100x100',
+            'crop',
+            '.jpg')
+        self.job = queues.get_job(self.thumbnail)
+
+    def test_put_deduplicates_jobs(self):
+        self.assertTrue(
+            self.queue.put(self.job))
+        self.assertFalse(
+            self.queue.put(self.job))
+        self.assertEqual(
+            self.queue.depth(),
+            1)
+        self.assertEqual(
+            self.queue.status(self.thumbnail.key),
+            (queues.PENDING, None, None))
+
+    def test_get_claims_jobs_once(self):
+        self.queue.put(self.job)
+        job = self.queue.get()
+        self.assertEqual(
+            job['key'],
+            self.thumbnail.key)
+        self.assertEqual(
+            job['source'],
+            'animals/kitten.jpg')
+        self.assertEqual(
+            self.queue.get(),
+            None)
+        self.assertEqual(
+            self.queue.status(self.thumbnail.key)[0],
+            queues.RUNNING)
+        # Running jobs aren't queued again
+        self.assertFalse(
+            self.queue.put(self.job))
+
+    def test_get_returns_oldest_job(self):
+        other = queues.get_job(ThumbnailFile(
+            'animals/kitten.jpg',
+            '50x50',
+            'crop',
+            '.jpg'))
+        self.queue.put(self.job)
+        time.sleep(0.01)
+        self.queue.put(other)
+        self.assertEqual(
+            self.queue.get()['key'],
+            self.job['key'])
+        self.assertEqual(
+            self.queue.get()['key'],
+            other['key'])
+
+    def test_finish(self):
+        self.queue.put(self.job)
+        self.queue.finish(self.queue.get(), result=True)
+        self.assertEqual(
+            self.queue.status(self.thumbnail.key),
+            (queues.DONE, True, None))
+        # Finished jobs can be queued again
+        self.assertTrue(
+            self.queue.put(self.job))
+
+    def test_finish_with_error(self):
+        self.queue.put(self.job)
+        self.queue.finish(self.queue.get(),
+            error=('SourceDoesNotExist', 'animals/kitten.jpg'))
+        self.assertEqual(
+            self.queue.status(self.thumbnail.key),
+            (queues.FAILED, None, ('SourceDoesNotExist', 'animals/kitten.jpg')))
+
+    def test_stale_jobs_are_queued_again(self):
+        self.queue.stale_after = -1
+        self.queue.put(self.job)
+        self.queue.get()
+        self.assertEqual(
+            self.queue.get()['key'],
+            self.thumbnail.key)
+
+    def test_stale_jobs_are_queued_again_with_backlog(self):
+        self.queue.put(self.job)
+        self.queue.get()
+        self.queue.put(self.make_job('10x10', queues.BATCH))
+        self.queue.stale_after = -1
+        self.assertEqual(
+            self.queue.get()['key'],
+            self.thumbnail.key)
+
+    def test_cleanup_interval(self):
+        calls = []
+        cleanup = self.queue.cleanup
+        self.queue.cleanup = lambda: calls.append(True) or cleanup()
+        for size in ('10x10', '20x20', '30x30'):
+            self.queue.put(self.make_job(size, queues.BATCH))
+        for i in range(3):
+            self.queue.get()
+        self.assertEqual(
+            len(calls),
+            1)
+
+    @override_settings(
+        THUMBNAILS_METRICS_SINK='restthumbnails.metrics.MemorySink')
+    def test_depth_gauges(self):
+        self.queue.put(self.make_job('10x10', queues.BATCH))
+        self.queue.put(self.make_job('20x20', queues.BATCH))
+        self.queue.get()
+        gauges = defaults.metrics_sink().stats()['gauges']
+        self.assertEqual(
+            (gauges['queue.pending.batch'], gauges['queue.running.batch']),
+            (2, 0))
+        self.assertEqual(
+            gauges['queue.pending.interactive'],
+            0)
+        # Not again until `report_interval` seconds have passed
+        self.queue.get()
+        self.assertEqual(
+            defaults.metrics_sink().stats()['gauges']['queue.pending.batch'],
+            2)
+
+    def make_job(self, size, priority):
+        return queues.get_job(ThumbnailFile(
+            'animals/kitten.jpg',
+            size,
+            'crop',
+            '.jpg'), priority)
+
+    def test_strict_scheduling(self):
+        self.queue.put(self.make_job('10x10', queues.BATCH))
+        self.queue.put(self.make_job('20x20', queues.PREFETCH))
+        self.queue.put(self.make_job('30x30', queues.INTERACTIVE))
+        self.assertEqual(
+            [self.queue.get()['size'] for i in range(3)],
+            ['30x30', '20x20', '10x10'])
+
+    def test_weighted_scheduling(self):
+        self.queue.scheduling = queues.WEIGHTED
+        self.queue.weights = {queues.INTERACTIVE: 2, queues.BATCH: 1}
+        for size in range(1, 7):
+            self.queue.put(self.make_job('%dx%d' % (size, size), queues.INTERACTIVE))
+            self.queue.put(self.make_job('%dx%d' % (size + 10, size + 10), queues.BATCH))
+        priorities = [self.queue.get()['priority'] for i in range(6)]
+        self.assertEqual(
+            priorities.count(queues.INTERACTIVE),
+            4)
+        self.assertEqual(
+            priorities.count(queues.BATCH),
+            2)
+
+    def test_starving_classes_get_a_job(self):
+        self.queue.max_age = -1
+        self.queue.put(self.make_job('10x10', queues.BATCH))
+        self.queue.put(self.make_job('20x20', queues.INTERACTIVE))
+        self.queue.put(self.make_job('30x30', queues.INTERACTIVE))
+        self.assertEqual(
+            self.queue.get()['size'],
+            '10x10')
+
+    def test_concurrency_limits(self):
+        self.queue.concurrency = {queues.BATCH: 1}
+        self.queue.put(self.make_job('10x10', queues.BATCH))
+        self.queue.put(self.make_job('20x20', queues.BATCH))
+        self.assertEqual(
+            self.queue.get()['size'],
+            '10x10')
+        self.assertEqual(
+            self.queue.get(),
+            None)
+        self.assertEqual(
+            self.queue.stats()['batch'],
+            {'pending': 1, 'running': 1})
+
+    def test_put_promotes_pending_jobs(self):
+        self.queue.put(self.make_job('10x10', queues.INTERACTIVE))
+        self.queue.put(self.make_job('20x20', queues.BATCH))
+        self.assertFalse(
+            self.queue.put(self.make_job('20x20', queues.INTERACTIVE)))
+        self.assertEqual(
+            self.queue.depth(queues.INTERACTIVE),
+            2)
+        self.assertEqual(
+            self.queue.depth(queues.BATCH),
+            0)
+        self.queue.get()
+        self.assertEqual(
+            self.queue.get()['priority'],
+            queues.INTERACTIVE)
+
+    def test_work(self):
+        self.queue.put(self.job)
+        self.assertEqual(
+            queues.work(self.queue, burst=True),
+            1)
+        self.assertTrue(
+            self.thumbnail.exists())
+        self.assertEqual(
+            self.queue.status(self.thumbnail.key),
+            (queues.DONE, True, None))
+
+    def test_work_records_errors(self):
+        job = queues.get_job(ThumbnailFile(
+            'animals/puppy.jpg',
+            '100x100',
+            'crop',
+            '.jpg'))
+        self.queue.put(job)
+        queues.work(self.queue, burst=True)
+        status, result, error = self.queue.status(job['key'])
+        self.assertEqual(
+            status,
+            queues.FAILED)
+        self.assertEqual(
+            error[0],
+            'SourceDoesNotExist')
+
+
+class DatabaseQueueTest(QueueTestBase, StorageTestCase):
+    def get_queue(self):
+        return queues.DatabaseQueue()
+
+
+class SpoolQueueTest(QueueTestBase, StorageTestCase):
+    def get_queue(self):
+        return queues.SpoolQueue(self.tmp)
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        super(SpoolQueueTest, self).setUp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+        super(SpoolQueueTest, self).tearDown()
+
+
+class QueueExecutorTest(StorageTestCase):
+    def setUp(self):
+        super(QueueExecutorTest, self).setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.queue = queues.SpoolQueue(self.tmp)
+        self.executor = executors.QueueExecutor(timeout=0)
+        self.executor.queue = self.queue
+        self.thumbnail = ThumbnailFile(
+            'animals/kitten.jpg',
+            '100x100',
+            'crop',
+            '.jpg')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+        super(QueueExecutorTest, self).tearDown()
+
+    def test_raise_timeout_while_queued(self):
+        self.assertRaises(
+            exceptions.RenderTimeout,
+            self.executor.render, self.thumbnail)
+        self.assertEqual(
+            self.queue.depth(),
+            1)
+
+    def test_wait_for_worker(self):
+        self.executor.timeout = 10
+        worker = threading.Thread(target=queues.work,
+            kwargs={'queue': self.queue, 'max_jobs': 1, 'poll_interval': 0.01})
+        worker.start()
+        try:
+            self.assertTrue(
+                self.executor.render(self.thumbnail))
+        finally:
+            worker.join()
+        self.assertTrue(
+            self.thumbnail.exists())
+
+    def test_raise_worker_exceptions(self):
+        thumbnail = ThumbnailFile(
+            'animals/puppy.jpg',
+            '100x100',
+            'crop',
+            '.jpg')
+        self.assertRaises(
+            exceptions.RenderTimeout,
+            self.executor.render, thumbnail)
+        queues.work(self.queue, burst=True)
+        self.assertRaises(
+            exceptions.SourceDoesNotExist,
+            self.executor.render, thumbnail)
+
+    def test_raise_render_failed_on_unknown_exceptions(self):
+        self.queue.put(queues.get_job(self.thumbnail))
+        self.queue.finish(self.queue.get(), error=('IOError', 'broken'))
+        self.assertRaises(
+            exceptions.RenderFailed,
+            self.executor.render, self.thumbnail)
+
+
+@override_settings(THUMBNAILS_RENDER_QUEUE='restthumbnails.queues.DatabaseQueue')
+class RunThumbnailWorkerTest(StorageTestCase):
+    def test_enqueue(self):
+        stdout = StringIO.StringIO()
+        call_command('generate_thumbnails', '100x100:crop:.jpg',
+            prefix='animals', enqueue=True, stdout=stdout)
+        self.assertIn(
+            '1 queued',
+            stdout.getvalue())
+        queue = defaults.render_queue()
+        self.assertEqual(
+            queue.depth(queues.BATCH),
+            1)
+        stdout = StringIO.StringIO()
+        call_command('runthumbnailworker', stats=True, stdout=stdout)
+        self.assertIn(
+            'batch: 1 pending, 0 running',
+            stdout.getvalue())
+
+    def test_burst(self):
+        thumbnail = ThumbnailFile(
+            'animals/kitten.jpg',
+            '100x100',
+            'crop',
+            '.jpg')
+        defaults.render_queue().put(queues.get_job(thumbnail))
+        stdout = StringIO.StringIO()
+        call_command('runthumbnailworker', burst=True, stdout=stdout)
+        self.assertTrue(
+            thumbnail.exists())
+        self.assertIn(
+            '1 jobs',
+            stdout.getvalue())
@@ -0,0 +1,114 @@
+from django.core.files.base import ContentFile
+from django.test import TestCase
+
+from restthumbnails.storage import CachedMetadataStorage, ThumbnailStorage
+
+from testsuite.tests.utils import StorageTestCase
+
+import threading
+
+
+class CountingStorage(ThumbnailStorage):
+    def __init__(self, *args, **kwargs):
+        super(CountingStorage, self).__init__(*args, **kwargs)
+        self.calls = []
+
+    def exists(self, name):
+        self.calls.append(('exists', name))
+        return super(CountingStorage, self).exists(name)
+
+    def size(self, name):
+        self.calls.append(('size', name))
+        return super(CountingStorage, self).size(name)
+
+
+class ThumbnailStorageTestCase(StorageTestCase):
+    def test_overwrite(self):
+        self.assertEqual(
+            self.storage.save('foo/bar.txt', ContentFile('foo')),
+            'foo/bar.txt')
+        self.assertEqual(
+            self.storage.save('foo/bar.txt', ContentFile('bar')),
+            'foo/bar.txt')
+        self.assertEqual(
+            self.storage.open('foo/bar.txt').read(),
+            'bar')
+        self.assertEqual(
+            self.storage.listdir('foo'),
+            ([], ['bar.txt']))
+
+
+    def test_concurrent_writes(self):
+        content = 'foo' * 100000
+        threads = [threading.Thread(target=self.storage.save,
+                                    args=('foo/bar.txt', ContentFile(content)))
+                   for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(
+            self.storage.listdir('foo'),
+            ([], ['bar.txt']))
+        self.assertEqual(
+            self.storage.size('foo/bar.txt'),
+            300000)
+
+    def test_failed_write(self):
+        class BrokenFile(ContentFile):
+            def chunks(self, *args):
+                yield 'foo'
+                raise IOError
+        self.assertRaises(
+            IOError,
+            self.storage.save, 'foo/bar.txt', BrokenFile('foo'))
+        self.assertEqual(
+            self.storage.listdir('foo'),
+            ([], []))
+
+
+class CachedMetadataStorageTestCase(TestCase):
+    def setUp(self):
+        self.wrapped = CountingStorage()
+        self.storage = CachedMetadataStorage(self.wrapped, 60, max_entries=2)
+
+    def test_cache(self):
+        for i in range(2):
+            self.assertTrue(
+                self.storage.exists('animals/kitten.jpg'))
+            self.assertFalse(
+                self.storage.exists('animals/puppy.jpg'))
+        self.assertEqual(
+            self.wrapped.calls,
+            [('exists', 'animals/kitten.jpg'),
+             ('exists', 'animals/puppy.jpg')])
+
+    def test_timeout(self):
+        self.storage.timeout = 0
+        self.storage.size('animals/kitten.jpg')
+        self.storage.size('animals/kitten.jpg')
+        self.assertEqual(
+            len(self.wrapped.calls),
+            2)
+
+    def test_max_entries(self):
+        self.storage.exists('animals/kitten.jpg')
+        self.storage.size('animals/kitten.jpg')
+        self.storage.exists('animals/puppy.jpg')
+        self.storage.exists('animals/kitten.jpg')
+        self.assertEqual(
+            len(self.wrapped.calls),
+            4)
+
+    def test_forget(self):
+        self.storage.exists('animals/kitten.jpg')
+        self.storage.forget('animals/kitten.jpg')
+        self.storage.exists('animals/kitten.jpg')
+        self.assertEqual(
+            len(self.wrapped.calls),
+            2)
+
+    def test_passthrough(self):
+        self.assertEqual(
+            self.storage.path('animals/kitten.jpg'),
+            self.wrapped.path('animals/kitten.jpg'))
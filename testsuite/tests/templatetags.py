@@ -1,12 +1,19 @@
 from django.template import Context
 from django.test.utils import override_settings
 
-from restthumbnails import exceptions
+from restthumbnails import defaults, exceptions
+from restthumbnails.index import SourceInfo
 from restthumbnails.templatetags.thumbnail import thumbnail as thumbnail_tag
+from restthumbnails.templatetags.thumbnail import (
+    thumbnail_srcset as thumbnail_srcset_tag)
 
 from testsuite.models import ImageModel
 from testsuite.tests.utils import StorageTestCase
 
+import os
+import shutil
+import tempfile
+
 
 class ThumbnailTagTestBase(object):
     def setUp(self):
@@ -31,9 +38,9 @@ class ThumbnailTagTestBase(object):
         self.assertRaises(
             exceptions.ThumbnailError,
             thumbnail_tag, self.ctx, self.source, '200x200', 'foo', '.jpg')
-        # self.assertRaises(
-        #     exceptions.ThumbnailError,
-        #     thumbnail_tag, self.ctx, self.source, '200x200', 'crop', 'foo')
+        self.assertRaises(
+            exceptions.ThumbnailError,
+            thumbnail_tag, self.ctx, self.source, '200x200', 'crop', 'foo')
 
     def test_none_on_empty_source(self):
         self.assertEqual(
@@ -56,6 +63,60 @@ class ThumbnailProxyTest(ThumbnailTagTestBase, StorageTestCase):
             thumb.url,
             '/thumbnails/images/image.jpg/100x100/crop/72ebae3f7fcda69b79bbf1c55ebe22197100e06e.jpg')
 
+    def test_no_instance_dict(self):
+        thumb = thumbnail_tag(
+            context=self.ctx,
+            source=self.source,
+            size='100x100',
+            method='crop',
+            extension='.jpg')
+        self.assertFalse(
+            hasattr(thumb, '__dict__'))
+
+
+@override_settings(THUMBNAILS_PROXY='restthumbnails.proxies.ThumbnailProxy')
+class ThumbnailSrcsetTest(StorageTestCase):
+    def setUp(self):
+        super(ThumbnailSrcsetTest, self).setUp()
+        self.ctx = Context()
+
+    def test_density_descriptors(self):
+        thumbs = thumbnail_srcset_tag(self.ctx, 'animals/kitten.jpg',
+            '100x100', 'crop', '.jpg', '1,1.5,2')
+        urls = [thumb.url for thumb in thumbs]
+        self.assertEqual(
+            [thumb.size_string for thumb in thumbs],
+            ['100x100', '150x150', '200x200'])
+        self.assertEqual(
+            thumbs.src,
+            urls[0])
+        self.assertEqual(
+            thumbs.srcset,
+            '%s 1x, %s 1.5x, %s 2x' % tuple(urls))
+        self.assertEqual(
+            unicode(thumbs),
+            thumbs.srcset)
+
+    def test_width_descriptors(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            with override_settings(
+                    THUMBNAILS_SOURCE_INDEX=os.path.join(tmp, 'sources.idx')):
+                defaults.source_index().add('animals/kitten.jpg',
+                    SourceInfo(500, 342, 'JPEG', None))
+                thumbs = thumbnail_srcset_tag(self.ctx, 'animals/kitten.jpg',
+                    '200x200', 'scale', '.jpg')
+                self.assertEqual(
+                    thumbs.srcset,
+                    '%s 292w, %s 585w' % tuple(thumb.url for thumb in thumbs))
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_none_on_empty_source(self):
+        self.assertEqual(
+            thumbnail_srcset_tag(self.ctx, '', '200x200', 'crop', '.jpg'),
+            None)
+
 
 @override_settings(THUMBNAILS_PROXY='restthumbnails.proxies.DummyImageProxy')
 class DummyImageProxyTest(ThumbnailTagTestBase, StorageTestCase):
@@ -6,3 +6,8 @@ class StorageTestCase(TestCase):
         from restthumbnails import defaults
         self.storage = defaults.storage_backend()
         self.storage.cleanup()
+
+    def tearDown(self):
+        # Don't leave thumbnails behind in the source tree
+        self.storage.cleanup()
+        super(StorageTestCase, self).tearDown()
@@ -1,9 +1,14 @@
 from django.core.cache import cache
 from django.test.client import Client
 from django.test.utils import override_settings
+from django.utils import unittest
+
+from restthumbnails import processors
 
 from testsuite.tests.utils import StorageTestCase
 
+import os
+import threading
 import urlparse
 
 
@@ -12,16 +17,28 @@ class ResponseBackendTestBase(StorageTestCase):
         super(ResponseBackendTestBase, self).setUp()
         self.client = Client()
 
-    def get(self, **kwargs):
+    def get(self, source, size, method, extension, secret=None, **extra):
         from restthumbnails import defaults, helpers
 
-        if 'secret' not in kwargs:
-            kwargs['secret'] = helpers.get_secret(**kwargs)
+        kwargs = dict(
+            source=source,
+            size=size,
+            method=method,
+            extension=extension)
+        if secret is None:
+            secret = helpers.get_secret(**kwargs)
 
         url = urlparse.urljoin(
             defaults.THUMBNAIL_PROXY_BASE_URL,
-            defaults.FILE_SIGNATURE % kwargs)
-        return self.client.get(url)
+            defaults.FILE_SIGNATURE % dict(kwargs, secret=secret))
+        return self.client.get(url, **extra)
+
+    def get_lock(self, **kwargs):
+        from restthumbnails import defaults, helpers
+
+        thumbnail = helpers.get_thumbnail(
+            secret=helpers.get_secret(**kwargs), **kwargs)
+        return defaults.lock_backend()(thumbnail, defaults.LOCK_TIMEOUT)
 
 
 class DefaultBackendTest(object):
@@ -46,6 +63,17 @@ class DefaultBackendTest(object):
             response.status_code,
             400)
 
+    @unittest.skipIf(processors.can_save('AVIF'), "PIL can encode AVIF")
+    def test_400_on_unsupported_format(self):
+        response = self.get(
+            source='animals/kitten.jpg',
+            size='100x100',
+            method='crop',
+            extension='.avif')
+        self.assertEqual(
+            response.status_code,
+            400)
+
     def test_400_on_invalid_method(self):
         response = self.get(
             source='animals/kitten.jpg',
@@ -56,6 +84,148 @@ class DefaultBackendTest(object):
             response.status_code,
             400)
 
+    def test_400_is_cacheable(self):
+        response = self.get(
+            source='animals/kitten.jpg',
+            size='derp',
+            method='crop',
+            extension='.jpg')
+        self.assertIn(
+            'max-age=3600',
+            response['Cache-Control'])
+        self.assertIn(
+            'Expires',
+            response)
+
+    def test_404_on_missing_source(self):
+        from restthumbnails import helpers
+
+        response = self.get(
+            source='animals/puppy.jpg',
+            size='100x100',
+            method='crop',
+            extension='.jpg')
+        self.assertEqual(
+            response.status_code,
+            404)
+        self.assertIn(
+            'max-age=300',
+            response['Cache-Control'])
+        self.assertTrue(
+            cache.get(helpers.get_missing_key('animals/puppy.jpg')))
+        helpers.invalidate_source('animals/puppy.jpg')
+        self.assertIsNone(
+            cache.get(helpers.get_missing_key('animals/puppy.jpg')))
+
+    def test_404_on_cached_missing_source(self):
+        from restthumbnails import helpers
+
+        cache.set(helpers.get_missing_key('animals/kitten.jpg'), True)
+        try:
+            response = self.get(
+                source='animals/kitten.jpg',
+                size='100x100',
+                method='crop',
+                extension='.jpg')
+        finally:
+            helpers.invalidate_source('animals/kitten.jpg')
+        self.assertEqual(
+            response.status_code,
+            404)
+        self.assertFalse(
+            self.storage.exists('animals/kitten.jpg'))
+
+    def test_negotiate_format(self):
+        from restthumbnails import defaults
+
+        negotiate_formats = defaults.NEGOTIATE_FORMATS
+        defaults.NEGOTIATE_FORMATS = ('WEBP',)
+        try:
+            response = self.get(
+                source='animals/kitten.jpg',
+                size='100x100',
+                method='crop',
+                extension='.jpg',
+                HTTP_ACCEPT='image/webp,*/*')
+        finally:
+            defaults.NEGOTIATE_FORMATS = negotiate_formats
+        self.assertEqual(
+            response.status_code,
+            200)
+        self.assertIn(
+            'Accept',
+            response['Vary'])
+        self.assertTrue(
+            self.storage.exists(
+                'animals/kitten.jpg/100x100/crop/38cdd9ad3dda068a81ebd59c113039637c1c8d1d.jpg.webp'))
+
+    def test_access_log(self):
+        from restthumbnails import defaults
+
+        log = os.path.join(self.storage.location, 'access.log')
+        access_log, defaults.ACCESS_LOG = defaults.ACCESS_LOG, log
+        try:
+            for i in range(2):
+                self.get(
+                    source='animals/kitten.jpg',
+                    size='100x100',
+                    method='crop',
+                    extension='.jpg')
+        finally:
+            defaults.ACCESS_LOG = access_log
+        with open(log) as f:
+            self.assertEqual(
+                [line.split(' ', 1)[1] for line in f],
+                ['animals/kitten.jpg/100x100/crop/38cdd9ad3dda068a81ebd59c113039637c1c8d1d.jpg\n'] * 2)
+
+    def test_wait_while_locked(self):
+        kwargs = dict(
+            source='animals/kitten.jpg',
+            size='100x100',
+            method='crop',
+            extension='.jpg')
+        lock = self.get_lock(**kwargs)
+        self.assertTrue(
+            lock.acquire())
+
+        def generate():
+            lock.thumbnail.generate()
+            lock.release()
+
+        timer = threading.Timer(0.2, generate)
+        timer.start()
+        try:
+            response = self.get(**kwargs)
+        finally:
+            timer.join()
+        self.assertEqual(
+            response.status_code,
+            200)
+
+    def test_404_while_locked(self):
+        from restthumbnails import defaults
+
+        kwargs = dict(
+            source='animals/kitten.jpg',
+            size='100x100',
+            method='crop',
+            extension='.jpg')
+        lock = self.get_lock(**kwargs)
+        self.assertTrue(
+            lock.acquire())
+        lock_wait, defaults.LOCK_WAIT = defaults.LOCK_WAIT, 0.1
+        try:
+            response = self.get(**kwargs)
+        finally:
+            defaults.LOCK_WAIT = lock_wait
+            lock.release()
+        self.assertEqual(
+            response.status_code,
+            404)
+        self.assertIn(
+            'max-age=0',
+            response['Cache-Control'])
+
 
 @override_settings(THUMBNAILS_RESPONSE_BACKEND='restthumbnails.responses.nginx.sendfile')
 class NginxBackendTest(DefaultBackendTest, ResponseBackendTestBase):
@@ -92,3 +262,202 @@ class ApacheBackendTest(DefaultBackendTest, ResponseBackendTestBase):
             '/thumbnails/animals/kitten.jpg/100x100/crop/38cdd9ad3dda068a81ebd59c113039637c1c8d1d.jpg')
         self.assertNotIn(
             'Content-Type', response)
+
+
+class SizeLadderTest(ResponseBackendTestBase):
+    def setUp(self):
+        from restthumbnails import defaults
+        super(SizeLadderTest, self).setUp()
+        self.defaults = defaults
+        self.size_ladder = defaults.SIZE_LADDER
+        self.size_ladder_policy = defaults.SIZE_LADDER_POLICY
+        defaults.SIZE_LADDER = (100, 200)
+
+    def tearDown(self):
+        self.defaults.SIZE_LADDER = self.size_ladder
+        self.defaults.SIZE_LADDER_POLICY = self.size_ladder_policy
+        super(SizeLadderTest, self).tearDown()
+
+    def test_off_ladder_sizes_are_rendered_by_default(self):
+        response = self.get(
+            source='animals/kitten.jpg',
+            size='150x150',
+            method='crop',
+            extension='.jpg')
+        self.assertEqual(
+            response.status_code,
+            200)
+
+    def test_reject(self):
+        self.defaults.SIZE_LADDER_POLICY = 'reject'
+        response = self.get(
+            source='animals/kitten.jpg',
+            size='150x150',
+            method='crop',
+            extension='.jpg')
+        self.assertEqual(
+            response.status_code,
+            400)
+        response = self.get(
+            source='animals/kitten.jpg',
+            size='200x200',
+            method='crop',
+            extension='.jpg')
+        self.assertEqual(
+            response.status_code,
+            200)
+
+    def test_redirect(self):
+        from restthumbnails import helpers
+        self.defaults.SIZE_LADDER_POLICY = 'redirect'
+        response = self.get(
+            source='animals/kitten.jpg',
+            size='150x75',
+            method='scale',
+            extension='.jpg')
+        self.assertEqual(
+            response.status_code,
+            302)
+        self.assertEqual(
+            urlparse.urlparse(response['Location']).path,
+            '/thumbnails/animals/kitten.jpg/200x100/scale/%s.jpg' % (
+                helpers.get_secret('animals/kitten.jpg', '200x100', 'scale',
+                                   '.jpg')))
+        self.assertIn(
+            'public',
+            response['Cache-Control'])
+
+
+@override_settings(THUMBNAILS_RESPONSE_BACKEND='restthumbnails.responses.direct.sendfile')
+class DirectBackendTest(DefaultBackendTest, ResponseBackendTestBase):
+    kwargs = dict(
+        source='animals/kitten.jpg',
+        size='100x100',
+        method='crop',
+        extension='.jpg')
+    name = 'animals/kitten.jpg/100x100/crop/38cdd9ad3dda068a81ebd59c113039637c1c8d1d.jpg'
+
+    def content(self):
+        f = self.storage.open(self.name)
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def test_response_headers(self):
+        response = self.get(**self.kwargs)
+        self.assertEqual(
+            response.status_code,
+            200)
+        self.assertEqual(
+            response['Content-Type'],
+            'image/jpeg')
+        self.assertEqual(
+            response['ETag'],
+            '"38cdd9ad3dda068a81ebd59c113039637c1c8d1d-jpeg"')
+        self.assertIn(
+            'immutable',
+            response['Cache-Control'])
+        self.assertIn(
+            'max-age=31536000',
+            response['Cache-Control'])
+        self.assertEqual(
+            response.content,
+            self.content())
+        self.assertEqual(
+            response['Content-Length'],
+            str(len(response.content)))
+
+    def test_not_modified(self):
+        response = self.get(**self.kwargs)
+        for header in ({'HTTP_IF_NONE_MATCH': response['ETag']},
+                       {'HTTP_IF_NONE_MATCH': '"derp", %s' % response['ETag']},
+                       {'HTTP_IF_MODIFIED_SINCE': response['Last-Modified']}):
+            self.assertEqual(
+                self.get(**dict(self.kwargs, **header)).status_code,
+                304)
+        self.assertEqual(
+            self.get(HTTP_IF_NONE_MATCH='"derp"', **self.kwargs).status_code,
+            200)
+
+    def test_range(self):
+        self.get(**self.kwargs)
+        content = self.content()
+        response = self.get(HTTP_RANGE='bytes=10-19', **self.kwargs)
+        self.assertEqual(
+            response.status_code,
+            206)
+        self.assertEqual(
+            response.content,
+            content[10:20])
+        self.assertEqual(
+            response['Content-Range'],
+            'bytes 10-19/%d' % len(content))
+        response = self.get(HTTP_RANGE='bytes=-10', **self.kwargs)
+        self.assertEqual(
+            response.content,
+            content[-10:])
+        response = self.get(HTTP_RANGE='bytes=%d-' % len(content),
+            **self.kwargs)
+        self.assertEqual(
+            response.status_code,
+            416)
+        # The whole file is sent when it changed since the client got a part
+        response = self.get(HTTP_RANGE='bytes=10-19', HTTP_IF_RANGE='"derp"',
+            **self.kwargs)
+        self.assertEqual(
+            response.status_code,
+            200)
+
+    def test_served_from_memory(self):
+        from restthumbnails import defaults
+
+        content = self.get(**self.kwargs).content
+        os.remove(self.storage.path(self.name))
+        # Pretend the file is still there, as checked by the view
+        exists = self.storage.exists
+        self.storage.exists = lambda name: True
+        try:
+            response = self.get(**self.kwargs)
+        finally:
+            self.storage.exists = exists
+        self.assertEqual(
+            response.content,
+            content)
+        self.assertEqual(
+            len(defaults.direct_cache()),
+            1)
+
+    @override_settings(THUMBNAILS_DIRECT_CACHE_SIZE=0)
+    def test_streamed_from_storage(self):
+        response = self.get(HTTP_RANGE='bytes=10-', **self.kwargs)
+        self.assertEqual(
+            response.status_code,
+            206)
+        self.assertEqual(
+            response.content,
+            self.content()[10:])
+
+
+class LRUCacheTest(unittest.TestCase):
+    def test_evict_least_recently_used(self):
+        from restthumbnails.responses.direct import LRUCache
+
+        cache = LRUCache(10, 5)
+        cache.set('a', 'aaaa', 0)
+        cache.set('b', 'bbbb', 0)
+        cache.get('a')
+        cache.set('c', 'cccc', 0)
+        self.assertEqual(
+            cache.get('b'),
+            None)
+        self.assertEqual(
+            cache.get('a'),
+            ('aaaa', 0))
+        cache.set('d', 'dddddd', 0)
+        self.assertEqual(
+            cache.get('d'),
+            None)
+        self.assertEqual(
+            cache.size,
+            8)
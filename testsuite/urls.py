@@ -4,7 +4,10 @@ try:
 except ImportError:
     from django.conf.urls.defaults import patterns, url, include
 
+from restthumbnails.views import StatsView
+
 urlpatterns = patterns('',
+    url(r'^stats/$', StatsView.as_view()),
     # url(r'^media/(?P<path>.*)$', 'django.views.static.serve', {'document_root': settings.MEDIA_ROOT}),
     url(r'^thumbnails/', include('restthumbnails.urls')),
 )